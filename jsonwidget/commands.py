@@ -10,7 +10,8 @@ import os
 import sys
 import jsonwidget
 
-from jsonwidget.jsonnode import JsonNodeError
+from jsonwidget.jsonnode import JsonNodeError, split_json_pointer
+from jsonwidget.schema import SchemaNode, JsonSchemaError
 from jsontypes import schemaformat
 
 def jsonedit():
@@ -28,6 +29,22 @@ def jsonedit():
     parser.add_option("--schemagen", dest="schemagen", action="store_true",
                       default=False,
                       help="Print generated schema to standard output and exit")
+    parser.add_option("--no-journal", dest="journal", action="store_false",
+                      default=True,
+                      help="Don't keep a journal of unsaved edits for " +
+                      "crash recovery")
+    parser.add_option("--collapse-depth", dest="collapsedepth", type="int",
+                      default=None,
+                      help="Start with objects and arrays nested this many " +
+                      "levels deep collapsed")
+    parser.add_option("--collapse-size", dest="collapsesize", type="int",
+                      default=None,
+                      help="Start with objects and arrays with more than " +
+                      "this many children collapsed")
+    parser.add_option("--path", dest="path", default=None,
+                      help="Only load and edit the value at this JSON " +
+                      "Pointer (e.g. /a/b/3), leaving the rest of the " +
+                      "file as it is")
     
     (options, args) = parser.parse_args()
     if not options.tracebacks:
@@ -39,10 +56,21 @@ def jsonedit():
     if len(args) > 1:
         parser.error("Too many arguments." +
                      "  Just one .json file at a time, please.")
+    if options.path is not None:
+        if len(args) == 0:
+            parser.error("--path requires a JSON file")
+        if options.path != "" and not options.path.startswith("/"):
+            parser.error("--path must be a JSON Pointer, starting with /")
     if len(args) == 1:
         jsonfile = args[0]
-        if schemafile is None:
-            schemaobj = jsonwidget.generate_schema(jsonfile)
+        # without a schema, one is derived from the file as it's loaded
+        if schemafile is not None and options.path is not None:
+            # the schema is for the whole file
+            try:
+                schemaobj = SchemaNode(filename=schemafile).get_descendant(
+                    split_json_pointer(options.path))
+            except JsonSchemaError as inst:
+                parser.error(str(inst))
     else:
         jsonfile = None
         if schemafile is None:
@@ -51,14 +79,18 @@ def jsonedit():
     if options.schemagen == True:
         if jsonfile is None:
             parser.error("JSON-formatted required with --schemagen")
-        schemaobj = jsonwidget.generate_schema(jsonfile)
-        print schemaobj.dumps()
+        schemaobj = jsonwidget.generate_schema(jsonfile, pointer=options.path)
+        schemaobj.dump(sys.stdout)
+        print
         sys.exit(0)
 
     progname = "jsonedit " + jsonwidget.__version__
     try:
         jsonwidget.run_editor(jsonfile, schemafile=schemafile, schemaobj=schemaobj,
-                              program_name=progname)
+                              program_name=progname, journal=options.journal,
+                              collapse_depth=options.collapsedepth,
+                              collapse_size=options.collapsesize,
+                              pointer=options.path, background=True)
     except JsonNodeError as inst:
         sys.stderr.writelines(parser.get_prog_name() + " error:\n")
         sys.stderr.writelines(str(inst) + "\n")
@@ -94,16 +126,27 @@ def jsonaddress():
 
 
 def run_editor(jsonfile, schemafile=None, schemaobj=None, 
-               program_name="jsonwidget " + jsonwidget.__version__):
+               program_name="jsonwidget " + jsonwidget.__version__,
+               journal=True, collapse_depth=None, collapse_size=None,
+               pointer=None, background=False):
     """ 
     Run a simple editor with a given jsonfile and corresponding schema file.
+    With pointer set, only the value at that JSON Pointer in jsonfile is 
+    edited, and schemaobj (or schemafile) should describe that value.  With
+    background set, the editor starts right away and loads jsonfile while 
+    it runs.
     """
     
     form = jsonwidget.termedit.JsonFileEditor(jsonfile=jsonfile, 
                                               schemafile=schemafile,
                                               schemaobj=schemaobj,
-                                              program_name=program_name)
-    if schemafile is None:
+                                              program_name=program_name,
+                                              journal=journal,
+                                              collapse_depth=collapse_depth,
+                                              collapse_size=collapse_size,
+                                              pointer=pointer,
+                                              background=background)
+    if schemafile is None and form.get_startup_notification() is None:
         form.set_startup_notification(
             'Using schema derived from json file.  Use "--schema" at startup to provide custom schema')
     form.run()
@@ -127,22 +170,30 @@ def find_system_schema(schemaname):
 
 
 def generate_schema(filename=None, data=None, jsonstring=None, 
-                    version=schemaformat.version):
+                    version=schemaformat.version, pointer=None):
     """
-    Generate a schema from a JSON example.
+    Generate a schema from a JSON example (or from the value at pointer in 
+    it).
     """
     import json
     import jsonwidget.jsonorder
-    if filename is not None:
+    import jsonwidget.jsonscan
+    if filename is None:
+        raise RuntimeError("only filename-based generation is supported")
+    if pointer is None:
         with open(filename, 'r') as f:
             jsonbuffer = f.read()
-        jsondata = json.loads(jsonbuffer)
-        jsonordermap = \
-            jsonwidget.jsonorder.JsonOrderMap(jsonbuffer).get_order_map()
-        return jsonwidget.schema.generate_schema_from_data(jsondata, 
-            jsonordermap=jsonordermap, version=version)
     else:
-        raise RuntimeError("only filename-based generation is supported")
+        try:
+            start, end, jsonbuffer = jsonwidget.jsonscan.read_pointer(
+                filename, pointer)
+        except jsonwidget.jsonscan.JsonScanError as inst:
+            raise JsonNodeError("Error in %s: %s" % (filename, inst))
+    jsondata = json.loads(jsonbuffer)
+    jsonordermap = \
+        jsonwidget.jsonorder.JsonOrderMap(jsonbuffer).get_order_map()
+    return jsonwidget.schema.generate_schema_from_data(jsondata, 
+        jsonordermap=jsonordermap, version=version)
 
 
 def upgradeschema(args):
@@ -158,7 +209,8 @@ usage: %prog upgradeschema oldschema\
     
         schemanode = jsonwidget.schema.SchemaNode(filename=subargs[0])
         schemanode.convert(jsonwidget.jsontypes.schemaformat_v2)
-        print schemanode.dumps()
+        schemanode.dump(sys.stdout)
+        print
         sys.exit(0)
     elif len(subargs)<1:
         subparser.error("old schema file required")
@@ -167,9 +219,14 @@ usage: %prog upgradeschema oldschema\
 
 
 def schemagen(args):
+    import time
+    import jsonwidget.schemagen
     usage = """\
-Create a schema from an example json file
-usage: %prog schemagen [options] jsonfile\
+Create a schema from an example json file, or from many example files
+usage: %prog schemagen [options] jsonfile
+       %prog schemagen [options] (file|directory) ...
+       %prog schemagen [options] --ndjson ndjsonfile ...
+       %prog schemagen [options] --sample N (ndjsonfile|-)\
 """
     subparser = optparse.OptionParser(usage=usage)
     versionhelp = "schema format version to use.  Default: %i" % \
@@ -177,16 +234,89 @@ usage: %prog schemagen [options] jsonfile\
     subparser.add_option("-v", "--version", dest="version", type="int",
                             default=schemaformat.version,
                             help=versionhelp)
+    subparser.add_option("-j", "--jobs", dest="jobs", type="int",
+                            default=None,
+                            help="number of worker processes for sharded " +
+                                 "generation.  Default: one per cpu")
+    subparser.add_option("--ndjson", dest="ndjson", action="store_true",
+                            default=False,
+                            help="input files hold one JSON document per line")
+    subparser.add_option("--shard-size", dest="shardsize", type="int",
+                            default=100,
+                            help="files per shard.  Default: 100")
+    subparser.add_option("--shard-bytes", dest="shardbytes", type="int",
+                            default=8*1024*1024,
+                            help="bytes of ndjson input per shard.  " +
+                                 "Default: 8388608")
+    subparser.add_option("--window", dest="window", type="int",
+                            default=None,
+                            help="stop once this many documents in a row " +
+                                 "leave the schema unchanged")
+    subparser.add_option("--sample", dest="sample", type="int",
+                            default=None,
+                            help="infer the schema from a random sample of " +
+                                 "this many records of a newline-delimited " +
+                                 "file or stream (\"-\" for stdin)")
+    subparser.add_option("--sample-bytes", dest="samplebytes", type="int",
+                            default=None,
+                            help="read at most this many bytes when sampling")
     (options, subargs) = subparser.parse_args(args[1:])
-    if len(subargs)==1:
-        schemaobj = jsonwidget.generate_schema(subargs[0], 
-                                                version=options.version)
-        print schemaobj.dumps()
-        sys.exit(0)
-    elif len(subargs)<1:
+    if len(subargs)<1:
         subparser.error("jsonfile required")
+
+    if options.sample is not None or options.samplebytes is not None:
+        if len(subargs) > 1:
+            subparser.error("only one file at a time when sampling")
+        if subargs[0] == '-':
+            stream = sys.stdin
+        else:
+            stream = open(subargs[0], 'rb')
+        coverage = jsonwidget.schemagen.KeyCoverage()
+        starttime = time.time()
+        try:
+            schemaobj, samplesize, seen, bytesread = \
+                jsonwidget.schemagen.generate_schema_from_sample(
+                    stream, version=options.version, size=options.sample,
+                    bytebudget=options.samplebytes, coverage=coverage)
+        except jsonwidget.schemagen.SchemaGenError as inst:
+            sys.stderr.write(str(inst) + "\n")
+            sys.exit(1)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        sys.stderr.write("sampled %i of %i records (%i bytes read) in %.3fs\n"
+                         % (samplesize, seen, bytesread,
+                            time.time() - starttime))
+        encoding = getattr(sys.stderr, 'encoding', None) or 'utf-8'
+        sys.stderr.write(coverage.format_report(encoding=encoding))
+        schemaobj.dump(sys.stdout)
+        print
+        sys.exit(0)
+
+    sharded = (len(subargs) > 1 or options.ndjson or
+               options.jobs is not None or options.window is not None or
+               os.path.isdir(subargs[0]))
+    if not sharded:
+        schemaobj = jsonwidget.generate_schema(subargs[0],
+                                                version=options.version)
     else:
-        subparser.error("only one file at a time")
+        def report(shardnum, count, elapsed):
+            sys.stderr.write("shard %i: %i documents in %.3fs\n" %
+                             (shardnum, count, elapsed))
+        starttime = time.time()
+        try:
+            schemaobj = jsonwidget.schemagen.generate_schema_from_sources(
+                subargs, version=options.version, jobs=options.jobs,
+                ndjson=options.ndjson, shardsize=options.shardsize,
+                shardbytes=options.shardbytes, window=options.window,
+                report=report)
+        except jsonwidget.schemagen.SchemaGenError as inst:
+            sys.stderr.write(str(inst) + "\n")
+            sys.exit(1)
+        sys.stderr.write("total: %.3fs\n" % (time.time() - starttime))
+    schemaobj.dump(sys.stdout)
+    print
+    sys.exit(0)
 
 
 def json2yaml(args):
@@ -319,6 +449,90 @@ usage: %prog validate [options] jsonfile\
         subparser.error("only one file at a time")
 
 
+def diff(args):
+    import json
+    import sys
+    from jsonwidget.jsondiff import get_diff, format_report
+
+    usage = """\
+Compare two JSON files structurally, printing the differences as a JSON Patch
+(RFC 6902) or as a report.  Exits with status 1 if the files differ.
+usage: %prog diff [options] jsonfile1 jsonfile2\
+"""
+    schemafile = jsonwidget.find_system_schema("openschema.json")
+    subparser = optparse.OptionParser(usage=usage)
+    schemahelp = "schema used to load both files (also used for key " + \
+        "ordering).  Default: %s" % schemafile
+    subparser.add_option("-s", "--schema", dest="schema", type="str",
+                            default=schemafile,
+                            help=schemahelp)
+    subparser.add_option("-f", "--format", dest="format", type="choice",
+                         choices=["patch", "report"], default="patch",
+                         help="output format: patch or report.  " +
+                         "Default: patch")
+    (options, subargs) = subparser.parse_args(args[1:])
+    if len(subargs) != 2:
+        subparser.error("two json files required")
+    try:
+        nodes = [jsonwidget.jsonnode.JsonNode(filename=filename,
+                                              schemafile=options.schema)
+                 for filename in subargs]
+    except jsonwidget.jsonnode.JsonNodeError as inst:
+        print str(inst)
+        sys.exit(2)
+    diff = get_diff(nodes[0], nodes[1])
+    if options.format == "report":
+        for line in format_report(diff):
+            print line
+    else:
+        print json.dumps([op for op, oldvalue in diff], indent=4,
+                         sort_keys=True)
+    if len(diff) > 0:
+        sys.exit(1)
+
+
+def patch(args):
+    import json
+    import sys
+
+    usage = """\
+Apply a JSON Patch (RFC 6902) to a JSON file, checking the result against a 
+schema.  Nothing is written unless every operation succeeds.
+usage: %prog patch [options] jsonfile patchfile\
+"""
+    schemafile = jsonwidget.find_system_schema("openschema.json")
+    subparser = optparse.OptionParser(usage=usage)
+    schemahelp = "schema format version to use.  Default: %s" % schemafile
+    subparser.add_option("-s", "--schema", dest="schema", type="str",
+                            default=schemafile,
+                            help=schemahelp)
+    subparser.add_option("-o", "--output", dest="output", type="str",
+                         default=None,
+                         help="write the result here rather than back to " +
+                         "jsonfile")
+    (options, subargs) = subparser.parse_args(args[1:])
+    if len(subargs) != 2:
+        subparser.error("jsonfile and patchfile required")
+    jsonfile, patchfile = subargs
+    try:
+        if patchfile == "-":
+            ops = json.load(sys.stdin)
+        else:
+            with open(patchfile) as f:
+                ops = json.load(f)
+    except ValueError as inst:
+        print "Invalid patch: " + str(inst)
+        sys.exit(2)
+    try:
+        jsonnode = jsonwidget.jsonnode.JsonNode(filename=jsonfile,
+                                                schemafile=options.schema)
+        jsonnode.apply_patch(ops)
+    except jsonwidget.jsonnode.JsonNodeError as inst:
+        print str(inst)
+        sys.exit(1)
+    jsonnode.save_to_file(options.output)
+
+
 def editserver(args):
     import json
     import sys
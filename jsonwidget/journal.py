@@ -0,0 +1,266 @@
+#!/usr/bin/python
+# Append-only edit journal for crash recovery
+#
+# Copyright (c) 2010, Rob Lanphier
+# All rights reserved.
+# Licensed under BSD-style license.  See LICENSE.txt for details.
+
+"""
+Edit journal for JsonNode trees.
+
+Each edit to the tree is appended to a sidecar file as a one line,
+JSON-Patch-like record:
+    {"op": "replace", "path": "/a/0", "value": 3}
+    {"op": "add", "path": "/a/1", "value": ""}
+    {"op": "remove", "path": "/a/1"}
+    {"op": "move", "from": "/b", "path": "/c"}
+
+The first line of the journal is a header recording the size and mtime of the
+file the edits apply to (and the JSON Pointer to the edited part of it, if the
+editor only loaded part of the file), so a journal is only replayed against the
+file it was written for.  Records are flushed as they are written, and fsync is
+batched so that a burst of edits costs at most one sync per interval; a timer
+syncs whatever is left once the interval is up.  Saving the file
+folds the journal into it, so the journal starts over after every save
+(carrying over any edits made while a background save was being written).
+"""
+
+import json
+import os
+import threading
+import time
+
+from jsonwidget.jsonnode import JsonNodeError, JsonNodeEvent
+
+
+class JournalError(RuntimeError):
+    pass
+
+
+JOURNAL_VERSION = 1
+
+
+def get_journal_filename(filename):
+    """Name of the journal for filename: a hidden file in the same directory"""
+    dirname, basename = os.path.split(os.path.abspath(filename))
+    return os.path.join(dirname, "." + basename + ".journal")
+
+
+def get_file_signature(filename):
+    """Return (size, mtime) of filename, or (None, None) if it's missing"""
+    try:
+        filestat = os.stat(filename)
+    except OSError:
+        return None, None
+    return filestat.st_size, filestat.st_mtime
+
+
+def read_journal(journalname):
+    """
+    Return (header, records) from a journal file.  A partly written last
+    record (as left behind by a crash) is ignored.
+    """
+    with open(journalname, 'r') as f:
+        lines = f.readlines()
+    if len(lines) == 0:
+        raise JournalError("%s is empty" % journalname)
+    try:
+        header = json.loads(lines[0])
+    except ValueError:
+        raise JournalError("%s has an invalid header" % journalname)
+    if header.get('journal') != JOURNAL_VERSION:
+        raise JournalError("%s has an unsupported version" % journalname)
+    records = []
+    for line in lines[1:]:
+        if not line.endswith("\n"):
+            break
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            break
+    return header, records
+
+
+def is_journal_current(header, filename, pointer=""):
+    """
+    Was this journal written against the current contents of filename, for
+    the value at pointer?
+    """
+    size, mtime = get_file_signature(filename)
+    return (header.get('size') == size and header.get('mtime') == mtime and
+            header.get('pointer', "") == pointer)
+
+
+def replay_journal(jsonnode, records):
+    """Apply journal records to the tree rooted at jsonnode"""
+    for record in records:
+        try:
+            op = record['op']
+            if op == 'replace':
+                jsonnode.get_node_by_pointer(record['path']).set_data(
+                    record['value'])
+            elif op == 'add':
+                parent, key = jsonnode.resolve_pointer(record['path'])
+                parent.attach_child(key, parent.make_child_node(
+                    key, record['value']))
+            elif op == 'remove':
+                parent, key = jsonnode.resolve_pointer(record['path'])
+                parent.delete_child(key)
+            elif op == 'move':
+                parent, oldkey = jsonnode.resolve_pointer(record['from'])
+                newparent, newkey = jsonnode.resolve_pointer(record['path'])
+                if newparent is not parent:
+                    raise JournalError("can't move between parents")
+                parent.change_child_key(oldkey, newkey)
+            else:
+                raise JournalError("unknown op %s" % op)
+        except (KeyError, IndexError, ValueError, JsonNodeError) as inst:
+            raise JournalError("Can't replay %s: %s" %
+                               (json.dumps(record), inst))
+
+
+class EditJournal(object):
+    """
+    Writer for a journal file.  Call start() to begin a new journal against
+    the current contents of the file, or resume() to keep appending to an
+    existing one.
+
+    syncinterval: maximum number of seconds between a record being written
+        and fsync being called on the journal (records appended between 
+        begin_batch() and end_batch() are synced when the batch ends)
+    pointer: JSON Pointer to the part of the file being edited, which the
+        paths in the records are relative to
+    """
+    def __init__(self, filename, syncinterval=1.0, pointer=""):
+        self.filename = filename
+        self.pointer = pointer
+        self.journalname = get_journal_filename(filename)
+        self.syncinterval = syncinterval
+        self._file = None
+        self._unsynced = 0
+        self._lastsync = 0
+        self._batchdepth = 0
+        # records appended since mark(), or None
+        self._marked = None
+        # timer for syncing records left unsynced, or None.  The lock keeps 
+        # it from getting in the way of the thread writing the journal.
+        self._synctimer = None
+        self._lock = threading.RLock()
+
+    def start(self, records=()):
+        """
+        Truncate the journal, and begin a new one for the current file, 
+        starting with records
+        """
+        self.close()
+        size, mtime = get_file_signature(self.filename)
+        header = {'journal': JOURNAL_VERSION, 'size': size, 'mtime': mtime}
+        if self.pointer != "":
+            header['pointer'] = self.pointer
+        self._file = open(self.journalname, 'w')
+        self._file.write(json.dumps(header, sort_keys=True) + "\n")
+        for record in records:
+            self._file.write(json.dumps(record, separators=(',', ':')) + "\n")
+        self.sync()
+
+    def mark(self):
+        """
+        Keep the records appended from now on, e.g. for the edits made while
+        the file is being saved, which the saved file won't have
+        """
+        self._marked = []
+
+    def get_marked(self):
+        """Return the records appended since mark(), and stop keeping them"""
+        records = self._marked or []
+        self._marked = None
+        return records
+
+    def resume(self):
+        """Append to the existing journal"""
+        self.close()
+        self._file = open(self.journalname, 'a')
+        self._lastsync = time.time()
+
+    def append(self, record):
+        with self._lock:
+            if self._file is None:
+                self.start()
+            if self._marked is not None:
+                self._marked.append(record)
+            self._file.write(json.dumps(record, separators=(',', ':')) + 
+                             "\n")
+            self._unsynced += 1
+            if self._batchdepth > 0:
+                return
+            self._file.flush()
+            wait = self._lastsync + self.syncinterval - time.time()
+            if wait <= 0:
+                self.sync()
+            elif self._synctimer is None:
+                self._synctimer = threading.Timer(wait, self._sync_later)
+                self._synctimer.daemon = True
+                self._synctimer.start()
+
+    def _sync_later(self):
+        with self._lock:
+            self._synctimer = None
+            if self._batchdepth == 0 and self._unsynced > 0:
+                self.sync()
+
+    def begin_batch(self):
+        """Hold off flushing and syncing until the matching end_batch()"""
+        self._batchdepth += 1
+
+    def end_batch(self):
+        """Write out and sync everything appended since begin_batch()"""
+        with self._lock:
+            self._batchdepth -= 1
+            if self._batchdepth == 0 and self._unsynced > 0:
+                self.sync()
+
+    def handle_event(self, event):
+        """JsonNode listener: append a record for a JsonNodeEvent"""
+        if event.type == JsonNodeEvent.VALUE_CHANGED:
+            record = {'op': 'replace', 'path': event.get_pointer(),
+                      'value': event.value}
+        elif event.type == JsonNodeEvent.CHILD_INSERTED:
+            record = {'op': 'add', 'path': event.get_pointer(event.key),
+                      'value': event.child.get_data()}
+        elif event.type == JsonNodeEvent.CHILD_REMOVED:
+            record = {'op': 'remove', 'path': event.get_pointer(event.key)}
+        elif event.type == JsonNodeEvent.KEY_RENAMED:
+            record = {'op': 'move', 'from': event.get_pointer(event.oldkey),
+                      'path': event.get_pointer(event.key)}
+        else:
+            return
+        self.append(record)
+
+    def sync(self):
+        """Force any records written so far onto the disk"""
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+            self._lastsync = time.time()
+
+    def close(self):
+        with self._lock:
+            if self._synctimer is not None:
+                self._synctimer.cancel()
+                self._synctimer = None
+            if self._file is not None:
+                if self._unsynced > 0:
+                    self.sync()
+                self._file.close()
+                self._file = None
+
+    def remove(self):
+        """Close and delete the journal"""
+        self.close()
+        try:
+            os.remove(self.journalname)
+        except OSError:
+            pass
@@ -6,6 +6,7 @@
 # Licensed under BSD-style license.  See LICENSE.txt for details.
 
 import json
+import os
 
 from jsonwidget.jsonorder import *
 
@@ -14,6 +15,24 @@ class JsonBaseError(RuntimeError):
     pass
 
 
+def read_with_progress(f, progress, chunksize=1024*1024):
+    """
+    Read all of file f, calling progress("read", bytes read, file size) after
+    each chunk
+    """
+    total = os.fstat(f.fileno()).st_size
+    chunks = []
+    done = 0
+    while True:
+        chunk = f.read(chunksize)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        done += len(chunk)
+        progress("read", done, total)
+    return "".join(chunks)
+
+
 class JsonBaseNode:
     """ abstract base class for SchemaNode and JsonNode """
     # TODO: pull more functions in from subclasses
@@ -35,12 +54,21 @@ class JsonBaseNode:
         self.filename = filename
         self.savededitcount = 0
 
-    def load_from_file(self, filename=None):
+    def load_from_file(self, filename=None, progress=None):
+        """
+        progress: optional callback(stage, done, total), called as the file is
+            read ("read", bytes read, file size) and before it's parsed 
+            ("parse", 0, None)
+        """
         if filename is not None:
-            self.filename = file
+            self.filename = filename
         with open(self.filename, 'r') as f:
-            jsonbuffer = f.read()
-        f.closed  
+            if progress is None:
+                jsonbuffer = f.read()
+            else:
+                jsonbuffer = read_with_progress(f, progress)
+        if progress is not None:
+            progress("parse", 0, None)
         self.data = json.loads(jsonbuffer)
         self.ordermap = JsonOrderMap(jsonbuffer).get_order_map()
 
@@ -50,20 +78,14 @@ class JsonBaseNode:
 
     def sort_keys(self, keys):
         ordermap = self._get_key_order()
-        def keycmp(a, b):
-            try:
-                ai = ordermap.index(a)
-            except:
-                ai = len(keys)
-            try:
-                bi = ordermap.index(b)
-            except:
-                bi = len(keys)
-            if ai == bi == len(keys):
-                return cmp(a, b)
-            else:
-                return cmp(ai, bi)
-        return sorted(keys, cmp=keycmp)
+        # index the key order once rather than searching it per comparison
+        positions = {}
+        for i, key in enumerate(ordermap):
+            positions.setdefault(key, i)
+        last = len(ordermap)
+        def keypos(a):
+            return (positions.get(a, last), a)
+        return sorted(keys, key=keypos)
 
     def get_child_keys(self):
         if isinstance(self.children, dict):
@@ -0,0 +1,255 @@
+#!/usr/bin/python
+# Structural diff between JSON documents
+#
+# Copyright (c) 2010, Rob Lanphier
+# All rights reserved.
+# Licensed under BSD-style license.  See LICENSE.txt for details.
+
+"""
+Structural diff between two JsonNode trees.
+
+The result is a list of RFC 6902 JSON Patch operations which turn the first
+tree into the second:
+    {"op": "replace", "path": "/a/0", "value": 3}
+    {"op": "add", "path": "/a/1", "value": ""}
+    {"op": "remove", "path": "/a/1"}
+    {"op": "move", "from": "/b/4", "path": "/b/0"}
+
+Subtrees with equal content hashes are skipped without being walked, so the
+cost is roughly proportional to the size of the changes (plus the size of the
+arrays containing them).  Object members are listed in the order the
+documents (or their schemas) give them.
+
+Array items are matched up before being compared.  If every item in both
+arrays is an object with a unique identifying member (see ARRAY_ID_KEYS),
+items are matched by that member, so a record which moved and changed shows
+up as a move plus the changes to it.  Otherwise items are matched by content,
+and unmatched items which sit between the same matched neighbours are
+compared with each other.  The longest run of matched items which is in the
+same order in both arrays stays put; the other matched items are moved.
+"""
+
+import bisect
+import json
+
+from jsonwidget.jsonnode import make_json_pointer
+
+
+# object members which identify array items, in order of preference
+ARRAY_ID_KEYS = ('id', 'key', 'name')
+
+
+def make_patch(a, b):
+    """Return a JSON Patch (list of operations) turning a into b"""
+    return [op for op, oldvalue in get_diff(a, b)]
+
+
+def get_diff(a, b):
+    """
+    Return a list of (op, oldvalue) pairs, where op is a JSON Patch operation
+    and oldvalue is the value it removes or replaces (None for add and move).
+    """
+    out = []
+    _diff_node(a, b, [], out)
+    return out
+
+
+def format_report(diff):
+    """Turn the result of get_diff into readable lines of text"""
+    lines = []
+    for op, oldvalue in diff:
+        if op['op'] == 'replace':
+            lines.append("~ %s: %s -> %s" % (op['path'], _dumps(oldvalue),
+                                             _dumps(op['value'])))
+        elif op['op'] == 'add':
+            lines.append("+ %s: %s" % (op['path'], _dumps(op['value'])))
+        elif op['op'] == 'remove':
+            lines.append("- %s: %s" % (op['path'], _dumps(oldvalue)))
+        elif op['op'] == 'move':
+            lines.append("> %s -> %s" % (op['from'], op['path']))
+    return lines
+
+
+def _dumps(value):
+    return json.dumps(value, sort_keys=True)
+
+
+def _make_op(op, path, value=None, frompath=None):
+    retval = {'op': op, 'path': make_json_pointer(path)}
+    if frompath is not None:
+        retval['from'] = make_json_pointer(frompath)
+    if op in ('add', 'replace'):
+        retval['value'] = value
+    return retval
+
+
+def _diff_node(a, b, path, out):
+    if a.get_hash() == b.get_hash():
+        return
+    adata = a.get_data()
+    bdata = b.get_data()
+    if isinstance(adata, dict) and isinstance(bdata, dict):
+        _diff_object(a, b, path, out)
+    elif isinstance(adata, list) and isinstance(bdata, list):
+        _diff_array(a, b, path, out)
+    else:
+        out.append((_make_op('replace', path, value=bdata), adata))
+
+
+def _diff_object(a, b, path, out):
+    akeys = a.get_child_keys()
+    bkeys = b.get_child_keys()
+    akeyset = set(akeys)
+    bkeyset = set(bkeys)
+    for key in akeys:
+        if key not in bkeyset:
+            out.append((_make_op('remove', path + [key]),
+                        a.get_child(key).get_data()))
+    for key in bkeys:
+        if key not in akeyset:
+            out.append((_make_op('add', path + [key],
+                                 value=b.get_child(key).get_data()), None))
+        else:
+            _diff_node(a.get_child(key), b.get_child(key), path + [key], out)
+
+
+def _get_array_id_key(achildren, bchildren):
+    """Find a member which identifies every item of both arrays"""
+    if len(achildren) == 0 or len(bchildren) == 0:
+        return None
+    for idkey in ARRAY_ID_KEYS:
+        if (_has_unique_ids(achildren, idkey) and
+            _has_unique_ids(bchildren, idkey)):
+            return idkey
+    return None
+
+
+def _has_unique_ids(children, idkey):
+    ids = set()
+    for child in children:
+        data = child.get_data()
+        if not isinstance(data, dict) or idkey not in data:
+            return False
+        value = data[idkey]
+        if isinstance(value, (dict, list)) or value in ids:
+            return False
+        ids.add(value)
+    return True
+
+
+def _get_anchors(match):
+    """
+    Given match[i] = index in b of the item matched with a[i] (or None),
+    return the a indexes of the longest run of matches in increasing b order
+    """
+    # patience sorting: tails[k] is the a index ending the best run of
+    # length k + 1 found so far
+    tails = []
+    tailvalues = []
+    prev = {}
+    for i, j in enumerate(match):
+        if j is None:
+            continue
+        k = bisect.bisect_left(tailvalues, j)
+        if k > 0:
+            prev[i] = tails[k - 1]
+        if k == len(tails):
+            tails.append(i)
+            tailvalues.append(j)
+        else:
+            tails[k] = i
+            tailvalues[k] = j
+    anchors = []
+    if len(tails) > 0:
+        i = tails[-1]
+    else:
+        i = None
+    while i is not None:
+        anchors.append(i)
+        i = prev.get(i)
+    anchors.reverse()
+    return anchors
+
+
+def _pair_gaps(match, anchors, blen):
+    """
+    Match up the unmatched items which lie between the same two anchors,
+    in order.  Returns the a indexes of the new pairs.
+    """
+    bmatched = set([j for j in match if j is not None])
+    pairs = []
+    previ, prevj = -1, -1
+    for i, j in [(i, match[i]) for i in anchors] + [(len(match), blen)]:
+        agap = [x for x in range(previ + 1, i) if match[x] is None]
+        bgap = [y for y in range(prevj + 1, j) if y not in bmatched]
+        for x, y in zip(agap, bgap):
+            match[x] = y
+            pairs.append(x)
+        previ, prevj = i, j
+    return pairs
+
+
+def _diff_array(a, b, path, out):
+    achildren = a.get_children()
+    bchildren = b.get_children()
+    idkey = _get_array_id_key(achildren, bchildren)
+    if idkey is None:
+        aids = [child.get_hash() for child in achildren]
+        bids = [child.get_hash() for child in bchildren]
+    else:
+        aids = [child.get_data()[idkey] for child in achildren]
+        bids = [child.get_data()[idkey] for child in bchildren]
+
+    # match equal ids, first occurrence to first occurrence
+    positions = {}
+    for j in reversed(range(len(bids))):
+        positions.setdefault(bids[j], []).append(j)
+    match = []
+    for itemid in aids:
+        candidates = positions.get(itemid)
+        if candidates:
+            match.append(candidates.pop())
+        else:
+            match.append(None)
+    anchors = _get_anchors(match)
+    if idkey is None:
+        # items with different ids are different records, but items with
+        # different content may just have been edited
+        anchors.extend(_pair_gaps(match, anchors, len(bchildren)))
+
+    # remove the unmatched items, from the end so the indexes stay valid
+    for i in reversed(range(len(achildren))):
+        if match[i] is None:
+            out.append((_make_op('remove', path + [i]),
+                        achildren[i].get_data()))
+    # current order of the remaining items, by their index in b
+    current = [j for j in match if j is not None]
+    placed = sorted([match[i] for i in anchors])
+    anchorset = set(placed)
+    for j in sorted(current):
+        if j in anchorset:
+            continue
+        fromindex = current.index(j)
+        del current[fromindex]
+        # put it after the nearest item which precedes it in b
+        k = bisect.bisect_left(placed, j)
+        if k == 0:
+            toindex = 0
+        else:
+            toindex = current.index(placed[k - 1]) + 1
+        current.insert(toindex, j)
+        bisect.insort(placed, j)
+        if toindex != fromindex:
+            out.append((_make_op('move', path + [toindex],
+                                 frompath=path + [fromindex]), None))
+    # everything matched is now in b order, so new items go straight to
+    # their final index
+    bmatched = set(current)
+    for j in range(len(bchildren)):
+        if j not in bmatched:
+            out.append((_make_op('add', path + [j],
+                                 value=bchildren[j].get_data()), None))
+    pairs = [(j, i) for i, j in enumerate(match) if j is not None]
+    pairs.sort()
+    for j, i in pairs:
+        _diff_node(achildren[i], bchildren[j], path + [j], out)
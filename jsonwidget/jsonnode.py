@@ -5,9 +5,14 @@
 # All rights reserved.
 # Licensed under BSD-style license.  See LICENSE.txt for details.
 
+import contextlib
 import json
+import os
+import shutil
+import tempfile
 import uuid
 import base64
+import hashlib
 
 from jsonwidget.schema import *
 from jsonwidget.jsonbase import *
@@ -17,39 +22,440 @@ class JsonNodeError(RuntimeError):
     pass
 
 
+_scalar_encoder = json.JSONEncoder()
+
+def _encode_float(value):
+    if value != value or value in (float('inf'), float('-inf')):
+        return _scalar_encoder.encode(value)
+    return repr(value)
+
+_scalar_encoders = {str: json.encoder.encode_basestring_ascii,
+                    unicode: json.encoder.encode_basestring_ascii,
+                    int: str,
+                    long: str,
+                    float: _encode_float,
+                    bool: lambda value: value and 'true' or 'false',
+                    type(None): lambda value: 'null'}
+
+def encode_json_value(value):
+    """Encode a scalar the way json.dumps would, with fast paths for the 
+    common types"""
+    try:
+        return _scalar_encoders[type(value)](value)
+    except KeyError:
+        return _scalar_encoder.encode(value)
+
+
+def make_json_pointer(path):
+    """Turn a list of keys into a JSON Pointer (RFC 6901) string"""
+    return "".join(["/" + unicode(key).replace("~", "~0").replace("/", "~1")
+                    for key in path])
+
+
+def split_json_pointer(pointer):
+    """Turn a JSON Pointer string into a list of (string) keys"""
+    if pointer == "":
+        return []
+    if not pointer.startswith("/"):
+        raise JsonNodeError("Invalid JSON pointer: %s" % pointer)
+    return [token.replace("~1", "/").replace("~0", "~")
+            for token in pointer[1:].split("/")]
+
+
+class JsonNodeEvent(object):
+    """
+    Description of a change to a JsonNode tree, as passed to listeners.
+
+    type: VALUE_CHANGED, CHILD_INSERTED, CHILD_REMOVED or KEY_RENAMED
+    node: the node whose value was replaced, or whose children changed
+    path: list of keys leading to node, as of when the change was made
+    key: key of the inserted or removed child (new key for renames)
+    child: the inserted, removed or renamed child node
+    oldkey: previous key of a renamed child
+    value, oldvalue: new and previous data (VALUE_CHANGED only)
+    oldchildren: the children the node had before its value was replaced 
+        (VALUE_CHANGED only, None if they were kept)
+    """
+    VALUE_CHANGED = 'value-changed'
+    CHILD_INSERTED = 'child-inserted'
+    CHILD_REMOVED = 'child-removed'
+    KEY_RENAMED = 'key-renamed'
+
+    def __init__(self, type, node, key=None, child=None, oldkey=None,
+                 value=None, oldvalue=None, oldchildren=None):
+        self.type = type
+        self.node = node
+        self.path = node.get_path()
+        self.key = key
+        self.child = child
+        self.oldkey = oldkey
+        self.value = value
+        self.oldvalue = oldvalue
+        self.oldchildren = oldchildren
+
+    def get_pointer(self, key=None):
+        """JSON Pointer to the node, or to its child at key"""
+        if key is None:
+            return make_json_pointer(self.path)
+        return make_json_pointer(self.path + [key])
+
+
+class _SpanWriter(object):
+    """
+    Output file wrapper for incremental saves.  Keeps track of the output 
+    position, and copies byte ranges from the source file.  Adjacent ranges 
+    are merged, so a run of unchanged siblings turns into a single copy.
+    progress, if given, is called as progress("write", bytes written, None)
+    after about every bufsize bytes.
+    """
+    def __init__(self, out, source=None, bufsize=1024*1024, progress=None):
+        self.out = out
+        self.source = source
+        self.bufsize = bufsize
+        self.progress = progress
+        self.pos = 0
+        self._pending = None
+        self._written = 0
+        self._nextreport = bufsize
+
+    def write(self, chunk):
+        if self._pending is not None:
+            self.flush()
+        self.out.write(chunk)
+        self.pos += len(chunk)
+        self._advance(len(chunk))
+
+    def copy(self, start, end):
+        if end <= start:
+            return
+        if self._pending is not None and self._pending[1] == start:
+            self._pending = (self._pending[0], end)
+        else:
+            self.flush()
+            self._pending = (start, end)
+        self.pos += end - start
+
+    def copy_rest(self, start):
+        """Copy everything from start to the end of the source file"""
+        self.source.seek(0, 2)
+        self.copy(start, self.source.tell())
+
+    def flush(self):
+        if self._pending is None:
+            return
+        start, end = self._pending
+        self._pending = None
+        self.source.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = self.source.read(min(remaining, self.bufsize))
+            if not chunk:
+                raise JsonNodeError("source file is shorter than expected")
+            self.out.write(chunk)
+            remaining -= len(chunk)
+            self._advance(len(chunk))
+
+    def _advance(self, size):
+        self._written += size
+        if self.progress is not None and self._written >= self._nextreport:
+            self._nextreport = self._written + self.bufsize
+            self.progress("write", self._written, None)
+
+
+class SaveSnapshot(object):
+    """
+    The tree as JsonNode.save_to_file would write it, taken in one pass over
+    just the parts changed since the last save, so that it can be written 
+    out (say, in another thread) while editing carries on.  Get one from
+    JsonNode.take_save_snapshot, call write(), which only looks at the 
+    snapshot, and then commit() or cancel() it in the thread that edits the 
+    tree.
+
+    The snapshot is a tree of (kind, node, srcstart, srcend, payload) plans,
+    with srcstart and srcend the node's absolute offsets in the source file 
+    (None if it can't be copied from there).  The modified flags of the 
+    nodes move into the snapshot, so edits made while it's being written 
+    are flagged for the next save.
+
+    A tree loaded from part of a file (see the pointer argument of JsonNode)
+    is always saved into the rest of that file.  If the file has changed 
+    since it was read, the value at the pointer is looked up again, and the 
+    whole tree is written in its place.
+    """
+    # copy the node from the source file; copy it, but write the (modified)
+    # children, payload [(child srcstart, child srcend, plan), ...]; write 
+    # the container out, payload (isobject, [(key, plan), ...]); write the
+    # scalar in payload
+    COPY, SPLICE, REWRITE, VALUE = range(4)
+
+    def __init__(self, root, filename):
+        self.root = root
+        self.filename = filename
+        self.sourcename = root._get_unchanged_source()
+        self.pointer = root._sourcepointer
+        if root._source is not None:
+            # the file that holds the rest of the document
+            self.documentname = root._source[0]
+        else:
+            self.documentname = None
+        self.editcount = root.editcount
+        self._oldsavedhash = root._savedhash
+        self.plan = root._get_save_plan(None, self.sourcename is not None)
+        # the next edit records the digest of the tree as of the snapshot
+        # (see JsonNode._set_modified)
+        root._savedhash = None
+        # [(node, span), ...] and (filename, size, mtime) once written
+        self._spans = None
+        self._source = None
+
+    def write(self, progress=None):
+        """
+        Write the snapshot to a temporary file next to the file name, then
+        rename it over the file, so that a failed save never leaves a 
+        partial file.  Unmodified subtrees are copied byte for byte from the
+        source file, and only the modified parts are encoded.  progress is
+        passed on to _SpanWriter.
+        """
+        filename = self.filename
+        dirname = os.path.dirname(os.path.abspath(filename))
+        fileno, tempname = tempfile.mkstemp(
+            dir=dirname, prefix='.' + os.path.basename(filename) + '.', 
+            suffix='.tmp')
+        spans = []
+        try:
+            out = os.fdopen(fileno, 'wb', 65536)
+            try:
+                srcstart, srcend = self.plan[2:4]
+                if self.sourcename is not None:
+                    source = open(self.sourcename, 'rb')
+                elif self.pointer != "":
+                    srcstart, srcend = self._find_document_span()
+                    source = open(self.documentname, 'rb')
+                else:
+                    source = None
+                try:
+                    writer = _SpanWriter(out, source, progress=progress)
+                    if srcstart is not None:
+                        # keep whatever surrounds the top level value
+                        writer.copy(0, srcstart)
+                    self._write_plan(writer, self.plan, 0, 0, spans)
+                    if srcstart is not None:
+                        writer.copy_rest(srcend)
+                    writer.flush()
+                finally:
+                    if source is not None:
+                        source.close()
+                out.flush()
+                os.fsync(out.fileno())
+            finally:
+                out.close()
+            if os.path.exists(filename):
+                shutil.copymode(filename, tempname)
+            else:
+                umask = os.umask(0)
+                os.umask(umask)
+                os.chmod(tempname, 0666 & ~umask)
+            try:
+                os.rename(tempname, filename)
+            except OSError:
+                # Windows won't rename over an existing file
+                os.remove(filename)
+                os.rename(tempname, filename)
+        except:
+            try:
+                os.remove(tempname)
+            except OSError:
+                pass
+            raise
+        sourcestat = os.stat(filename)
+        self._source = (filename, sourcestat.st_size, sourcestat.st_mtime)
+        self._spans = spans
+
+    def _find_document_span(self):
+        """
+        Return the (start, end) offsets of the value at the pointer in the 
+        document file, which has changed since the tree was read
+        """
+        from jsonwidget.jsonscan import find_file_pointer_span, JsonScanError
+        if self.documentname is None:
+            raise JsonNodeError("No file to save %s into" % self.pointer)
+        try:
+            return find_file_pointer_span(self.documentname, self.pointer)
+        except (JsonScanError, EnvironmentError) as inst:
+            raise JsonNodeError("Can't save %s into %s: %s" % 
+                                (self.pointer, self.documentname, inst))
+
+    def _write_plan(self, writer, plan, outbase, indentlevel, spans):
+        """
+        Write one node, and record its new span relative to outbase, the
+        offset of its parent's value in the output
+        """
+        kind, node, srcstart, srcend, payload = plan
+        start = writer.pos
+        if kind == self.COPY:
+            writer.copy(srcstart, srcend)
+        elif kind == self.SPLICE:
+            # same children as in the source, so everything between them is
+            # copied
+            pos = srcstart
+            for childstart, childend, childplan in payload:
+                writer.copy(pos, childstart)
+                pos = childend
+                self._write_plan(writer, childplan, start, indentlevel + 1,
+                                 spans)
+            writer.copy(pos, srcend)
+        elif kind == self.REWRITE:
+            isobject, items = payload
+            if isobject:
+                opener, closer = "{", "}"
+            else:
+                opener, closer = "[", "]"
+            if len(items) == 0:
+                writer.write(opener + closer)
+            else:
+                indent = "\n" + " " * 4 * (indentlevel + 1)
+                separator = opener + indent
+                for key, childplan in items:
+                    if isobject:
+                        writer.write(separator + encode_json_value(key) + 
+                                     ": ")
+                    else:
+                        writer.write(separator)
+                    self._write_plan(writer, childplan, start, 
+                                     indentlevel + 1, spans)
+                    separator = ", " + indent
+                writer.write("\n" + " " * 4 * indentlevel + closer)
+        else:
+            writer.write(encode_json_value(payload))
+        spans.append((node, (start - outbase, writer.pos - outbase)))
+
+    def commit(self):
+        """Record the written file as the tree's saved state"""
+        root = self.root
+        for node, span in self._spans:
+            node.span = span
+        root._source = self._source
+        root.savededitcount = self.editcount
+        self._spans = None
+
+    def cancel(self):
+        """Put back the modified flags after a failed write"""
+        stack = [self.plan]
+        while len(stack) > 0:
+            kind, node, srcstart, srcend, payload = stack.pop()
+            if kind == self.COPY:
+                continue
+            node._modified = True
+            if kind == self.SPLICE:
+                stack.extend([plan for start, end, plan in payload])
+            elif kind == self.REWRITE:
+                node._restructured = True
+                stack.extend([plan for key, plan in payload[1]])
+        if self._oldsavedhash is not None:
+            # (if it was None, nothing had changed since the last save, so 
+            # the digest taken since then is still the saved one)
+            self.root._savedhash = self._oldsavedhash
+
+
 class JsonNode(JsonBaseNode):
     """
     JsonNode is a class to store the data associated with a schema.  Each node
     of the tree gets tied to a SchemaNode.
     """
+    # where the tree is in its file, if it was loaded from part of the file
+    _sourcepointer = ""
+    _sourcestart = 0
+    # progress callback while the tree is being built, see __init__
+    _progress = None
+    _nodecount = 0
+    # nodes left to hash, see saved_hash_step
+    _hashwalk = None
+    # lazy loading: the root's _lazy is set until build_step is done, and 
+    # _unbuilt is set on nodes whose children haven't been built yet
+    _lazy = False
+    _unbuilt = False
+    _buildwalk = None
 
     def __init__(self, key=None, parent=None, filename=None, data=None,
                  schemanode=None, schemadata=None, schemafile=None, 
-                 ordermap=None):
+                 ordermap=None, pointer=None, progress=None, lazy=False):
+        """
+        pointer: load just the value at this JSON Pointer in filename (and 
+            save it back in place).  The schema describes that value.
+        progress: optional callback(stage, done, total) for following the
+            load of a big file: "read" and "parse" (see load_from_file), 
+            "schema" if one is being derived from the data, then "build" 
+            with the number of nodes built so far every 1000 nodes.
+        lazy: only build the top level of the tree for now.  Deeper nodes
+            get their children when they're first used, or from build_step.
+        If no schema is given, one is derived from the data.
+        """
+        # set once construction is done; edits made while building the tree
+        # aren't recorded in the journal
+        self._attached = False
         self.filename = filename
+        # (filename, size, mtime) of the file that spans refer to
+        self._source = None
         if self.filename is not None:
             if data is None:
                 try:
-                    self.load_from_file()
+                    sourcestat = os.stat(self.filename)
+                    if pointer is None:
+                        self.load_from_file(progress=progress)
+                    else:
+                        self.load_subtree_from_file(pointer, 
+                                                    progress=progress)
                 except ValueError as inst:
                     raise JsonNodeError("Error in %s: %s" % (self.filename, 
                                                             inst))
+                self._source = (self.filename, sourcestat.st_size,
+                                sourcestat.st_mtime)
         else:
             self.data = data
 
+        if ordermap is not None:
+            self.ordermap = ordermap
+
         if schemanode is None:
-            schemanode = SchemaNode(key=key, data=schemadata,
-                                    filename=schemafile)
+            if parent is None and schemadata is None and schemafile is None:
+                if progress is not None:
+                    progress("schema", 0, None)
+                schemanode = generate_schema_from_data(self.data,
+                    jsonordermap=getattr(self, 'ordermap', None))
+            else:
+                schemanode = SchemaNode(key=key, data=schemadata,
+                                        filename=schemafile)
 
         self.schemanode = schemanode
 
-        if ordermap is not None:
-            self.ordermap = ordermap
-
         # local index for the node
         self.key = key
         # object ref for the parent
         self.parent = parent
+
+        # byte range of this value in the source file, relative to the start
+        # of the parent's range, so that unmodified subtrees can be copied
+        # verbatim on save
+        self.span = None
+        try:
+            span = self.ordermap['span']
+            if parent is None:
+                self.span = (self._sourcestart + span[0], 
+                             self._sourcestart + span[1])
+            else:
+                parentstart = parent.ordermap['span'][0]
+                self.span = (span[0] - parentstart, span[1] - parentstart)
+        except (AttributeError, KeyError, TypeError):
+            pass
+        # _modified: something in this subtree changed since the last load or
+        # save.  _restructured: this node's value was replaced, or its
+        # children were added, removed or renamed.
+        self._modified = False
+        self._restructured = False
+        # cached digest of this subtree, see get_hash
+        self._hash = None
+        # [(callback, subtree), ...], see add_listener
+        self._listeners = None
         # self.children will get set in attach_schema_node if there are any
         self.children = []
 
@@ -62,9 +468,22 @@ class JsonNode(JsonBaseNode):
             self.editcount = 0
             self.savededitcount = 0
             self.cursor = None
+            self.journal = None
+            self.history = None
+            # events held back until the outermost batch() ends, or None
+            self._batchevents = None
+            # digest of the tree as last saved.  None: same as the current
+            # tree (see saved_hash_step).  False: not known.
+            self._savedhash = False
+            self._progress = progress
+            self._lazy = lazy
         else:
             self.depth = self.parent.get_depth() + 1
             self.root = self.parent.get_root()
+            if self.root._progress is not None:
+                self.root._nodecount += 1
+                if self.root._nodecount % 1000 == 0:
+                    self.root._progress("build", self.root._nodecount, None)
 
         if schemanode.is_type('idref'):
             schemanode = schemanode.resolve_fragment_id()
@@ -79,25 +498,319 @@ class JsonNode(JsonBaseNode):
                 ("Type mismatch in %s%s - jsontype: %s schematype: %s\n" +
                  "Schema: %s\nTry using a different schema") %
                 (filename, idstring, jsontype, schematype, schemaname))
+        elif self.depth > 0 and self.root._lazy:
+            # the children are built on first use (see __getattr__)
+            self.schemanode = schemanode
+            del self.children
+            self._unbuilt = True
         else:
             self.attach_schema_node(schemanode)
         if self.depth == 0:
             self.set_saved(True)
+            # nodes added later aren't part of the load
+            self._progress = None
+        self._attached = True
+
+    def __getattr__(self, name):
+        if name == 'children' and self._unbuilt:
+            self._build_children()
+            return self.children
+        raise AttributeError(name)
+
+    def _build(self):
+        """Build the children now, if a lazy load left them for later"""
+        if self._unbuilt:
+            self._build_children()
+
+    def _build_children(self):
+        """Build the children of a node that a lazy load left unbuilt"""
+        root = self.root
+        # required children added along the way are part of the file as 
+        # loaded rather than edits, just as when building the whole tree
+        editcount = root.editcount
+        savedhash = root._savedhash
+        self._unbuilt = False
+        self.children = []
+        self._attached = False
+        try:
+            self.attach_schema_node(self.schemanode)
+        except:
+            del self.children
+            self._unbuilt = True
+            raise
+        finally:
+            self._attached = True
+            root.editcount = editcount
+            root._savedhash = savedhash
+
+    def build_step(self, limit=1000):
+        """
+        Build the children of up to limit more of the nodes that a lazy load
+        left unbuilt.  Meant to be called when idle (like saved_hash_step),
+        so that the tree is ready before it's needed and any errors in the
+        file turn up early; returns True once the whole tree is built.
+        """
+        root = self.root
+        if not root._lazy:
+            return True
+        if root._buildwalk is None:
+            root._buildwalk = [root]
+        stack = root._buildwalk
+        while len(stack) > 0 and limit > 0:
+            node = stack.pop()
+            stack.extend(node.get_children())
+            limit -= 1
+        if len(stack) > 0:
+            return False
+        root._buildwalk = None
+        # nodes added from here on are built straight away
+        root._lazy = False
+        return True
+
+    def load_subtree_from_file(self, pointer, progress=None):
+        """
+        Load the value at pointer in self.filename.  The file is scanned for
+        the value rather than parsed, so the rest of it is never decoded.  
+        The spans of the tree are relative to the start of the file, so 
+        saving writes the value back in place, and copies the rest of the 
+        file around it.
+        """
+        from jsonwidget.jsonscan import read_pointer, JsonScanError
+        try:
+            start, end, jsonbuffer = read_pointer(self.filename, pointer)
+        except JsonScanError as inst:
+            raise JsonNodeError("Error in %s: %s" % (self.filename, inst))
+        if progress is not None:
+            progress("parse", 0, None)
+        self.data = json.loads(jsonbuffer)
+        self.ordermap = JsonOrderMap(jsonbuffer).get_order_map()
+        self._sourcepointer = pointer
+        self._sourcestart = start
+
+    def get_source_pointer(self):
+        """JSON Pointer to this tree in its file ("" for the whole file)"""
+        return self.root._sourcepointer
 
     def get_root(self):
         return self.root
 
+    def get_parent(self):
+        return self.parent
+
     def save_to_file(self, filename=None):
+        snapshot = self.take_save_snapshot(filename)
+        try:
+            snapshot.write()
+        except:
+            snapshot.cancel()
+            raise
+        snapshot.commit()
+
+    def take_save_snapshot(self, filename=None):
+        """
+        Return a SaveSnapshot for saving the tree to filename (or to its
+        current file), e.g. in another thread
+        """
         if filename is not None:
             self.filename = filename
         if self.filename is None:
-            import tempfile
             fd = tempfile.NamedTemporaryFile(delete=False, suffix='.json')
+            fd.close()
             self.filename = fd.name
+        return SaveSnapshot(self, self.filename)
+
+    def _get_unchanged_source(self):
+        """
+        Return the name of the file the spans refer to, or None if there is 
+        no such file or it has changed since it was read.
+        """
+        if self._source is None:
+            return None
+        filename, size, mtime = self._source
+        try:
+            sourcestat = os.stat(filename)
+        except OSError:
+            return None
+        if sourcestat.st_size != size or sourcestat.st_mtime != mtime:
+            return None
+        return filename
+
+    def _get_save_plan(self, srcbase, hassource):
+        """
+        Return the SaveSnapshot plan for this node, clearing its modified 
+        flags.  srcbase is the absolute offset of the parent's value in the 
+        source file (None if nothing can be copied from it).
+        """
+        srcstart = srcend = None
+        if hassource and self.span is not None:
+            if self.parent is None:
+                srcbase = 0
+            if srcbase is not None:
+                srcstart = srcbase + self.span[0]
+                srcend = srcbase + self.span[1]
+        if srcstart is not None and not self._modified:
+            return (SaveSnapshot.COPY, self, srcstart, srcend, None)
+        restructured = self._restructured
+        self._modified = False
+        self._restructured = False
+        if isinstance(self.data, dict):
+            keys = self.get_child_keys()
+        elif isinstance(self.data, list):
+            keys = range(len(self.children))
+        else:
+            return (SaveSnapshot.VALUE, self, srcstart, srcend, self.data)
+        children = self.children
+        if (srcstart is not None and keys and not restructured and
+              None not in [children[key].span for key in keys]):
+            # same children as in the source, so only the children that 
+            # changed need to be written
+            if isinstance(children, list):
+                ordered = children
+            else:
+                ordered = sorted(children.values(), 
+                                 key=lambda child: child.span[0])
+            parts = [(srcstart + child.span[0], srcstart + child.span[1],
+                      child._get_save_plan(srcstart, hassource))
+                     for child in ordered]
+            return (SaveSnapshot.SPLICE, self, srcstart, srcend, parts)
+        parts = [(key, children[key]._get_save_plan(srcstart, hassource))
+                 for key in keys]
+        return (SaveSnapshot.REWRITE, self, srcstart, srcend,
+                (isinstance(self.data, dict), parts))
+
+    def _set_modified(self, restructured=False):
+        """
+        Flag this node and its ancestors as changed since the last save, so 
+        that saving can skip the unchanged parts of the tree
+        """
+        if restructured:
+            self._restructured = True
+        root = self.root
+        if root._savedhash is None:
+            # remember what the saved tree looked like before it changes, if
+            # the digest is ready (see saved_hash_step).  Hashing the whole
+            # tree here would hold up the edit; without the digest, is_saved
+            # goes by the edit count.
+            root._savedhash = root._hash or False
+        node = self
+        while node is not None and not node._modified:
+            node._modified = True
+            node = node.parent
+        # a cached digest implies cached digests for the whole subtree, so we
+        # can stop at the first ancestor without one
+        node = self
+        while node is not None and node._hash is not None:
+            node._hash = None
+            node = node.parent
+
+    def get_hash(self):
+        """
+        Hex SHA-1 digest of the content of this subtree.  Equal values have
+        equal hashes however they were arrived at (object key order aside),
+        so this is a cheap way to compare subtrees, or to tag a version of 
+        the tree.  Digests are cached per node and discarded along the path to
+        the root on each edit, so rehashing after an edit costs 
+        O(depth * siblings) rather than O(size).
+        """
+        return self._get_digest().encode('hex')
+
+    def _get_digest(self):
+        if self._hash is None:
+            if isinstance(self.data, dict):
+                parts = ['{']
+                for key in sorted(self.children):
+                    parts.append(encode_json_value(key))
+                    parts.append(self.children[key]._get_digest())
+            elif isinstance(self.data, list):
+                parts = ['[']
+                parts.extend([child._get_digest() for child in self.children])
+            else:
+                parts = [encode_json_value(self.data)]
+            self._hash = hashlib.sha1("".join(parts)).digest()
+        return self._hash
+
+    def diff(self, other):
+        """
+        Return a list of JSON Pointers (relative to this node) to the values
+        that differ between this tree and other.  Subtrees with equal hashes
+        are skipped without being walked.
+        """
+        changes = []
+        self._diff(other, [], changes)
+        return changes
+
+    def _diff(self, other, path, changes):
+        if self._get_digest() == other._get_digest():
+            return
+        if isinstance(self.data, dict) and isinstance(other.data, dict):
+            keys = set(self.children)
+            keys.update(other.children)
+            for key in sorted(keys):
+                if key in self.children and key in other.children:
+                    self.children[key]._diff(other.children[key], 
+                                             path + [key], changes)
+                else:
+                    changes.append(make_json_pointer(path + [key]))
+        elif isinstance(self.data, list) and isinstance(other.data, list):
+            common = min(len(self.children), len(other.children))
+            for i in range(common):
+                self.children[i]._diff(other.children[i], path + [i], changes)
+            for i in range(common, max(len(self.children), 
+                                       len(other.children))):
+                changes.append(make_json_pointer(path + [i]))
+        else:
+            changes.append(make_json_pointer(path))
+
+    def write_json(self, write, indentlevel=0):
+        """
+        Write this node as indented JSON text, one chunk at a time, by calling
+        write(chunk).  Objects are written in get_child_keys order, so the key
+        order of the original file (or the schema) survives a save.  Nothing
+        but the current path through the tree is held in memory, so memory 
+        use is bounded by the depth of the tree rather than the size of the
+        document.
+        """
+        if isinstance(self.data, dict):
+            keys = self.get_child_keys()
+            isobject = True
+        elif isinstance(self.data, list):
+            keys = range(len(self.children))
+            isobject = False
+        else:
+            write(encode_json_value(self.data))
+            return
+        if len(keys) == 0:
+            if isobject:
+                write("{}")
+            else:
+                write("[]")
+            return
+
+        indent = "\n" + " " * 4 * (indentlevel + 1)
+        if isobject:
+            separator = "{" + indent
+        else:
+            separator = "[" + indent
+        children = self.children
+        for key in keys:
+            child = children[key]
+            childdata = child.data
+            if isinstance(childdata, (dict, list)):
+                if isobject:
+                    write(separator + encode_json_value(key) + ": ")
+                else:
+                    write(separator)
+                child.write_json(write, indentlevel + 1)
+            elif isobject:
+                write(separator + encode_json_value(key) + ": " +
+                      encode_json_value(childdata))
+            else:
+                write(separator + encode_json_value(childdata))
+            separator = ", " + indent
+        if isobject:
+            write("\n" + " " * 4 * indentlevel + "}")
         else:
-            fd = open(self.filename, 'w+')
-        json.dump(self.get_data(), fd, indent=4, sort_keys=True)
-        self.savededitcount = self.editcount
+            write("\n" + " " * 4 * indentlevel + "]")
 
     def is_type_match(self, schemanode):
         # is the json type appropriate for the expected schema type?
@@ -125,13 +838,15 @@ class JsonNode(JsonBaseNode):
             init_object()
             for subkey, subdata in self.data.items():
                 self.children[subkey] = JsonNode(key=subkey, data=subdata,
-                    parent=self, schemanode=self.schemanode)
+                    parent=self, schemanode=self.schemanode,
+                    ordermap=self._get_child_order_map(subkey))
         elif self.schemanode.is_type('any') and self.is_type('array'):
             self.children = []
             i = 0
             for subdata in self.data:
                 self.children.append(JsonNode(key=i, data=subdata, parent=self,
-                    schemanode=self.schemanode))
+                    schemanode=self.schemanode,
+                    ordermap=self._get_child_order_map(i)))
                 i += 1
         elif self.is_type('object'):
             schemakeys = self.schemanode.get_child_keys()
@@ -162,13 +877,9 @@ class JsonNode(JsonBaseNode):
                     raise JsonNodeError(
                         "Invalid key: \"%s\" in %s%s.  Valid keys: %s" % 
                         (subkey, filename, idstring, validkeystring))
-                try:
-                    ordermap = self.ordermap['children'][subkey]
-                except AttributeError:
-                    ordermap = None
                 self.children[subkey] = JsonNode(key=subkey, data=subdata,
                     parent=self, schemanode=subschemanode, 
-                    ordermap=ordermap)
+                    ordermap=self._get_child_order_map(subkey))
               
             # iterate through the unpopulated schema keys and add subnodes if 
             # the nodes are required
@@ -180,16 +891,20 @@ class JsonNode(JsonBaseNode):
             i = 0
             for subdata in self.data:
                 subschemanode = self.schemanode.get_child(i)
-                try:
-                    ordermap = self.ordermap['children'][i]
-                except AttributeError:
-                    ordermap = None
                 self.children.append(JsonNode(key=i, data=subdata, parent=self,
-                    schemanode=subschemanode, ordermap=ordermap))
+                    schemanode=subschemanode,
+                    ordermap=self._get_child_order_map(i)))
                 i += 1
             if i == 0 and self.schemanode.get_child(0).is_required():
                 self.add_child(0)
 
+    def _get_child_order_map(self, key):
+        """Return the part of the file's order map belonging to a child"""
+        try:
+            return self.ordermap['children'][key]
+        except (AttributeError, KeyError, TypeError):
+            return None
+
     def get_schema_node(self):
         return self.schemanode
 
@@ -215,9 +930,56 @@ class JsonNode(JsonBaseNode):
 
         if not self.data == data:
             self.root.editcount += 1
+            self._set_modified(restructured=True)
+            changed = True
+        else:
+            changed = False
+        olddata = self.data
         self.data = data
+        oldchildren = None
+        if (changed and self._attached and 
+              (isinstance(data, (dict, list)) or 
+               isinstance(olddata, (dict, list)))):
+            # the children hold the data that gets saved, so they're 
+            # replaced along with the value (no need to build them first if 
+            # a lazy load hasn't yet)
+            unbuilt = self._unbuilt
+            if unbuilt:
+                oldchildren = []
+            else:
+                oldchildren = self.children
+            oldordermap = getattr(self, 'ordermap', None)
+            try:
+                self._rebuild_children()
+            except:
+                self.data = olddata
+                if unbuilt:
+                    del self.children
+                    self._unbuilt = True
+                else:
+                    self.children = oldchildren
+                self.ordermap = oldordermap
+                raise
         if(self.depth > 0):
             self.parent.set_child_data(self.key, data)
+        if changed:
+            self._emit(JsonNodeEvent(JsonNodeEvent.VALUE_CHANGED, self, 
+                                     value=data, oldvalue=olddata,
+                                     oldchildren=oldchildren))
+
+    def _rebuild_children(self):
+        """Build new children for a value that replaced this node's data"""
+        # the order map and spans were for the old value
+        self.ordermap = None
+        self._unbuilt = False
+        self.children = []
+        # required children added along the way are part of the new value,
+        # not separate edits
+        self._attached = False
+        try:
+            self.attach_schema_node(self.schemanode)
+        finally:
+            self._attached = True
 
     def get_children(self):
         """
@@ -239,8 +1001,25 @@ class JsonNode(JsonBaseNode):
         return self.children[key]
 
     def _get_key_order(self):
-        ordermap = self.schemanode._get_key_order()
-        return ordermap
+        """
+        Keys are ordered as the schema lists them, followed by any other keys
+        in the order they appeared in the original file.
+        """
+        keyorder = []
+        if self.schemanode.is_type('object'):
+            try:
+                keyorder = list(self.schemanode._get_key_order())
+            except (KeyError, TypeError):
+                # schemas built without an order map
+                pass
+        try:
+            filekeys = self.ordermap['keys']
+        except (AttributeError, KeyError, TypeError):
+            filekeys = []
+        if len(filekeys) > 0:
+            schemakeys = set(keyorder)
+            keyorder.extend([k for k in filekeys if k not in schemakeys])
+        return keyorder
 
     def get_available_keys(self):
         """
@@ -273,42 +1052,101 @@ class JsonNode(JsonBaseNode):
             raise JsonNodeError("type %s not implemented" % self.get_type())
 
     def set_child_data(self, key, data):
+        # the children are built from the data, so before it changes
+        self._build()
         if(self.data is None):
             type = self.schemanode.get_type()
-            self.data = self.schemanode.get_blank_value()
             self.root.editcount += 1
+            self._set_modified(restructured=True)
+            self.data = self.schemanode.get_blank_value()
+            self._emit(JsonNodeEvent(JsonNodeEvent.VALUE_CHANGED, self, 
+                                     value=self.data, oldvalue=None))
         if(self.is_type('array') and key == len(self.data)):
             self.data.append(data)
             self.root.editcount += 1
+            self._set_modified(restructured=True)
         else:
-            if not key in self.data or not self.data[key] == data:
+            # replacing a value is counted by the child's set_data, so only
+            # new object members count here
+            if isinstance(self.data, dict) and key not in self.data:
                 self.root.editcount += 1
             self.data[key] = data
 
     def is_saved(self):
-        return self.savededitcount == self.editcount
+        if self.savededitcount == self.editcount:
+            return True
+        # the edits may have been undone, or typed back to the saved value
+        if not self._savedhash:
+            return False
+        return self._get_digest() == self._savedhash
+
+    def saved_hash_step(self, limit=1000):
+        """
+        Hash up to limit more nodes towards the digest of the tree as last 
+        loaded or saved, which is_saved uses to notice edits that were 
+        undone or typed back.  Meant to be called when idle (like 
+        SearchIndex.build_step); returns True once there's nothing left to 
+        do, i.e. the digest is known or an edit has come first.
+        """
+        root = self.root
+        if root._savedhash is not None:
+            root._hashwalk = None
+            return True
+        if root._hashwalk is None:
+            root._hashwalk = [(root, False)]
+        stack = root._hashwalk
+        while len(stack) > 0 and limit > 0:
+            node, expanded = stack.pop()
+            if node._hash is not None:
+                continue
+            children = node.get_children()
+            if expanded or len(children) == 0:
+                # the children are hashed by now, so this is quick
+                node._get_digest()
+                limit -= 1
+            else:
+                stack.append((node, True))
+                stack.extend([(child, False) for child in children
+                              if child._hash is None])
+        if len(stack) > 0:
+            return False
+        root._hashwalk = None
+        root._savedhash = root._get_digest()
+        return True
 
     def set_saved(self, saved=True):
         if(saved):
             self.editcount = 0
+            self._savedhash = None
         else:
             self.editcount = 1
+            self._savedhash = False
         self.savededitcount = 0
 
+    def set_filename(self, filename):
+        JsonBaseNode.set_filename(self, filename)
+        # whatever was saved, it wasn't saved to this file
+        self._savedhash = False
+
     def add_child(self, key=None):
         schemanode = self.schemanode.get_child(key)
         newnode = JsonNode(key=key, data=schemanode.get_blank_value(),
                            parent=self, schemanode=schemanode)
         self.set_child_data(key, newnode.get_data())
+        self._set_modified(restructured=True)
         if(self.is_type('array')):
             self.children.insert(key, newnode)
         else:
             self.children[key] = newnode
+        self._emit(JsonNodeEvent(JsonNodeEvent.CHILD_INSERTED, self, 
+                                 key=key, child=newnode))
 
     def delete_child(self, key=None):
+        self._build()
         self.root.editcount += 1
+        self._set_modified(restructured=True)
         self.data.pop(key)
-        self.children.pop(key)
+        oldnode = self.children.pop(key)
 
         # since children keep track of their own keys, we have to refresh
         # them
@@ -319,9 +1157,13 @@ class JsonNode(JsonBaseNode):
         # propogate the change up the tree
         if(self.depth > 0):
             self.parent.set_child_data(self.key, self.data)
+        self._emit(JsonNodeEvent(JsonNodeEvent.CHILD_REMOVED, self, 
+                                 key=key, child=oldnode))
 
     def insert_child(self, key=None):
+        self._build()
         self.root.editcount += 1
+        self._set_modified(restructured=True)
         schemanode = self.schemanode.get_child(key)
         newnode = JsonNode(key=key, data=schemanode.get_blank_value(),
                            parent=self, schemanode=schemanode)
@@ -332,6 +1174,41 @@ class JsonNode(JsonBaseNode):
         # them
         for i in range(len(self.children)):
              self.children[i].set_key(i)
+        self._emit(JsonNodeEvent(JsonNodeEvent.CHILD_INSERTED, self, 
+                                 key=key, child=newnode))
+
+    def make_child_node(self, key, data):
+        """Build a JsonNode for data to go at key, without attaching it"""
+        if self.schemanode.is_type('any'):
+            schemanode = self.schemanode
+        else:
+            schemanode = self.schemanode.get_child(key)
+        return JsonNode(key=key, data=data, parent=self, 
+                        schemanode=schemanode)
+
+    def attach_child(self, key, node):
+        """
+        Put node (built with make_child_node, or removed from this node 
+        earlier) into this node at key.  Later items in an array shift up.
+        """
+        self._build()
+        if self.data is None:
+            self.set_data(self.schemanode.get_blank_value())
+        self.root.editcount += 1
+        self._set_modified(restructured=True)
+        # the node's spans may refer to an older version of the file
+        node.span = None
+        if isinstance(self.data, list):
+            self.data.insert(key, node.data)
+            self.children.insert(key, node)
+            for i in range(key, len(self.children)):
+                self.children[i].set_key(i)
+        else:
+            self.data[key] = node.data
+            self.children[key] = node
+            node.set_key(key)
+        self._emit(JsonNodeEvent(JsonNodeEvent.CHILD_INSERTED, self, 
+                                 key=key, child=node))
 
     def is_enum(self):
         return self.schemanode.is_enum()
@@ -429,9 +1306,200 @@ class JsonNode(JsonBaseNode):
             raise JsonNodeError("%s is already in use" % newkey)
         if oldkey != newkey:
             self.root.editcount += 1
+            self._set_modified(restructured=True)
             node = self.children.pop(oldkey)
             self.children[newkey] = node
             node.set_key(newkey)
             data = self.data.pop(oldkey)
             self.data[newkey] = data
+            self._emit(JsonNodeEvent(JsonNodeEvent.KEY_RENAMED, self, 
+                                     key=newkey, child=node, oldkey=oldkey))
+
+    def get_path(self):
+        """List of keys leading from the root to this node"""
+        path = []
+        node = self
+        while node.parent is not None:
+            path.append(node.key)
+            node = node.parent
+        path.reverse()
+        return path
+
+    def get_pointer(self):
+        """JSON Pointer (RFC 6901) to this node"""
+        return make_json_pointer(self.get_path())
+
+    def resolve_pointer(self, pointer):
+        """
+        Return (parentnode, key) for the node that pointer refers to, relative
+        to this node.  The node itself need not exist yet.  Returns 
+        (None, None) for the empty pointer.
+        """
+        tokens = split_json_pointer(pointer)
+        if len(tokens) == 0:
+            return None, None
+        node = self
+        for token in tokens[:-1]:
+            node = node.get_child(node._pointer_key(token))
+        return node, node._pointer_key(tokens[-1])
+
+    def get_node_by_pointer(self, pointer):
+        """Return the node that a JSON Pointer refers to"""
+        try:
+            parent, key = self.resolve_pointer(pointer)
+            if parent is None:
+                return self
+            return parent.get_child(key)
+        except (KeyError, IndexError, ValueError, TypeError):
+            raise JsonNodeError("No node at %s" % pointer)
+
+    def _pointer_key(self, token):
+        try:
+            if isinstance(self.children, list):
+                return int(token)
+            return token
+        except ValueError:
+            raise JsonNodeError("Invalid array index: %s" % token)
+
+    def add_listener(self, callback, subtree=False):
+        """
+        Call callback(event) with a JsonNodeEvent whenever this node's value 
+        is replaced or its children are inserted, removed or renamed.  With 
+        subtree set, changes anywhere below this node are reported as well.
+        """
+        if self._listeners is None:
+            self._listeners = []
+        self._listeners.append((callback, subtree))
+
+    def remove_listener(self, callback):
+        if self._listeners is None:
+            return
+        self._listeners = [listener for listener in self._listeners 
+                           if listener[0] != callback]
+        if len(self._listeners) == 0:
+            self._listeners = None
+
+    def _emit(self, event):
+        """Pass event to the listeners of this node and its ancestors"""
+        if not self._attached:
+            # still building the tree
+            return
+        if self.root._batchevents is not None:
+            self.root._batchevents.append(event)
+            return
+        self._notify(event)
+
+    def _notify(self, event):
+        node = self
+        while node is not None:
+            if node._listeners is not None:
+                for callback, subtree in list(node._listeners):
+                    if subtree or node is self:
+                        callback(event)
+            node = node.parent
+
+    def set_journal(self, journal):
+        """Record every edit to this tree in journal (an EditJournal)"""
+        root = self.root
+        if root.journal is not None:
+            root.remove_listener(root.journal.handle_event)
+        root.journal = journal
+        if journal is not None:
+            root.add_listener(journal.handle_event, subtree=True)
+
+    def get_journal(self):
+        return self.root.journal
+
+    def set_history(self, history):
+        """Record undo information for this tree in history (EditHistory)"""
+        root = self.root
+        if root.history is not None:
+            root.remove_listener(root.history.handle_event)
+        root.history = history
+        if history is not None:
+            root.add_listener(history.handle_event, subtree=True)
+
+    def get_history(self):
+        return self.root.history
+
+    def undo(self):
+        """Undo the last edit step.  See EditHistory.undo"""
+        return self.root.history.undo()
+
+    def redo(self):
+        """Redo the last undone edit step.  See EditHistory.redo"""
+        return self.root.history.redo()
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Context manager grouping edits to this tree into one transaction:
+            with jsonnode.batch():
+                ...
+        Listeners (including the journal and undo history) hear about the
+        edits when the outermost batch ends, all in one go; the edits form a 
+        single undo step, and count as one edit.  If the block raises, its 
+        edits are rolled back without listeners hearing about them.
+        """
+        root = self.root
+        outermost = root._batchevents is None
+        if outermost:
+            root._batchevents = []
+            editcount = root.editcount
+        start = len(root._batchevents)
+        try:
+            yield self
+        except:
+            try:
+                root._rollback_batch(start)
+            finally:
+                if outermost:
+                    root._batchevents = None
+                    root.editcount = editcount
+            raise
+        if outermost:
+            events = root._batchevents
+            root._batchevents = None
+            if root.editcount != editcount:
+                root.editcount = editcount + 1
+            root._commit_batch(events)
+
+    def _rollback_batch(self, start):
+        """Undo the edits behind the batched events from start onward"""
+        from jsonwidget.undo import EditHistory
+        events = self._batchevents[start:]
+        del self._batchevents[start:]
+        history = EditHistory()
+        history.begin_group()
+        for event in events:
+            history.handle_event(event)
+        # the events from undoing are dropped along with the edits
+        heldevents = self._batchevents
+        self._batchevents = []
+        try:
+            history.rollback_group()
+        finally:
+            self._batchevents = heldevents
+
+    def _commit_batch(self, events):
+        if self.history is not None:
+            self.history.begin_group()
+        if self.journal is not None:
+            self.journal.begin_batch()
+        try:
+            for event in events:
+                event.node._notify(event)
+        finally:
+            if self.journal is not None:
+                self.journal.end_batch()
+            if self.history is not None:
+                self.history.end_group()
+
+    def apply_patch(self, ops):
+        """
+        Apply a JSON Patch (RFC 6902) to this node, all or nothing.  See
+        jsonwidget.jsonpatch
+        """
+        from jsonwidget.jsonpatch import apply_patch
+        apply_patch(self, ops)
 
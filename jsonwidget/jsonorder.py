@@ -62,7 +62,8 @@ class JsonOrderMap(object):
         
     The return value from get_order_map holds ordered lists of keys associated
     with the JSON file (organized into a hierarchy of dicts mirroring the 
-    original JSON).
+    original JSON).  Each entry also records the "span" of its value: the 
+    (start, end) byte offsets of the value in the buffer.
     """
     def __init__(self, jsonbuffer): 
         self._buffer = jsonbuffer
@@ -102,6 +103,7 @@ class JsonOrderMap(object):
 
     def _process_value(self, results, ordermap, depth=0, key=[]):
         type, start, end, child = results
+        ordermap['span'] = (start, end)
         if type == 'object':
             self._process_object(child, ordermap, depth=depth, key=key)
         elif type == 'array':
@@ -115,6 +117,31 @@ class JsonOrderMap(object):
         return self._ordermap
 
 
+def merge_order_maps(a, b):
+    """
+    Combine two order maps.  Keys from "a" come first, followed by any keys
+    only found in "b".  The merge is associative, so order maps from many
+    documents can be combined in any grouping.
+    """
+    if not a:
+        return b
+    if not b:
+        return a
+    keys = list(a.get('keys', []))
+    seen = set(keys)
+    for key in b.get('keys', []):
+        if key not in seen:
+            keys.append(key)
+            seen.add(key)
+    children = dict(a.get('children', {}))
+    for key, child in b.get('children', {}).items():
+        if key in children:
+            children[key] = merge_order_maps(children[key], child)
+        else:
+            children[key] = child
+    return {'keys': keys, 'children': children}
+
+
 if __name__ == "__main__":
     import json
     import optparse
@@ -0,0 +1,183 @@
+#!/usr/bin/python
+# JSON Patch (RFC 6902) for JsonNode trees
+#
+# Copyright (c) 2010, Rob Lanphier
+# All rights reserved.
+# Licensed under BSD-style license.  See LICENSE.txt for details.
+
+"""
+Apply RFC 6902 JSON Patch documents to JsonNode trees.
+
+Patches are applied atomically: if any operation fails (including a "test"
+operation, or a value which doesn't fit the schema), the operations already
+applied are undone and JsonPatchError is raised.  Each value added by the
+patch is checked against the schema as its node is built, so only the
+touched subtrees are revalidated.  The patch is applied as one
+JsonNode.batch(), so it counts as one edit, and is one step in the undo 
+history.
+"""
+
+import copy
+
+from jsonwidget.jsonnode import JsonNode, JsonNodeError, make_json_pointer, \
+    split_json_pointer
+
+
+class JsonPatchError(JsonNodeError):
+    pass
+
+
+def apply_patch(jsonnode, ops):
+    """Apply the list of operations ops, with paths relative to jsonnode"""
+    # the batch rolls back everything if an operation fails
+    with jsonnode.batch():
+        for i, op in enumerate(ops):
+            try:
+                _apply_op(jsonnode, op)
+            except Exception as inst:
+                raise JsonPatchError("Patch operation %i (%s) failed: %s" %
+                                     (i, _describe_op(op), inst))
+
+
+def _describe_op(op):
+    try:
+        return "%s %s" % (op['op'], op['path'])
+    except (KeyError, TypeError):
+        return repr(op)
+
+
+def _apply_op(jsonnode, op):
+    name = op['op']
+    path = op['path']
+    if name == 'add':
+        _add(jsonnode, path, copy.deepcopy(op['value']))
+    elif name == 'remove':
+        _remove(jsonnode, path)
+    elif name == 'replace':
+        _replace(jsonnode, path, copy.deepcopy(op['value']))
+    elif name == 'move':
+        frompath = op['from']
+        if frompath == path:
+            return
+        if path.startswith(frompath + "/"):
+            raise JsonPatchError("can't move a value into itself")
+        value = jsonnode.get_node_by_pointer(frompath).get_data()
+        _remove(jsonnode, frompath)
+        _add(jsonnode, path, copy.deepcopy(value))
+    elif name == 'copy':
+        value = jsonnode.get_node_by_pointer(op['from']).get_data()
+        _add(jsonnode, path, copy.deepcopy(value))
+    elif name == 'test':
+        value = jsonnode.get_node_by_pointer(path).get_data()
+        if not _json_equal(value, op['value']):
+            raise JsonPatchError("test failed")
+    else:
+        raise JsonPatchError("unknown operation %s" % name)
+
+
+def _resolve(jsonnode, path, adding=False):
+    """
+    Return (parent, key) for path.  With adding set, the key may be one past
+    the end of an array ("-" included).
+    """
+    tokens = split_json_pointer(path)
+    if len(tokens) == 0:
+        return None, None
+    parent = jsonnode.get_node_by_pointer(make_json_pointer(tokens[:-1]))
+    token = tokens[-1]
+    children = parent.get_children()
+    if isinstance(parent.children, list):
+        if adding and token == "-":
+            return parent, len(children)
+        try:
+            key = int(token)
+        except ValueError:
+            raise JsonPatchError("invalid array index %s" % token)
+        limit = len(children)
+        if adding:
+            limit += 1
+        if key < 0 or key >= limit:
+            raise JsonPatchError("array index %s out of range" % token)
+        return parent, key
+    if isinstance(parent.children, dict):
+        if not adding and token not in parent.children:
+            raise JsonPatchError("no member %s" % token)
+        return parent, token
+    raise JsonPatchError("%s isn't an object or array" % parent.get_pointer())
+
+
+def _add(jsonnode, path, value):
+    parent, key = _resolve(jsonnode, path, adding=True)
+    if parent is None:
+        _replace_whole(jsonnode, value)
+        return
+    newnode = parent.make_child_node(key, value)
+    if isinstance(parent.children, dict) and key in parent.children:
+        parent.delete_child(key)
+    parent.attach_child(key, newnode)
+
+
+def _remove(jsonnode, path):
+    parent, key = _resolve(jsonnode, path)
+    if parent is None:
+        raise JsonPatchError("can't remove the whole document")
+    if not parent.get_child(key).is_deletable():
+        raise JsonPatchError("%s is required" % path)
+    parent.delete_child(key)
+
+
+def _replace(jsonnode, path, value):
+    parent, key = _resolve(jsonnode, path)
+    if parent is None:
+        _replace_whole(jsonnode, value)
+        return
+    newnode = parent.make_child_node(key, value)
+    parent.delete_child(key)
+    parent.attach_child(key, newnode)
+
+
+def _replace_whole(jsonnode, value):
+    """Replace the contents of jsonnode itself"""
+    parent = jsonnode.get_parent()
+    if parent is not None:
+        _replace(parent, make_json_pointer([jsonnode.get_key()]), value)
+        return
+    # the root node can't be swapped out, so swap out its contents instead
+    newnode = JsonNode(data=value, schemanode=jsonnode.get_schema_node())
+    if isinstance(value, dict) and isinstance(jsonnode.get_data(), dict):
+        keys = newnode.get_child_keys()
+    elif isinstance(value, list) and isinstance(jsonnode.get_data(), list):
+        keys = range(len(value))
+    elif isinstance(value, (dict, list)) or isinstance(jsonnode.get_data(),
+                                                       (dict, list)):
+        raise JsonPatchError("can't change the type of the whole document")
+    else:
+        jsonnode.set_data(value)
+        return
+    for key in reversed(jsonnode.get_child_keys()):
+        jsonnode.delete_child(key)
+    for key in keys:
+        jsonnode.attach_child(key, jsonnode.make_child_node(key, value[key]))
+
+
+def _json_equal(a, b):
+    """Compare values by JSON rules (so True doesn't equal 1)"""
+    if isinstance(a, bool) or isinstance(b, bool):
+        return isinstance(a, bool) and isinstance(b, bool) and a == b
+    if isinstance(a, dict) and isinstance(b, dict):
+        if set(a.keys()) != set(b.keys()):
+            return False
+        for key in a:
+            if not _json_equal(a[key], b[key]):
+                return False
+        return True
+    if isinstance(a, list) and isinstance(b, list):
+        if len(a) != len(b):
+            return False
+        for x, y in zip(a, b):
+            if not _json_equal(x, y):
+                return False
+        return True
+    if isinstance(a, (dict, list)) or isinstance(b, (dict, list)):
+        return False
+    return a == b
@@ -0,0 +1,148 @@
+#!/usr/bin/python
+# Locate values in JSON text without decoding it
+#
+# Copyright (c) 2010, Rob Lanphier
+# All rights reserved.
+# Licensed under BSD-style license.  See LICENSE.txt for details.
+
+"""
+Find the byte range of the value at a JSON Pointer in JSON text.
+
+The text is scanned rather than decoded: only the member names along the way
+are decoded, and everything else is skipped over with regular expressions,
+bracket by bracket.  Files are mapped into memory rather than read, so a small
+subtree of a huge file can be loaded without reading the rest of it into
+Python objects.  The text is assumed to be valid JSON; scanning doesn't check
+the parts it skips.
+"""
+
+import json
+import mmap
+import re
+
+from jsonwidget.jsonnode import make_json_pointer, split_json_pointer
+
+
+class JsonScanError(RuntimeError):
+    pass
+
+
+_ws_re = re.compile(r'[ \t\n\r]*')
+_string_re = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+_scalar_re = re.compile(r'[^,:\[\]{}" \t\n\r]+')
+# the next bracket which isn't inside a string.  Group 1 is set for opening
+# brackets.
+_bracket_re = re.compile(r'[^"\[\]{}]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^"\[\]{}]*)*'
+                         r'(?:([\[{])|[\]}])', re.DOTALL)
+
+
+def skip_value(buf, pos):
+    """Return the offset just past the value starting at pos"""
+    char = buf[pos:pos + 1]
+    if char == '"':
+        match = _string_re.match(buf, pos)
+        if match is None:
+            raise JsonScanError("unterminated string at byte %i" % pos)
+        return match.end()
+    if char == '{' or char == '[':
+        depth = 0
+        for match in _bracket_re.finditer(buf, pos):
+            if match.group(1) is not None:
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return match.end()
+        raise JsonScanError("unexpected end of text")
+    match = _scalar_re.match(buf, pos)
+    if match is None:
+        raise JsonScanError("expected a value at byte %i" % pos)
+    return match.end()
+
+
+def find_pointer_span(buf, pointer):
+    """
+    Return the (start, end) offsets of the value at pointer in buf, which can
+    be a string or a memory map
+    """
+    pos = _ws_re.match(buf, 0).end()
+    path = []
+    for token in split_json_pointer(pointer):
+        path.append(token)
+        pos = _find_member(buf, pos, token, path)
+    return pos, skip_value(buf, pos)
+
+
+def _find_member(buf, pos, token, path):
+    """Return the offset of the member token of the value at pos"""
+    char = buf[pos:pos + 1]
+    if char == '{':
+        close = '}'
+    elif char == '[':
+        close = ']'
+        try:
+            index = int(token)
+        except ValueError:
+            raise JsonScanError("invalid array index %s" % token)
+    else:
+        raise JsonScanError("%s isn't an object or array" %
+                            make_json_pointer(path[:-1]))
+    pos = _ws_re.match(buf, pos + 1).end()
+    i = 0
+    if buf[pos:pos + 1] != close:
+        while True:
+            if close == '}':
+                match = _string_re.match(buf, pos)
+                if match is None:
+                    raise JsonScanError("expected a member name at byte %i" %
+                                        pos)
+                pos = _ws_re.match(buf, match.end()).end()
+                if buf[pos:pos + 1] != ':':
+                    raise JsonScanError("expected ':' at byte %i" % pos)
+                pos = _ws_re.match(buf, pos + 1).end()
+                found = json.loads(match.group()) == token
+            else:
+                found = i == index
+            if found:
+                return pos
+            pos = _ws_re.match(buf, skip_value(buf, pos)).end()
+            char = buf[pos:pos + 1]
+            if char == close:
+                break
+            if char != ',':
+                raise JsonScanError("expected ',' or '%s' at byte %i" %
+                                    (close, pos))
+            pos = _ws_re.match(buf, pos + 1).end()
+            i += 1
+    raise JsonScanError("No node at %s" % make_json_pointer(path))
+
+
+def read_pointer(filename, pointer):
+    """
+    Return (start, end, text) for the value at pointer in the file filename
+    """
+    def read(buf):
+        start, end = find_pointer_span(buf, pointer)
+        return start, end, buf[start:end]
+    return _scan_file(filename, read)
+
+
+def find_file_pointer_span(filename, pointer):
+    """Return the (start, end) offsets of the value at pointer in filename"""
+    return _scan_file(filename, 
+                      lambda buf: find_pointer_span(buf, pointer))
+
+
+def _scan_file(filename, scan):
+    """Return scan(buf), with buf the contents of filename"""
+    with open(filename, 'rb') as f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError):
+            # empty files (and special files) can't be mapped
+            buf = f.read()
+        try:
+            return scan(buf)
+        finally:
+            if isinstance(buf, mmap.mmap):
+                buf.close()
@@ -0,0 +1,283 @@
+#!/usr/bin/python
+# Incremental search over JsonNode trees
+#
+# Copyright (c) 2010, Rob Lanphier
+# All rights reserved.
+# Licensed under BSD-style license.  See LICENSE.txt for details.
+
+"""
+Search a JsonNode tree by member name, value, or JSON Pointer prefix.
+
+SearchIndex keeps an inverted index from the words in each node's member
+name and (scalar) value to the nodes holding them, so each search only looks
+at the words starting with what's been typed so far.  The index can be built
+a bit at a time with build_step (e.g. while the editor is idle); searching
+finishes building it first.  Once built, it's kept up to date from the tree's
+change events, so edits cost only the nodes they touch.
+
+Queries:
+    "foo bar"   nodes with words starting with "foo" and "bar" in their
+                member name or value
+    "/a/b/f"    members of /a/b whose name starts with "f"
+"""
+
+import bisect
+import json
+import re
+
+from jsonwidget.jsonnode import JsonNodeEvent, JsonNodeError, \
+    make_json_pointer, split_json_pointer
+
+
+_word_re = re.compile(r'\w+', re.UNICODE)
+
+
+def get_words(text):
+    """Split text into lower case words"""
+    return _word_re.findall(text.lower())
+
+
+def get_document_position(node, indexes=None):
+    """
+    Return a list of the positions of node and its ancestors among their 
+    siblings, for comparing with other nodes.  indexes is an optional dict
+    for reusing the positions of object members between calls.
+    """
+    if indexes is None:
+        indexes = {}
+    path = []
+    while node.parent is not None:
+        parent = node.parent
+        if isinstance(parent.children, list):
+            path.append(node.key)
+        else:
+            if parent not in indexes:
+                indexes[parent] = dict([(key, i) for i, key
+                                        in enumerate(parent.get_child_keys())])
+            path.append(indexes[parent][node.key])
+        node = parent
+    path.reverse()
+    return path
+
+
+class SearchIndex(object):
+    def __init__(self, jsonnode):
+        self.json = jsonnode
+        # word -> set of nodes with it
+        self._postings = {}
+        # node -> words indexed for it
+        self._nodewords = {}
+        # sorted list of the words in _postings, rebuilt when needed
+        self._words = None
+        # nodes left to index (along with their children)
+        self._pending = [jsonnode]
+        # object -> {key: position of member}, for get_document_position
+        self._keyindexes = {}
+        # (words or pointer, positions, nodes) for the last search, until the
+        # next edit
+        self._lastresults = None
+        jsonnode.add_listener(self._handle_json_event, subtree=True)
+
+    def close(self):
+        """Stop following changes to the tree"""
+        self.json.remove_listener(self._handle_json_event)
+
+    def is_built(self):
+        return len(self._pending) == 0
+
+    def build_step(self, limit=1000):
+        """Index up to limit more nodes.  Returns True once it's all built."""
+        while len(self._pending) > 0 and limit > 0:
+            node = self._pending.pop()
+            if not self._is_in_tree(node):
+                # removed before we got to it
+                continue
+            self._index_node(node)
+            children = node.get_children()
+            if isinstance(children, list):
+                self._pending.extend(reversed(children))
+            else:
+                self._pending.extend(children.values())
+            limit -= 1
+        return self.is_built()
+
+    def build(self):
+        while not self.build_step():
+            pass
+
+    def search(self, query):
+        """Return the nodes matching query, in document order"""
+        return self._get_results(query)[1]
+
+    def find(self, query, position, reverse=False, inclusive=False):
+        """
+        Return (i, matches), where matches is the result of search(query) and
+        matches[i] is the first match after position (a list from 
+        get_document_position), or the last one before it with reverse set.
+        The search wraps around at the ends.  With inclusive set, a match at
+        position counts as being after it.  i is None if nothing matches.
+        """
+        positions, matches = self._get_results(query)
+        if len(matches) == 0:
+            return None, matches
+        if reverse:
+            i = bisect.bisect_left(positions, position) - 1
+        elif inclusive:
+            i = bisect.bisect_left(positions, position)
+        else:
+            i = bisect.bisect_right(positions, position)
+        return i % len(matches), matches
+
+    def get_position(self, node):
+        return get_document_position(node, self._keyindexes)
+
+    def _get_results(self, query):
+        if query.startswith("/"):
+            terms = query
+        else:
+            terms = tuple(get_words(query))
+        if self._lastresults is not None and self._lastresults[0] == terms:
+            return self._lastresults[1:]
+        self.build()
+        if isinstance(terms, tuple):
+            found = self._search_words(terms)
+        else:
+            found = self._search_pointer(terms)
+        if self._is_refinement(terms):
+            # typing more only narrows down the last results, which are
+            # already in order
+            lastterms, positions, nodes = self._lastresults
+            results = [(position, node) for position, node 
+                       in zip(positions, nodes) if node in found]
+        else:
+            # put them in the order they're shown
+            results = [(self.get_position(node), node) for node in found]
+            results.sort()
+        positions = [position for position, node in results]
+        nodes = [node for position, node in results]
+        self._lastresults = (terms, positions, nodes)
+        return positions, nodes
+
+    def _is_refinement(self, words):
+        """Are the results for words a subset of the last results?"""
+        if self._lastresults is None:
+            return False
+        lastwords = self._lastresults[0]
+        if not isinstance(words, tuple) or not isinstance(lastwords, tuple):
+            return False
+        if len(lastwords) == 0 or len(words) < len(lastwords):
+            return False
+        for lastword, word in zip(lastwords, words):
+            if not word.startswith(lastword):
+                return False
+        return True
+
+    def _search_words(self, words):
+        if len(words) == 0:
+            return set()
+        if self._words is None:
+            self._words = sorted(self._postings.keys())
+        nodes = None
+        for word in words:
+            found = set()
+            i = bisect.bisect_left(self._words, word)
+            while i < len(self._words) and self._words[i].startswith(word):
+                found.update(self._postings[self._words[i]])
+                i += 1
+            if nodes is None:
+                nodes = found
+            else:
+                nodes &= found
+            if len(nodes) == 0:
+                break
+        return nodes
+
+    def _search_pointer(self, query):
+        tokens = split_json_pointer(query)
+        try:
+            parent = self.json.get_node_by_pointer(
+                make_json_pointer(tokens[:-1]))
+        except JsonNodeError:
+            return []
+        prefix = tokens[-1]
+        children = parent.get_children()
+        if isinstance(children, list):
+            return [child for child in children
+                    if str(child.get_key()).startswith(prefix)]
+        return [child for key, child in children.items()
+                if key.startswith(prefix)]
+
+    def _is_in_tree(self, node):
+        while node is not self.json:
+            if node.parent is None:
+                return False
+            try:
+                if node.parent.children[node.key] is not node:
+                    return False
+            except (KeyError, IndexError, TypeError):
+                return False
+            node = node.parent
+        return True
+
+    def _get_node_words(self, node):
+        words = []
+        if node.parent is not None and isinstance(node.key, basestring):
+            words.extend(get_words(node.key))
+        data = node.get_data()
+        if isinstance(data, basestring):
+            words.extend(get_words(data))
+        elif not isinstance(data, (dict, list)):
+            words.extend(get_words(json.dumps(data)))
+        return set(words)
+
+    def _index_node(self, node):
+        self._unindex_node(node)
+        words = self._get_node_words(node)
+        if len(words) == 0:
+            return
+        self._nodewords[node] = words
+        for word in words:
+            if word not in self._postings:
+                self._postings[word] = set()
+                self._words = None
+            self._postings[word].add(node)
+
+    def _unindex_node(self, node):
+        words = self._nodewords.pop(node, ())
+        for word in words:
+            nodes = self._postings[word]
+            nodes.discard(node)
+            if len(nodes) == 0:
+                del self._postings[word]
+                self._words = None
+
+    def _unindex_subtree(self, node):
+        stack = [node]
+        while len(stack) > 0:
+            node = stack.pop()
+            self._unindex_node(node)
+            stack.extend(node.get_children())
+
+    def _get_child_list(self, children):
+        if isinstance(children, dict):
+            return children.values()
+        return children
+
+    def _handle_json_event(self, event):
+        self._lastresults = None
+        if event.type != JsonNodeEvent.VALUE_CHANGED:
+            self._keyindexes.pop(event.node, None)
+        if event.type == JsonNodeEvent.VALUE_CHANGED:
+            self._index_node(event.node)
+            if event.oldchildren is not None:
+                self._keyindexes.pop(event.node, None)
+                for child in self._get_child_list(event.oldchildren):
+                    self._unindex_subtree(child)
+                self._pending.extend(
+                    self._get_child_list(event.node.get_children()))
+        elif event.type == JsonNodeEvent.CHILD_INSERTED:
+            self._pending.append(event.child)
+        elif event.type == JsonNodeEvent.CHILD_REMOVED:
+            self._unindex_subtree(event.child)
+        elif event.type == JsonNodeEvent.KEY_RENAMED:
+            self._index_node(event.child)
@@ -7,6 +7,7 @@
 #
 # classes:
 # RetroMainLoop - Main event loop base routines
+# PinotMainLoop - Event-driven replacement for RetroMainLoop
 # PinotUserInterface - pine/pico/nano-inspired user interface routines
 # PinotFileEditor - Standalone file editor methods (load file, save file)
 #
@@ -30,8 +31,10 @@ class PinotAlert(Exception):
 
 
 import urwid.curses_display
+import urwid.raw_display
 import urwid
 import threading
+import time
 import sys
 import os
 
@@ -49,7 +52,7 @@ class RetroMainLoop(object):
     """
 
     def __init__(self, program_name="RetroMainLoop", unhandled_input=None):
-        self.ui = urwid.curses_display.Screen()
+        self.ui = self.get_screen()
         self.ui.register_palette([
             ('body', 'black', 'light gray'),
             ('selected', 'black', 'dark green', ('bold','underline')),
@@ -79,16 +82,24 @@ class RetroMainLoop(object):
         self.notificationtimer = None
         self._unhandled_input = unhandled_input
 
+    def get_screen(self):
+        return urwid.curses_display.Screen()
+
+    def set_monochrome(self):
+        """Draw with the mono settings of the palette, even in colour"""
+        self._monochrome = True
+
     def run(self):
         header = self.get_header()
         body = self.get_body()
         footer = self.get_footer()
 
         self.view = urwid.Frame(body, header=header, footer=footer)
+        self.setup_loop()
         self.on_init()
 
         try:
-            self.ui.run_wrapper(self.run_loop)
+            self.start_loop()
         except PinotExit:
             pass
 
@@ -98,7 +109,16 @@ class RetroMainLoop(object):
         if not self.endstatusmessage == "":
             print self.endstatusmessage,
 
+    def setup_loop(self):
+        pass
+
+    def start_loop(self):
+        self.ui.run_wrapper(self.run_loop)
+
     def run_loop(self):
+        if getattr(self, '_monochrome', False):
+            # the screen looks for colour support when it starts
+            self.ui.has_color = False
         size = self.ui.get_cols_rows()
         while(True):
             self.set_header()
@@ -118,18 +138,162 @@ class RetroMainLoop(object):
                 if key == 'window resize':
                     size = self.ui.get_cols_rows()
                 else:
-                    if self._unhandled_input is not None:
-                        key = self._unhandled_input(key)
-                    if key is not None:
-                        try:
-                            self.view.keypress(size, key)
-                        except PinotAlert as inst:
-                            self.display_notification(str(inst))
+                    self.handle_key(size, key)
+
+    def handle_key(self, size, key):
+        if self._unhandled_input is not None:
+            key = self._unhandled_input(key)
+        if key is not None:
+            try:
+                self.view.keypress(size, key)
+            except PinotAlert as inst:
+                self.display_notification(str(inst))
+
+    def clear_screen(self):
+        """Force a full repaint on the next redraw"""
+        self.ui.clear()
+
+    def set_alarm(self, seconds, callback):
+        """Call callback() in seconds.  Returns a handle for remove_alarm"""
+        timer = threading.Timer(seconds, callback)
+        timer.start()
+        return timer
+
+    def remove_alarm(self, handle):
+        handle.cancel()
+
+    def run_when_idle(self, callback):
+        """
+        Call callback() now and then while waiting for input, until it 
+        returns True.  Here it's never called, so callback must not be needed 
+        for anything but getting a head start on work.
+        """
+        pass
 
     def on_init(self):
         pass
 
-class PinotUserInterface(RetroMainLoop):
+
+class PinotMainLoop(RetroMainLoop):
+    """
+    Event-driven main loop, built on urwid.MainLoop.  Rather than waking up
+    every half second to redraw everything, it sleeps until there's input or
+    an alarm is due, and then redraws.  Widgets which haven't changed since 
+    the last redraw (and so haven't invalidated their canvases) aren't 
+    rendered again, and only the changed parts of the terminal are written.
+    """
+    def get_screen(self):
+        # raw_display can be watched by the select loop, along with any other
+        # file descriptors (see watch_pipe)
+        return urwid.raw_display.Screen()
+
+    def set_monochrome(self):
+        """Draw with the mono settings of the palette, even in colour"""
+        self.ui.set_terminal_properties(colors=1)
+
+    def setup_loop(self):
+        self.loop = urwid.MainLoop(self.view, screen=self.ui, 
+                                   handle_mouse=False,
+                                   input_filter=self._filter_input)
+
+    def start_loop(self):
+        self.loop.run()
+
+    def _filter_input(self, keys, raw):
+        """Handle the keys ourselves, passing on only resizes to the loop"""
+        size = self.loop.screen_size
+        if size is None:
+            size = self.ui.get_cols_rows()
+        for key in keys:
+            if key != 'window resize':
+                self.handle_key(size, key)
+        self.refresh_header()
+        return [key for key in keys if key == 'window resize']
+
+    def refresh_header(self):
+        """Update the header after input, if it needs it (virtual function)"""
+        pass
+
+    def clear_screen(self):
+        # the screen only redraws what changed, and nothing else draws on it
+        pass
+
+    def set_alarm(self, seconds, callback):
+        return self.loop.set_alarm_in(seconds, lambda loop, data: callback())
+
+    def remove_alarm(self, handle):
+        self.loop.remove_alarm(handle)
+
+    def run_when_idle(self, callback):
+        # the short delay lets the loop redraw the screen (and handle any 
+        # input) between calls
+        def step(loop, data):
+            if not callback():
+                self.loop.set_alarm_in(0.01, step)
+        self.loop.set_alarm_in(0.01, step)
+
+    def watch_pipe(self, callback):
+        """
+        Return a file descriptor which other threads can write to, so that
+        callback(data) is called (and the screen redrawn) in the main loop
+        """
+        return self.loop.watch_pipe(callback)
+
+    def run_in_thread(self, func, ondone, onprogress=None):
+        """
+        Call func(progress) in a worker thread, then ondone(result, excinfo)
+        in the main loop, where excinfo is the sys.exc_info() of whatever 
+        func raised, or None.  func can call progress(stage, done, total) 
+        as it goes, and the latest report is passed on to onprogress in the
+        main loop (no more than ten times a second within a stage).  Returns
+        the thread, which doesn't keep the program from exiting.
+        """
+        # latest report, (time, stage) it was sent, and (result, excinfo)
+        latest = [None]
+        lastsent = [0, None]
+        outcome = []
+
+        def progress(stage, done, total):
+            now = time.time()
+            if now - lastsent[0] < 0.1 and stage == lastsent[1]:
+                return
+            lastsent[:] = [now, stage]
+            latest[0] = (stage, done, total)
+            os.write(pipe, "p")
+
+        def work():
+            try:
+                outcome.append((func(progress), None))
+            except:
+                outcome.append((None, sys.exc_info()))
+            os.write(pipe, "d")
+            os.close(pipe)
+
+        def handle(data):
+            if len(outcome) > 0:
+                result, excinfo = outcome[0]
+                ondone(result, excinfo)
+                # done with the pipe
+                return False
+            if latest[0] is not None and onprogress is not None:
+                onprogress(*latest[0])
+            return True
+
+        pipe = self.watch_pipe(handle)
+        thread = threading.Thread(target=work)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+# urwid versions before 0.9.9 have no MainLoop
+if hasattr(urwid, 'MainLoop'):
+    MainLoopBase = PinotMainLoop
+else:
+    MainLoopBase = RetroMainLoop
+
+
+class PinotUserInterface(MainLoopBase):
     """
     pine/pico/nano-inspired user interface routines
     These are the routines that implement the standard look-and-feel of the
@@ -139,7 +303,8 @@ class PinotUserInterface(RetroMainLoop):
     def __init__(self, **kwargs):
         self._default_footer_helpitems = None
         self.set_startup_notification(None)
-        RetroMainLoop.__init__(self, **kwargs)
+        self._headertext = None
+        MainLoopBase.__init__(self, **kwargs)
 
     def get_header(self):
         headerleft = urwid.Text(self.get_left_header_text(), align='left')
@@ -171,12 +336,22 @@ class PinotUserInterface(RetroMainLoop):
     def set_header(self):
         header = self.get_header()
         self.view.set_header(header)
+        self._headertext = self._get_header_text()
+
+    def refresh_header(self):
+        """Rebuild the header only if its text has changed"""
+        if self._get_header_text() != self._headertext:
+            self.set_header()
+
+    def _get_header_text(self):
+        return (self.get_left_header_text(), self.get_center_header_text(),
+                self.get_right_header_text())
 
     def set_body(self):
         body = self.get_body()
         self.view.set_body(body)
         # Test if this is really needed
-        self.ui.clear()
+        self.clear_screen()
 
     def get_body(self):
         return self.listbox
@@ -186,12 +361,11 @@ class PinotUserInterface(RetroMainLoop):
         self.view.set_footer(urwid.Pile(widgets))
 
     def set_notification_timer(self, time):
-        self.notificationtimer = threading.Timer(time, self.set_default_footer)
-        self.notificationtimer.start()
+        self.notificationtimer = self.set_alarm(time, self.set_default_footer)
 
     def set_default_footer(self):
         self.view.set_footer(self.get_footer())
-        self.ui.clear()
+        self.clear_screen()
 
     def set_default_footer_helpitems(self, helpitems=None):
         self._default_footer_helpitems = helpitems
@@ -203,7 +377,8 @@ class PinotUserInterface(RetroMainLoop):
    
     def clear_notification_timer(self):
         if self.notificationtimer is not None:
-            self.notificationtimer.cancel()
+            self.remove_alarm(self.notificationtimer)
+            self.notificationtimer = None
 
     def get_notification_widget(self, widget=None, active=False):
         if widget is None:
@@ -300,9 +475,15 @@ class PinotFileEditor(PinotUserInterface):
     These routines deal with the specifics of an editor that loads/saves
     files.  There shouldn't be anything JSON-specific in this
     """
+    # worker thread of the save being written in the background, if any
+    _savethread = None
 
     def handle_write_to_request(self, exit_on_save=False):
         """Handle ctrl w - "write/save"."""
+        if self.is_saving():
+            self.display_notification("Still saving " + 
+                                      self.file.get_filename())
+            return
         entryform = self
 
         class CallbackEdit(urwid.Edit):
@@ -312,21 +493,28 @@ class PinotFileEditor(PinotUserInterface):
                 if key == 'enter':
                     currentfilename = entryform.file.get_filename()
                     entryform.file.set_filename(self.get_edit_text())
-                    try:
-                        entryform.handle_save()
-                        msg = "Saved " + entryform.file.get_filename()
-                    except Exception as inst:
-                        msg = "FAILED TO WRITE %s - %s: %s" % (
-                            entryform.file.get_filename(),
-                            inst.__class__.__name__,
-                            str(inst))
-                        entryform.file.set_filename(currentfilename)
-                    else:
-                        if exit_on_save:
-                            msg += "\n"
-                            entryform.append_end_status_message(msg)
-                            entryform.handle_exit()
-                    entryform.display_notification(msg)
+
+                    def saved(error):
+                        if error is not None:
+                            msg = "FAILED TO WRITE %s - %s: %s" % (
+                                entryform.file.get_filename(),
+                                error.__class__.__name__,
+                                str(error))
+                            entryform.file.set_filename(currentfilename)
+                        else:
+                            msg = "Saved " + entryform.file.get_filename()
+                            if exit_on_save:
+                                msg += "\n"
+                                entryform.append_end_status_message(msg)
+                                entryform.handle_exit()
+                            if entryform.view.focus_part == 'footer':
+                                # don't get in the way of a prompt opened 
+                                # while saving; the header says it's saved
+                                entryform.refresh_header()
+                                return
+                        entryform.display_notification(msg)
+                    entryform.cleanup_user_question()
+                    entryform.handle_save(saved)
                 elif key == 'esc':
                     entryform.cleanup_user_question()
         filename = entryform.file.get_filename()
@@ -346,20 +534,88 @@ class PinotFileEditor(PinotUserInterface):
             yesfunc=self.handle_save_and_exit,
             nofunc=self.handle_exit)
 
-    def handle_save(self):
-        self.file.save_to_file()
+    def handle_save(self, callback=None):
+        """
+        Save the file, then call callback(error), where error is the 
+        exception which stopped the save, or None.  If the main loop and the
+        file allow it, the file is written in another thread while editing
+        carries on, with the progress shown in the footer; otherwise it's
+        written before this returns.  Without a callback, errors are raised.
+        """
+        if callback is None:
+            self.file.save_to_file()
+            return
+        write = None
+        if hasattr(self, 'run_in_thread'):
+            write = self.file.begin_save()
+        if write is None:
+            try:
+                self.file.save_to_file()
+            except Exception as inst:
+                callback(inst)
+            else:
+                callback(None)
+            return
+        filename = self.file.get_filename()
+
+        def progress(stage, done, total):
+            self._show_save_progress("Saving %s: %.1f MB written" %
+                                     (filename, done / 1048576.0))
+
+        def finish(result, excinfo):
+            self._savethread = None
+            self.file.end_save(excinfo is None)
+            if self.view.focus_part != 'footer':
+                # clear the progress
+                self.set_default_footer()
+            if excinfo is None:
+                callback(None)
+            else:
+                callback(excinfo[1])
+
+        self._savethread = self.run_in_thread(write, finish, progress)
+        self._show_save_progress("Saving %s..." % filename)
+
+    def _show_save_progress(self, text):
+        if self.view.focus_part == 'footer':
+            # leave prompts alone
+            return
+        msg = urwid.Text(('notificationactive', "  " + text + "  "), 
+                         align='center')
+        notification = self.get_notification_widget(msg)
+        self.set_footer([notification, self.get_footer_help_widget()])
+
+    def is_saving(self):
+        """Is a save being written in the background?"""
+        return self._savethread is not None
 
     def handle_save_and_exit(self):
-        if self.file.get_filename() is None:
+        if self.is_saving():
+            self.cleanup_user_question()
+            self.display_notification("Still saving %s; try again once "
+                                      "it's done" % self.file.get_filename())
+        elif self.file.get_filename() is None:
             self.cleanup_user_question()
             self.handle_write_to_request(exit_on_save=True)
         else:
-            self.handle_save()
-            msg = "Saved " + self.file.get_filename() + "\n"
-            self.append_end_status_message(msg)
-            self.handle_exit()
+            def saved(error):
+                if error is not None:
+                    self.display_notification(
+                        "FAILED TO WRITE %s - %s: %s" % 
+                        (self.file.get_filename(), 
+                         error.__class__.__name__, str(error)))
+                    return
+                msg = "Saved " + self.file.get_filename() + "\n"
+                self.append_end_status_message(msg)
+                self.handle_exit()
+            self.cleanup_user_question()
+            self.handle_save(saved)
 
     def handle_exit(self):
+        if self._savethread is not None:
+            # finish writing rather than leave a stray temporary file
+            self._savethread.join()
+        self.file.close()
         raise PinotExit()
 
     def append_end_status_message(self, status):
@@ -377,6 +633,20 @@ class PinotFile(object):
     def save_to_file(self):
         pass
 
+    def begin_save(self):
+        """
+        Start a save which can be written in the background: return a 
+        function which writes the file when called (in any thread) as 
+        func(progress), or None if the file can only be saved with 
+        save_to_file.  end_save has to be called in the main thread after
+        the function has run.
+        """
+        return None
+
+    def end_save(self, saved):
+        """Finish the save started by begin_save (saved: did it work?)"""
+        pass
+
     def set_filename(self, name):
         pass
 
@@ -386,5 +656,9 @@ class PinotFile(object):
     def is_saved(self):
         pass
 
+    def close(self):
+        """Called when the editor exits normally"""
+        pass
+
 
 
@@ -206,11 +206,32 @@ class SchemaNode(JsonBaseNode):
         else:
             raise JsonSchemaError("self.children has invalid type %s" % type)
 
+    def get_descendant(self, path):
+        """
+        Return the schema for the value at path (a list of keys) inside a 
+        value that this node describes
+        """
+        node = self
+        for key in path:
+            if node.is_type('idref'):
+                node = node.resolve_fragment_id()
+            if node.is_type('any'):
+                continue
+            try:
+                node = node.get_child(key)
+            except (KeyError, IndexError):
+                raise JsonSchemaError("schema has nothing for %s" % key)
+        return node
+
     def get_key(self):
         return self.key
 
     def is_enum(self):
         return ('enum' in self.data)
+
+    def is_collapsed(self):
+        """Should editors show this node collapsed to start with?"""
+        return ('collapsed' in self.data and self.data['collapsed'])
         
     def is_required(self):
         if self.schemaformat.version == 1:
@@ -340,8 +361,19 @@ class SchemaNode(JsonBaseNode):
     def dumps(self, indentlevel=None):
         """ Version of dumps that more or less respects the originally-written
             key order."""
-        encoder = json.JSONEncoder(indent=4)
-        retval = ""
+        return "".join(self.iterdumps(indentlevel=indentlevel))
+
+    def dump(self, fp, indentlevel=None):
+        """ Write the output of dumps to the file-like object fp one chunk at
+            a time, rather than building the whole string in memory."""
+        for chunk in self.iterdumps(indentlevel=indentlevel):
+            fp.write(chunk)
+
+    def iterdumps(self, indentlevel=None, encoder=None):
+        """ Generator yielding the output of dumps in chunks.  One encoder is
+            shared by the whole tree."""
+        if encoder is None:
+            encoder = json.JSONEncoder(indent=4)
         indent = " " * 4
         if indentlevel is None:
             indentlevel = self.get_depth() * 2
@@ -349,7 +381,7 @@ class SchemaNode(JsonBaseNode):
             indentlevel -= 1
 
         if self.is_type('object') or self.is_type('array'):
-            retval += "{\n"
+            yield "{\n"
             indentlevel += 1
             data = self.get_data()
             props = sorted(data.keys())
@@ -359,72 +391,71 @@ class SchemaNode(JsonBaseNode):
                    'additionalProperties' in props):
                     props.remove('additionalProperties')
                 for prop in props:
-                    retval += indent * indentlevel
                     encprop = encoder.encode(prop)
                     val = encoder.encode(data[prop])
-                    retval += '%s: %s, \n' % (encprop, val)
-                retval += indent * indentlevel
-                retval += '"%s": {' % self.schemaformat.idmap['properties']
+                    yield '%s%s: %s, \n' % (indent * indentlevel, encprop, val)
+                yield indent * indentlevel
+                yield '"%s": {' % self.schemaformat.idmap['properties']
                 addcomma = False
                 indentlevel += 1
                 for key in self._get_key_order():
                     if addcomma:
-                        retval += ", "
-                    retval += "\n"
-                    retval += indent * indentlevel
+                        yield ", "
+                    yield "\n" + indent * indentlevel
                     addcomma = True
-                    retval += '"%s": ' % key
-                    retval += self.get_child(key).dumps(indentlevel=indentlevel)
+                    yield '%s: ' % encoder.encode(key)
+                    for chunk in self.get_child(key).iterdumps(
+                            indentlevel=indentlevel, encoder=encoder):
+                        yield chunk
 
                 indentlevel -= 1
                 if addcomma:
-                    retval += "\n"
-                    retval += indent * indentlevel
-                retval += "}"
+                    yield "\n" + indent * indentlevel
+                yield "}"
 
                 if(self.schemaformat.version == 2 and 
                    'additionalProperties' in data):
-                    retval += ", \n"
-                    retval += indent * indentlevel
-                    retval += '"additionalProperties": '
+                    yield ", \n" + indent * indentlevel
+                    yield '"additionalProperties": '
                     if self.allow_additional_properties():
-                        retval += self.get_additional_props_node().dumps(
-                                    indentlevel=indentlevel+1)
+                        propnode = self.get_additional_props_node()
+                        for chunk in propnode.iterdumps(
+                                indentlevel=indentlevel+1, encoder=encoder):
+                            yield chunk
                     else:
-                        retval += 'false'
-                    retval += "\n"
+                        yield 'false'
+                    yield "\n"
                 else:
-                    retval += "\n"
+                    yield "\n"
 
             elif self.is_type('array'):
                 props.remove(self.schemaformat.idmap['items'])
                 for prop in props:
-                    retval += indent * indentlevel
                     encprop = encoder.encode(prop)
                     val = encoder.encode(data[prop])
-                    retval += '%s: %s, \n' % (encprop, val)
-                retval += indent * indentlevel
-                retval += '"%s": [' %  self.schemaformat.idmap['items']
+                    yield '%s%s: %s, \n' % (indent * indentlevel, encprop, val)
+                yield indent * indentlevel
+                yield '"%s": [' %  self.schemaformat.idmap['items']
                 indentlevel += 1
                 addcomma = False
                 for child in self.get_children():
                     if addcomma:
-                        retval += ","
-                    retval += "\n"
-                    retval += indent * indentlevel
+                        yield ","
+                    yield "\n" + indent * indentlevel
                     addcomma = True
-                    retval += child.dumps(indentlevel=indentlevel)
-                retval += "\n"
+                    for chunk in child.iterdumps(indentlevel=indentlevel,
+                                                 encoder=encoder):
+                        yield chunk
+                yield "\n"
                 indentlevel -= 1
-                retval += indent * indentlevel
-                retval += "]\n"
+                yield indent * indentlevel
+                yield "]\n"
             indentlevel -= 1
-            retval += indent * indentlevel
-            retval += "}"
+            yield indent * indentlevel
+            yield "}"
         else:
             encoder.current_indent_level = indentlevel
-            retval = encoder.encode(self.get_data())
-        return retval
+            yield encoder.encode(self.get_data())
 
 
 def generate_schema_data_from_data(jsondata, fmt=schemaformat):
@@ -480,6 +511,47 @@ def generate_schema_ordermap(jsondata, jsonordermap=None, fmt=schemaformat):
     return ordermap
 
 
+def merge_schema_data(a, b, fmt=schemaformat):
+    """
+    Combine two generated schemas into one that accepts data valid under
+    either.  A schema without a type (the item schema of an array with no 
+    items yet) acts as the identity, conflicting types (including null and
+    anything else) widen to "any", and integer widens to number.  The merge
+    is associative, so partial schemas can be combined in any grouping.
+    """
+    typemap = fmt.typemap
+    if 'type' not in a:
+        return b
+    if 'type' not in b:
+        return a
+    atype = a['type']
+    btype = b['type']
+    if atype == typemap['any'] or btype == typemap['any']:
+        return {'type': typemap['any']}
+    if atype != btype:
+        if set([atype, btype]) == set([typemap['integer'], typemap['number']]):
+            return {'type': typemap['number']}
+        return {'type': typemap['any']}
+
+    if atype == typemap['object']:
+        properties_id = fmt.idmap['properties']
+        props = dict(a[properties_id])
+        for name, subschema in b[properties_id].items():
+            if name in props:
+                props[name] = merge_schema_data(props[name], subschema,
+                                                fmt=fmt)
+            else:
+                props[name] = subschema
+        return {'type': atype, properties_id: props}
+    elif atype == typemap['array']:
+        items_id = fmt.idmap['items']
+        return {'type': atype,
+                items_id: [merge_schema_data(a[items_id][0], b[items_id][0],
+                                             fmt=fmt)]}
+    else:
+        return a
+
+
 def generate_schema_from_data(jsondata, jsonordermap=None, fmt=None,
                              version=schemaformat.version):
     if fmt is None:
@@ -0,0 +1,383 @@
+#!/usr/bin/python
+# Schema generation from large collections of example documents
+#
+# Copyright (c) 2010, Rob Lanphier
+# All rights reserved.
+# Licensed under BSD-style license.  See LICENSE.txt for details.
+
+"""
+Infer a schema from many example documents at once.
+
+Inputs are split into shards (groups of files, or byte ranges of a
+newline-delimited JSON file), a partial schema is inferred for each shard in a
+process pool, and the partial schemas are combined with merge_schema_data and
+merge_order_maps.  Since both merges are associative, shards can be processed
+independently and combined as they complete.
+"""
+
+import json
+import os
+import random
+import time
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    OrderedDict = None
+
+from jsonwidget.schema import SchemaNode, JsonSchemaError, merge_schema_data
+from jsonwidget.jsonorder import merge_order_maps
+from jsonwidget.jsonnode import make_json_pointer
+from jsonwidget.jsontypes import schemaformat, schemaformat_v1, \
+    schemaformat_v2, get_json_type
+
+
+class SchemaGenError(RuntimeError):
+    pass
+
+
+def get_format(version):
+    if version == 1:
+        return schemaformat_v1
+    elif version == 2:
+        return schemaformat_v2
+    else:
+        raise JsonSchemaError("Invalid version")
+
+
+def load_json(jsonbuffer):
+    """Parse a JSON buffer, keeping the key order of objects if possible"""
+    if OrderedDict is None:
+        return json.loads(jsonbuffer)
+    return json.loads(jsonbuffer, object_pairs_hook=OrderedDict)
+
+
+def infer_schema(jsondata, fmt=schemaformat):
+    """
+    Return a (schemadata, ordermap) pair describing jsondata.  Unlike
+    generate_schema_data_from_data, every item of an array contributes to the
+    item schema, and an empty array yields an item schema without a type,
+    which merges away against any real example (see fill_unknown_types).
+    """
+    properties_id = fmt.idmap['properties']
+    items_id = fmt.idmap['items']
+    datatype = get_json_type(jsondata, fmt=fmt)
+    schema = {'type': datatype}
+    ordermap = {}
+
+    if datatype == fmt.typemap['object']:
+        props = {}
+        propmap = {'keys': [], 'children': {}}
+        for name in jsondata:
+            props[name], propmap['children'][name] = \
+                infer_schema(jsondata[name], fmt=fmt)
+            propmap['keys'].append(name)
+        schema[properties_id] = props
+        ordermap['keys'] = ['type', properties_id]
+        ordermap['children'] = {'type': {}, properties_id: propmap}
+    elif datatype == fmt.typemap['array']:
+        itemschema = {}
+        itemmap = {}
+        for item in jsondata:
+            subschema, submap = infer_schema(item, fmt=fmt)
+            itemschema = merge_schema_data(itemschema, subschema, fmt=fmt)
+            itemmap = merge_order_maps(itemmap, submap)
+        schema[items_id] = [itemschema]
+        ordermap['keys'] = ['type', items_id]
+        ordermap['children'] = {'type': {},
+                                items_id: {'keys': [0],
+                                           'children': {0: itemmap}}}
+    return schema, ordermap
+
+
+def fill_unknown_types(schema, fmt=schemaformat):
+    """
+    Give the item schemas of arrays which never had any items (see 
+    infer_schema) the type "any", in place
+    """
+    if 'type' not in schema:
+        schema['type'] = fmt.typemap['any']
+    elif schema['type'] == fmt.typemap['object']:
+        for subschema in schema[fmt.idmap['properties']].values():
+            fill_unknown_types(subschema, fmt=fmt)
+    elif schema['type'] == fmt.typemap['array']:
+        fill_unknown_types(schema[fmt.idmap['items']][0], fmt=fmt)
+    return schema
+
+
+def merge_partial_schemas(a, b, fmt=schemaformat):
+    """Merge two (schemadata, ordermap) pairs.  None is the identity."""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return (merge_schema_data(a[0], b[0], fmt=fmt),
+            merge_order_maps(a[1], b[1]))
+
+
+def read_ndjson_range(filename, start=0, end=None):
+    """
+    Yield the lines of filename which begin in the byte range [start, end).
+    A line straddling "start" belongs to the previous range.
+    """
+    with open(filename, 'rb') as f:
+        if start > 0:
+            f.seek(start - 1)
+            f.readline()
+        while end is None or f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            if line.strip():
+                yield line
+
+
+def iter_shard_documents(shard):
+    """Yield (filename, jsonbuffer) for each document belonging to a shard"""
+    if shard[0] == 'files':
+        for filename in shard[1]:
+            with open(filename, 'r') as f:
+                yield filename, f.read()
+    elif shard[0] == 'ndjson':
+        filename, start, end = shard[1:]
+        for line in read_ndjson_range(filename, start, end):
+            yield filename, line
+    else:
+        raise SchemaGenError("unknown shard type %s" % shard[0])
+
+
+def infer_shard(args):
+    """
+    Process pool entry point: infer a partial schema for one shard.  Returns
+    (partial, documentcount, elapsedseconds).
+    """
+    shard, version = args
+    fmt = get_format(version)
+    starttime = time.time()
+    partial = None
+    count = 0
+    for filename, jsonbuffer in iter_shard_documents(shard):
+        try:
+            jsondata = load_json(jsonbuffer)
+        except ValueError as inst:
+            raise SchemaGenError("Error in %s: %s" % (filename, inst))
+        partial = merge_partial_schemas(partial, infer_schema(jsondata, fmt),
+                                        fmt=fmt)
+        count += 1
+    return partial, count, time.time() - starttime
+
+
+def expand_sources(sources, suffixes=('.json',)):
+    """
+    Expand directories into the (sorted, non-hidden) files they contain whose
+    names end with one of the given suffixes.  Plain files are used as-is.
+    """
+    filenames = []
+    for source in sources:
+        if os.path.isdir(source):
+            for dirpath, dirnames, files in os.walk(source):
+                dirnames[:] = sorted(d for d in dirnames
+                                     if not d.startswith('.'))
+                for name in sorted(files):
+                    if (not name.startswith('.') and
+                        name.endswith(suffixes)):
+                        filenames.append(os.path.join(dirpath, name))
+        else:
+            filenames.append(source)
+    return filenames
+
+
+def make_shards(filenames, ndjson=False, shardsize=100,
+                shardbytes=8*1024*1024):
+    """
+    Split the inputs into shards.  Whole documents are grouped shardsize files
+    at a time; newline-delimited files are split into byte ranges of roughly
+    shardbytes each.
+    """
+    shards = []
+    if ndjson:
+        for filename in filenames:
+            size = os.path.getsize(filename)
+            for start in range(0, max(size, 1), shardbytes):
+                shards.append(('ndjson', filename, start,
+                               min(start + shardbytes, size)))
+    else:
+        for i in range(0, len(filenames), shardsize):
+            shards.append(('files', filenames[i:i + shardsize]))
+    return shards
+
+
+def generate_schema_from_sources(sources, version=schemaformat.version,
+                                 jobs=None, ndjson=False, shardsize=100,
+                                 shardbytes=8*1024*1024, window=None,
+                                 report=None):
+    """
+    Generate a SchemaNode from many example documents.
+
+    sources: list of files and/or directories
+    jobs: number of worker processes (default: one per cpu, 1 runs inline)
+    ndjson: treat each file as newline-delimited JSON
+    window: stop once this many documents in a row haven't changed the schema
+    report: optional function called with (shardnumber, documentcount,
+            elapsedseconds) as each shard is merged
+    """
+    fmt = get_format(version)
+    if ndjson:
+        suffixes = ('.json', '.ndjson', '.jsonl')
+    else:
+        suffixes = ('.json',)
+    shards = make_shards(expand_sources(sources, suffixes), ndjson=ndjson,
+                         shardsize=shardsize, shardbytes=shardbytes)
+    tasks = [(shard, version) for shard in shards]
+
+    pool = None
+    if jobs is None or jobs > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(jobs)
+        results = pool.imap(infer_shard, tasks)
+    else:
+        results = (infer_shard(task) for task in tasks)
+
+    merged = None
+    stable = 0
+    try:
+        for shardnum, (partial, count, elapsed) in enumerate(results):
+            if report is not None:
+                report(shardnum, count, elapsed)
+            if partial is None:
+                continue
+            newmerged = merge_partial_schemas(merged, partial, fmt=fmt)
+            if newmerged == merged:
+                stable += count
+            else:
+                stable = 0
+            merged = newmerged
+            if window is not None and stable >= window:
+                break
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    if merged is None:
+        raise SchemaGenError("no JSON documents found")
+    schema, ordermap = merged
+    fill_unknown_types(schema, fmt=fmt)
+    return SchemaNode(data=schema, ordermap=ordermap, fmt=fmt)
+
+
+def reservoir_sample(lines, size=None, bytebudget=None, rng=random):
+    """
+    Draw a uniform random sample of up to "size" non-blank lines from an
+    iterable, reading no more than "bytebudget" bytes.  Only the sampled lines
+    are kept, so the input may be arbitrarily large.  With no size, every line
+    within the byte budget is kept.
+
+    Returns (sample, linesseen, bytesread)
+    """
+    sample = []
+    seen = 0
+    bytesread = 0
+    for line in lines:
+        if bytebudget is not None and bytesread + len(line) > bytebudget:
+            break
+        bytesread += len(line)
+        if not line.strip():
+            continue
+        seen += 1
+        if size is None or len(sample) < size:
+            sample.append(line)
+        else:
+            i = rng.randint(0, seen - 1)
+            if i < size:
+                sample[i] = line
+    return sample, seen, bytesread
+
+
+class KeyCoverage(object):
+    """
+    Tally how often each object key appears, per location in the document.
+    Locations are written as JSON pointers (with "~" and "/" in keys 
+    escaped), with "*" standing for any array index.
+    """
+    def __init__(self):
+        self.objects = {}
+        self.keys = {}
+        self.keyorder = {}
+
+    def add(self, jsondata, path=''):
+        if isinstance(jsondata, dict):
+            location = path or '/'
+            self.objects[location] = self.objects.get(location, 0) + 1
+            counts = self.keys.setdefault(location, {})
+            order = self.keyorder.setdefault(location, [])
+            for key in jsondata:
+                if key not in counts:
+                    counts[key] = 0
+                    order.append(key)
+                counts[key] += 1
+                self.add(jsondata[key], path + make_json_pointer([key]))
+        elif isinstance(jsondata, list):
+            for item in jsondata:
+                self.add(item, path + '/*')
+
+    def get_locations(self):
+        return sorted(self.objects.keys())
+
+    def get_key_counts(self, location):
+        """Return [(key, count), ...] in the order keys were first seen"""
+        counts = self.keys[location]
+        return [(key, counts[key]) for key in self.keyorder[location]]
+
+    def format_report(self, encoding=None):
+        """
+        Return the report as text, or encoded with encoding (unencodable 
+        characters are escaped)
+        """
+        lines = []
+        for location in self.get_locations():
+            total = self.objects[location]
+            lines.append("%s: %i objects, %i keys" %
+                         (location, total, len(self.keys[location])))
+            for key, count in self.get_key_counts(location):
+                if count < total:
+                    note = "  (optional)"
+                else:
+                    note = ""
+                lines.append("    %s: %i (%.1f%%)%s" %
+                             (key, count, 100.0 * count / total, note))
+        report = u"\n".join(lines) + u"\n"
+        if encoding is not None:
+            return report.encode(encoding, 'backslashreplace')
+        return report
+
+
+def generate_schema_from_sample(stream, version=schemaformat.version,
+                                size=1000, bytebudget=None, coverage=None,
+                                rng=random):
+    """
+    Generate a SchemaNode from a reservoir sample of a newline-delimited JSON
+    stream.  Only the sampled records are parsed.  If a KeyCoverage object is
+    passed as "coverage", it is filled in from the sample.
+
+    Returns (schemanode, samplesize, recordsseen, bytesread)
+    """
+    fmt = get_format(version)
+    sample, seen, bytesread = reservoir_sample(stream, size=size,
+                                               bytebudget=bytebudget, rng=rng)
+    merged = None
+    for line in sample:
+        try:
+            jsondata = load_json(line)
+        except ValueError as inst:
+            raise SchemaGenError("Error in sampled record: %s" % inst)
+        if coverage is not None:
+            coverage.add(jsondata)
+        merged = merge_partial_schemas(merged, infer_schema(jsondata, fmt),
+                                       fmt=fmt)
+    if merged is None:
+        raise SchemaGenError("no JSON documents found")
+    schema, ordermap = merged
+    fill_unknown_types(schema, fmt=fmt)
+    schemanode = SchemaNode(data=schema, ordermap=ordermap, fmt=fmt)
+    return schemanode, len(sample), seen, bytesread
@@ -25,7 +25,6 @@ import json
 import shutil
 
 try:
-    import urwid.curses_display
     import urwid
 except ImportError:
     msg = """
@@ -47,6 +46,9 @@ except ImportError:
 from jsonwidget.floatedit import FloatEdit
 from jsonwidget.schema import *
 from jsonwidget.jsonnode import *
+from jsonwidget.journal import *
+from jsonwidget.undo import EditHistory, UndoError
+from jsonwidget.jsonsearch import SearchIndex
 from jsonwidget.pinot import *
 from jsonwidget.treetools import *
 from jsonwidget.termwidgets import *
@@ -93,22 +95,83 @@ class TreeFileDatatype(object):
 class JsonPinotFile(PinotFile):
     '''Glue to between PinotFile and underlying JSON object'''
 
-    def __init__(self, jsonfile=None, schemafile=None, schemaobj=None):
+    # EditJournal recording unsaved edits, if journaling is on
+    journal = None
+    # message about journal recovery to show the user at startup
+    journalmessage = None
+    # SaveSnapshot being written by a background save
+    _snapshot = None
+
+    def __init__(self, jsonfile=None, schemafile=None, schemaobj=None,
+                 journal=True, pointer=None, progress=None, lazy=False):
+        # with pointer set, only the value at pointer is loaded and edited.
+        # progress and lazy are passed on to JsonNode.
+        self.pointer = pointer
+        self.lazy = lazy
         if jsonfile is None or os.access(jsonfile, os.R_OK):
             # file exists, and we can read it (or we're just passing "None")
             self.json = JsonNode(filename=jsonfile, schemafile=schemafile,
-                schemanode=schemaobj)
+                schemanode=schemaobj, pointer=pointer, progress=progress,
+                lazy=lazy)
             self.schema = self.json.get_schema_node()
         elif os.access(jsonfile, os.F_OK):
             # file exists, but can't read it
             sys.stderr.write("Cannot access file \"%s\" (check permissions)\n" %
                              jsonfile)
             sys.exit(os.EX_NOINPUT)
+        elif pointer is not None:
+            raise JsonNodeError("%s doesn't exist, so there's nothing at %s" %
+                                (jsonfile, pointer))
         else:
             # must be a new file
             self.json = JsonNode(filename=None, schemafile=schemafile)
             self.schema = self.json.get_schema_node()
             self.set_filename(jsonfile)
+        if journal and jsonfile is not None:
+            self._open_journal()
+
+    def _open_journal(self):
+        """
+        Replay any journal left behind by an earlier session, then start 
+        recording edits
+        """
+        filename = self.get_filename()
+        pointer = self.json.get_source_pointer()
+        self.journal = EditJournal(filename, pointer=pointer)
+        journalname = self.journal.journalname
+        if not os.path.exists(journalname):
+            self.journal.start()
+        else:
+            try:
+                header, records = read_journal(journalname)
+                if not is_journal_current(header, filename, pointer):
+                    raise JournalError("%s changed since the journal was "
+                                       "written (or the journal is for "
+                                       "another part of it)" % filename)
+                replay_journal(self.json, records)
+            except (JournalError, IOError) as inst:
+                # keep the old journal around, but don't trust it
+                os.rename(journalname, journalname + "~")
+                self._reload()
+                self.journalmessage = ("Ignored edit journal (saved as %s~): "
+                                       "%s" % (journalname, inst))
+                self.journal.start()
+            else:
+                if len(records) > 0:
+                    self.journalmessage = ("Recovered %i unsaved edits from "
+                                           "%s" % (len(records), journalname))
+                self.journal.resume()
+        self.json.set_journal(self.journal)
+
+    def _reload(self):
+        """Throw away any changes, and reload the file from disk"""
+        filename = self.get_filename()
+        if os.access(filename, os.R_OK):
+            self.json = JsonNode(filename=filename, schemanode=self.schema,
+                                 pointer=self.pointer, lazy=self.lazy)
+        else:
+            self.json = JsonNode(filename=None, schemanode=self.schema)
+            self.set_filename(filename)
 
     def get_json(self):
         return self.json
@@ -117,13 +180,53 @@ class JsonPinotFile(PinotFile):
         return self.json.get_filename()
 
     def save_to_file(self):
-        return self.json.save_to_file()
+        retval = self.json.save_to_file()
+        self._restart_journal()
+        return retval
+
+    def begin_save(self):
+        self._snapshot = self.json.take_save_snapshot()
+        if self.journal is not None:
+            # the saved file won't have the edits made while it's written
+            self.journal.mark()
+        return self._snapshot.write
+
+    def end_save(self, saved):
+        snapshot = self._snapshot
+        self._snapshot = None
+        records = ()
+        if self.journal is not None:
+            records = self.journal.get_marked()
+        if not saved:
+            snapshot.cancel()
+            return
+        snapshot.commit()
+        self._restart_journal(records)
+
+    def _restart_journal(self, records=()):
+        """Start the journal over: the file now holds everything in it"""
+        if self.journal is None:
+            return
+        if self.journal.filename != self.get_filename():
+            self.journal.remove()
+            self.journal = EditJournal(self.get_filename(), 
+                                       pointer=self.journal.pointer)
+            self.json.set_journal(self.journal)
+        self.journal.start(records)
+
+    def close(self):
+        if self.journal is not None:
+            self.journal.remove()
 
     def set_filename(self, name):
         return self.json.set_filename(name)
 
     def get_filename_text(self):
-        return self.json.get_filename_text()
+        text = self.json.get_filename_text()
+        pointer = self.json.get_source_pointer()
+        if pointer != "":
+            text += " " + pointer
+        return text
 
     def is_saved(self):
         return self.json.is_saved()
@@ -168,6 +271,10 @@ class TreeFileWrapper(JsonPinotFile):
             schemafile=self.get_schema_file())
         self.set_filename(filename)
 
+    def begin_save(self):
+        # the datatype does the saving
+        return None
+
     def save_to_file(self, keep_old=False):
         data = self.json.get_data()
         filename = self.get_filename()
@@ -213,26 +320,250 @@ class JsonFileEditor(PinotFileEditor):
     JSON editor specific commands
     These routines deal with the specifics of a JSON editor.
     """
+    # SearchIndex for ^F, and the last thing searched for
+    searchindex = None
+    searchquery = None
+    # JsonPinotFile arguments while the file loads in the background, then
+    # the sys.exc_info() of the load if it failed
+    _loadargs = None
+    _loaderror = None
+    # alarm for committing the text being typed into a field
+    _committimer = None
+    # keys handled by unhandled_input
+    _commandkeys = ('ctrl x', 'ctrl w', 'ctrl d', 'ctrl n', 'meta u', 
+                    'meta e', 'ctrl f', 'meta n', 'meta p')
+
     def __init__(self, jsonfile=None, schemafile=None, fileobj=None, 
-                 schemaobj=None, program_name="JsonWidget", monochrome=True):
-        if fileobj is None:
-            self.file = JsonPinotFile(jsonfile=jsonfile, 
-                                      schemafile=schemafile,
-                                      schemaobj=schemaobj)
-        else:
+                 schemaobj=None, program_name="JsonWidget", monochrome=True,
+                 journal=True, collapse_depth=None, collapse_size=None,
+                 pointer=None, background=False, commit_delay=0.5):
+        """
+        background: load jsonfile in another thread once the editor is
+            running, showing the progress in the footer, rather than before
+            it starts (only for main loops with run_in_thread)
+        commit_delay: seconds of idle time after which text typed into a 
+            field is stored in the tree (it's also stored when the focus 
+            moves, and before any command).  None stores every keystroke.
+            Only used with the event-driven main loop, whose alarms run in 
+            the main thread.
+        """
+        if not hasattr(self, 'run_in_thread'):
+            commit_delay = None
+        self.commit_delay = commit_delay
+        self._collapse = (collapse_depth, collapse_size)
+        if fileobj is not None:
             self.file = fileobj
+        else:
+            loadargs = {'jsonfile': jsonfile, 'schemafile': schemafile,
+                        'schemaobj': schemaobj, 'journal': journal,
+                        'pointer': pointer}
+            if background and jsonfile is not None and \
+                    hasattr(self, 'run_in_thread'):
+                self.file = None
+                self._loadargs = loadargs
+            else:
+                self.file = JsonPinotFile(**loadargs)
 
-        self.json = self.file.get_json()
-        self.schema = self.json.get_schema_node()
-        self.listbox = JsonFrame(self.json)
+        if self.is_loading():
+            self.listbox = urwid.ListBox([urwid.Text("")])
+        else:
+            self._attach_file()
         PinotFileEditor.__init__(self, program_name=program_name, 
                                  unhandled_input=self.unhandled_input)
+        journalmessage = getattr(self.file, 'journalmessage', None)
+        if journalmessage is not None:
+            self.set_startup_notification(journalmessage)
         self.set_default_footer_helpitems([("^W", "Write/Save"), 
                                            ("^X", "Exit"),
                                            ("^N", "Insert New Item"),
-                                           ("^D", "Delete Item")])
+                                           ("^D", "Delete Item"),
+                                           ("M-U", "Undo"),
+                                           ("M-E", "Redo"),
+                                           ("^F", "Search"),
+                                           ("M-N", "Next Match")])
         if monochrome:
-            urwid.curses_display.curses.has_colors = lambda: False
+            self.set_monochrome()
+
+    def _attach_file(self):
+        """Set up the tree view (and friends) for self.file"""
+        self.json = self.file.get_json()
+        self.schema = self.json.get_schema_node()
+        if self.json.get_history() is None:
+            self.json.set_history(EditHistory())
+        collapse_depth, collapse_size = self._collapse
+        self.listbox = JsonFrame(self.json, collapse_depth=collapse_depth,
+                                 collapse_size=collapse_size,
+                                 buffer_edits=self.commit_delay is not None)
+        self.searchindex = SearchIndex(self.json)
+
+    def is_loading(self):
+        """Is the file still being loaded in the background?"""
+        return self._loadargs is not None
+
+    def _start_loading(self):
+        """
+        Load the file in a worker thread, reporting progress as it goes.  
+        Only the top level of the tree is built there, so that the editor 
+        can be used sooner; the rest is built when idle (see on_init).
+        """
+        loadargs = self._loadargs
+        filename = loadargs['jsonfile']
+
+        def load(progress):
+            return JsonPinotFile(progress=progress, lazy=True, **loadargs)
+
+        def progress(stage, done, total):
+            self._show_load_progress(
+                get_load_progress_text(filename, stage, done, total))
+
+        self.run_in_thread(load, self._finish_loading, progress)
+        self._show_load_progress("Loading %s..." % filename)
+
+    def _show_load_progress(self, text):
+        msg = urwid.Text(text)
+        notification = self.get_notification_widget(msg, active=True)
+        footerhelp = self.get_footer_help_widget(helptext=[("^X", "Exit")])
+        self.set_footer([notification, footerhelp])
+
+    def _finish_loading(self, fileobj, excinfo):
+        if excinfo is not None:
+            # run() raises it again once the screen is restored
+            self._loaderror = excinfo
+            raise PinotExit()
+        self.file = fileobj
+        self._loadargs = None
+        self._attach_file()
+        self.set_body()
+        self.set_header()
+        self.set_default_footer()
+        if self.file.journalmessage is not None:
+            self.set_startup_notification(self.file.journalmessage)
+        self.on_init()
+
+    def run(self):
+        PinotFileEditor.run(self)
+        if self._loaderror is not None:
+            exc_type, exc_value, exc_traceback = self._loaderror
+            self._loaderror = None
+            raise exc_type, exc_value, exc_traceback
+
+    def commit_edits(self):
+        """Store any text typed into a field which isn't in the tree yet"""
+        if self._committimer is not None:
+            self.remove_alarm(self._committimer)
+            self._committimer = None
+        try:
+            self.listbox.commit_pending_edit()
+        except PinotAlert as inst:
+            self.display_notification(str(inst))
+
+    def handle_key(self, size, key):
+        PinotFileEditor.handle_key(self, size, key)
+        if self.is_loading() or not self.listbox.has_pending_edit():
+            return
+        # commit once the typing stops
+        if self._committimer is not None:
+            self.remove_alarm(self._committimer)
+        self._committimer = self.set_alarm(self.commit_delay, 
+                                           self._commit_when_idle)
+
+    def _commit_when_idle(self):
+        self._committimer = None
+        self.commit_edits()
+        self.refresh_header()
+
+    def handle_undo(self, redo=False):
+        """Handle meta u - "undo" (and meta e - "redo")."""
+        try:
+            if redo:
+                focus = self.json.redo()
+            else:
+                focus = self.json.undo()
+        except UndoError as inst:
+            self.display_notification(str(inst))
+            return
+        try:
+            self.listbox.focus_json_node(focus)
+        except (KeyError, IndexError):
+            pass
+
+    def handle_search_request(self):
+        """Handle ctrl f - "search"."""
+        editor = self
+        startfocus = self.listbox.get_focus()[1]
+        startposition = self._get_focus_position()
+
+        class CallbackEdit(urwid.Edit):
+
+            def keypress(self, (maxcol, ), key):
+                query = self.get_edit_text()
+                key = urwid.Edit.keypress(self, (maxcol, ), key)
+                if key == 'enter':
+                    editor.cleanup_user_question()
+                elif key == 'esc':
+                    editor.listbox.set_focus(startfocus)
+                    editor.cleanup_user_question()
+                elif key in ('meta n', 'meta p'):
+                    self.show_match(editor.find_match(
+                        editor._get_focus_position(), 
+                        reverse=(key == 'meta p')))
+                elif self.get_edit_text() != query:
+                    editor.searchquery = self.get_edit_text()
+                    self.show_match(editor.find_match(startposition,
+                                                      inclusive=True))
+
+            def show_match(self, match):
+                i, count = match
+                if count == 0:
+                    self.set_caption("Search (no matches): ")
+                else:
+                    self.set_caption("Search (%i of %i): " % (i + 1, count))
+        prompt = CallbackEdit("Search: ", "")
+        self.view.set_focus("footer")
+        helptext = [("Enter", "Done"), ("ESC", "Cancel"), 
+                    ("M-N", "Next Match"), ("M-P", "Previous Match")]
+        notification = self.get_notification_widget(prompt, active=True)
+        footerhelp = self.get_footer_help_widget(helptext=helptext)
+        self.set_footer([notification, footerhelp])
+
+    def handle_search_next(self, reverse=False):
+        """Handle meta n - "next match" (and meta p - "previous match")."""
+        if not self.searchquery:
+            self.display_notification("Nothing to search for (try ^F)")
+            return
+        i, count = self.find_match(self._get_focus_position(), 
+                                   reverse=reverse)
+        if count == 0:
+            self.display_notification("No matches for %s" % self.searchquery)
+        else:
+            self.display_notification("Match %i of %i" % (i + 1, count))
+
+    def find_match(self, position, reverse=False, inclusive=False):
+        """
+        Focus the next match for searchquery after position, or the previous
+        one with reverse set (see SearchIndex.find).  Returns (index of the 
+        match, number of matches).
+        """
+        if not self.searchquery:
+            return None, 0
+        i, matches = self.searchindex.find(self.searchquery, position,
+                                           reverse=reverse, 
+                                           inclusive=inclusive)
+        if i is not None:
+            self.listbox.focus_json_node(matches[i])
+        return i, len(matches)
+
+    def _get_focus_position(self):
+        """Position of the focus, in the terms of SearchIndex.get_position"""
+        node = self.listbox.get_focus()[1]
+        position = self.searchindex.get_position(node.get_value())
+        if isinstance(node, FieldAddNode):
+            # the buttons come after the members of the object
+            position.append(len(node.get_value().get_children()))
+        elif isinstance(node, ArrayPageNode):
+            # the page comes just before its first item
+            position.append(node.get_range()[0] - 0.5)
+        return position
 
     def handle_delete_node_request(self):
         """Handle ctrl d - "delete item"."""
@@ -258,6 +589,8 @@ class JsonFileEditor(PinotFileEditor):
         else:
             if isinstance(node, FieldAddNode):
                 nodemsg = 'Cannot delete "add field" buttons'
+            elif isinstance(node, ArrayPageNode):
+                nodemsg = 'Cannot delete pages of array items'
             else:
                 nodemsg = ("%s is a required field" % 
                            node.get_value().get_title())
@@ -276,7 +609,15 @@ class JsonFileEditor(PinotFileEditor):
 
     def handle_delete_node(self):
         widget, node = self.listbox.get_focus()
-        node.delete_node()
+        # deleting the root node takes several edits; undo them together
+        history = self.json.get_history()
+        if history is not None:
+            history.begin_group()
+        try:
+            node.delete_node()
+        finally:
+            if history is not None:
+                history.end_group()
         self.cleanup_delete_request()        
 
     def handle_insert_node_request(self):
@@ -305,6 +646,14 @@ class JsonFileEditor(PinotFileEditor):
 
     def unhandled_input(self, input):
         """ Attach handlers for keyboard commands here. """
+        if self.is_loading():
+            # there's nothing to do yet but give up
+            if input == 'ctrl x':
+                raise PinotExit()
+            return None
+        if input in self._commandkeys:
+            # commands see the text typed so far
+            self.commit_edits()
         if input == 'ctrl x':
             if self.file.is_saved():
                 self.handle_exit()
@@ -321,19 +670,89 @@ class JsonFileEditor(PinotFileEditor):
         elif input == 'ctrl n':
             self.handle_insert_node_request()
             return None
+        elif input == 'meta u':
+            self.handle_undo()
+            return None
+        elif input == 'meta e':
+            self.handle_undo(redo=True)
+            return None
+        elif input == 'ctrl f':
+            self.handle_search_request()
+            return None
+        elif input in ('meta n', 'meta p') and self.view.focus_part == 'body':
+            # (the search prompt handles these itself)
+            self.handle_search_next(reverse=(input == 'meta p'))
+            return None
         else:
             return input
 
+    def on_init(self):
+        if self.is_loading():
+            self._start_loading()
+            return
+        PinotFileEditor.on_init(self)
+        self.run_when_idle(self._build_step)
+
+    def _build_step(self):
+        """Build more of a lazily loaded tree (see JsonNode.build_step)"""
+        try:
+            if not self.json.build_step():
+                return False
+        except JsonNodeError:
+            # the load failed after all; run() raises it again once the 
+            # screen is restored
+            self._loaderror = sys.exc_info()
+            raise PinotExit()
+        if self.searchindex is not None:
+            # get the index ready while waiting for the first keypress
+            self.run_when_idle(self.searchindex.build_step)
+        self._hash_when_idle()
+        return True
+
+    def _hash_when_idle(self):
+        # lets is_saved notice edits which are undone, without holding up
+        # the first one (see JsonNode.saved_hash_step)
+        self.run_when_idle(self.json.saved_hash_step)
+
+    def handle_save(self, callback=None):
+        if callback is None:
+            PinotFileEditor.handle_save(self)
+            self._hash_when_idle()
+            return
+
+        def finish(error):
+            if error is None:
+                self._hash_when_idle()
+            callback(error)
+        PinotFileEditor.handle_save(self, finish)
+
     def get_center_header_text(self):
+        if self.is_loading():
+            return self._loadargs['jsonfile']
         filename = self.file.get_filename_text()
         if self.file.is_saved() is False:
             filename += " (modified)"
         return filename
 
     def get_right_header_text(self):
+        if self.is_loading():
+            return ""
         return self.file.get_schema_display_text()
 
 
+def get_load_progress_text(filename, stage, done, total):
+    """Describe a JsonNode progress report (see JsonNode.__init__)"""
+    if stage == "read":
+        return "Reading %s: %.1f of %.1f MB" % (filename, done / 1048576.0,
+                                                total / 1048576.0)
+    elif stage == "parse":
+        return "Parsing %s..." % filename
+    elif stage == "schema":
+        return "Generating a schema for %s..." % filename
+    else:
+        return "Building the tree for %s: %i nodes" % (filename, done)
+
+
 class JsonDataEditor(JsonFileEditor):
     """
     This is an editor for in-memory data instead of a file
@@ -354,7 +773,10 @@ class JsonDataEditor(JsonFileEditor):
                                            ("^X", "Exit"),
                                            ("^D", "Delete Item")])
         if monochrome:
-            urwid.curses_display.curses.has_colors = lambda: False
+            self.set_monochrome()
+
+    def handle_exit(self):
+        raise PinotExit()
 
     def unhandled_input(self, input):
         """ Attach handlers for keyboard commands here. """
@@ -13,6 +13,7 @@ class JsonEditorError(RuntimeError):
     pass
 
 
+import bisect
 import threading
 import sys
 import os
@@ -28,12 +29,34 @@ from jsonwidget.jsonnode import *
 from jsonwidget.pinot import *
 from jsonwidget.treetools import *
 
+# arrays longer than this are shown in collapsible pages of this many items
+ARRAY_PAGE_SIZE = 1000
+# enums with more options than this are edited with an EnumPicker rather than
+# a row of radio buttons
+ENUM_BUTTONS_MAX = 10
+
 # Series of editing widgets follows, each appropriate to a datatype or two
 
 class BaseJsonEditWidget(TreeWidget):
+    _storing = False
+
     def get_json_node(self):
         return self.get_node().get_value()
 
+    def set_json_data(self, data):
+        """
+        Store data in the JsonNode.  The widget already shows the new value,
+        so it isn't rebuilt in response.
+        """
+        self._storing = True
+        try:
+            self.get_json_node().set_data(data)
+        finally:
+            self._storing = False
+
+    def is_storing(self):
+        return self._storing
+
     def unhandled_keys(self, size, key):
         """Overriding default selection behavior"""
         return key
@@ -48,6 +71,16 @@ class ArrayEditWidget(ParentWidget):
         title = jsonnode.get_title()
         if jsonnode.is_additional_props_node():
             title = "%s (%s)" % (title, jsonnode.get_key())
+        if not self.expanded:
+            # show what's hidden
+            count = len(jsonnode.get_children())
+            if jsonnode.is_type('array'):
+                noun = "item"
+            else:
+                noun = "field"
+            if count != 1:
+                noun += "s"
+            return "%s: (%i %s)" % (title, count, noun)
         return title + ": "
 
     def unhandled_keys(self, size, key):
@@ -56,7 +89,14 @@ class ArrayEditWidget(ParentWidget):
 
 
 class GenericEditWidget(BaseJsonEditWidget):
-    """ generic widget used for free text entry (e.g. strings)"""
+    """
+    generic widget used for free text entry (e.g. strings).  If the JsonFrame
+    buffers edits, the text typed is only stored in the JsonNode when the 
+    frame commits it (see JsonFrame.commit_pending_edit).
+    """
+    # text typed but not stored in the JsonNode yet, or None
+    _pendingtext = None
+
     def load_inner_widget(self):
         jsonnode = self.get_json_node()
         editcaption = urwid.Text(jsonnode.get_title() + ": ")
@@ -78,7 +118,22 @@ class GenericEditWidget(BaseJsonEditWidget):
         return urwid.Edit
 
     def store_text_as_data(self, text):
-        self.get_json_node().set_data(text)
+        self.set_json_data(text)
+
+    def handle_text_change(self, text):
+        listbox = self.get_node().get_root().get_listbox()
+        if listbox is None or not listbox.is_buffering_edits():
+            self.store_text_as_data(text)
+        else:
+            self._pendingtext = text
+            listbox.set_pending_edit(self)
+
+    def commit_edit(self):
+        """Store the text typed so far in the JsonNode"""
+        text = self._pendingtext
+        if text is not None:
+            self._pendingtext = None
+            self.store_text_as_data(text)
 
     def get_edit_field_widget(self):
         """
@@ -96,7 +151,7 @@ class GenericEditWidget(BaseJsonEditWidget):
 
             def set_edit_text(self, text):
                 urwid.Edit.set_edit_text(self, text)
-                thiswidget.store_text_as_data(text)
+                thiswidget.handle_text_change(text)
 
         innerwidget = CallbackEdit("", self.get_value_text())
         if self.is_selected():
@@ -124,11 +179,10 @@ class IntEditWidget(GenericEditWidget):
         return urwid.IntEdit
 
     def store_text_as_data(self, text):
-        jsonnode = self.get_json_node()
         if text == '':
-            jsonnode.set_data(0)
+            self.set_json_data(0)
         else:
-            jsonnode.set_data(int(text))
+            self.set_json_data(int(text))
 
 
 class NumberEditWidget(GenericEditWidget):
@@ -138,11 +192,10 @@ class NumberEditWidget(GenericEditWidget):
         return FloatEdit
 
     def store_text_as_data(self, text):
-        jsonnode = self.get_json_node()
         if text == '':
-            jsonnode.set_data(0)
+            self.set_json_data(0)
         else:
-            jsonnode.set_data(float(text))
+            self.set_json_data(float(text))
 
     def get_value_text(self):
         jsonnode = self.get_json_node()
@@ -155,22 +208,31 @@ class BoolEditWidget(GenericEditWidget):
 
     def get_edit_field_widget(self):
         jsonnode = self.get_json_node()
+        thiswidget = self
 
         def on_state_change(self, state, user_data=None):
-            jsonnode.set_data(state)
+            thiswidget.set_json_data(state)
 
         return urwid.CheckBox("", jsonnode.get_data(),
                               on_state_change=on_state_change)
 
 
 class EnumEditWidget(GenericEditWidget):
-    """ Enumerated string edit widget"""
+    """ 
+    Enumerated string edit widget.  Small enums get a radio button per 
+    option, larger ones an EnumPicker.
+    """
 
     def get_edit_field_widget(self):
-        options = []
-        self._radiolist = []
         jsonnode = self.get_json_node()
         schemanode = jsonnode.get_schema_node()
+        thiswidget = self
+        if len(schemanode.enum_options()) > ENUM_BUTTONS_MAX:
+            def on_select(option):
+                thiswidget.set_json_data(option)
+            return EnumPicker(schemanode, jsonnode.get_data(), on_select)
+        options = []
+        self._radiolist = []
         maxlen = 3
         for option in schemanode.enum_options():
             if(jsonnode.get_data() == option):
@@ -180,7 +242,7 @@ class EnumEditWidget(GenericEditWidget):
 
             def on_state_change(self, state, user_data=None):
                 if state:
-                    jsonnode.set_data(user_data)
+                    thiswidget.set_json_data(user_data)
 
             maxlen = max(len(option), maxlen)
             options.append(urwid.RadioButton(self._radiolist, option,
@@ -189,6 +251,149 @@ class EnumEditWidget(GenericEditWidget):
         return urwid.GridFlow(options, maxlen+6, 2, 0, 'left')
 
 
+def _to_unicode(text):
+    if isinstance(text, str):
+        return text.decode('utf-8', 'replace')
+    return unicode(text)
+
+
+class EnumIndex(object):
+    """Case-insensitive prefix index over the options of an enum"""
+    def __init__(self, options):
+        keyed = sorted([(_to_unicode(option).lower(), i) 
+                        for i, option in enumerate(options)])
+        self._keys = [key for key, i in keyed]
+        self._indexes = [i for key, i in keyed]
+
+    def find_prefix(self, prefix):
+        """Return the indexes of the options starting with prefix, in order"""
+        prefix = _to_unicode(prefix).lower()
+        i = bisect.bisect_left(self._keys, prefix)
+        found = []
+        while i < len(self._keys) and self._keys[i].startswith(prefix):
+            found.append(self._indexes[i])
+            i += 1
+        found.sort()
+        return found
+
+
+def get_enum_index(schemanode):
+    """Return the EnumIndex for schemanode, building it the first time"""
+    index = getattr(schemanode, '_enumindex', None)
+    if index is None:
+        index = EnumIndex(schemanode.enum_options())
+        schemanode._enumindex = index
+    return index
+
+
+class EnumPicker(urwid.WidgetWrap):
+    """
+    Compact editor for an enum of any size.  It shows the current value, and 
+    enter (or space) opens a drop-down list of the options under it: typing
+    filters the list by prefix, up/down/page up/page down move through it, 
+    enter picks an option and esc closes the list.  Only the options in view
+    get widgets, and the prefix index is only built once the list is 
+    filtered, so loading the widget doesn't depend on the number of options.
+    """
+    def __init__(self, schemanode, value, on_select, height=8):
+        self._schemanode = schemanode
+        self._value = value
+        self._on_select = on_select
+        self._height = height
+        self._filter = None
+        urwid.WidgetWrap.__init__(self, self._get_value_widget())
+
+    def _get_value_widget(self):
+        text = urwid.SelectableIcon("< %s >" % _to_unicode(self._value), 2)
+        return urwid.AttrWrap(text, 'editfield', 'editfieldfocus')
+
+    def is_open(self):
+        return self._filter is not None
+
+    def open(self):
+        options = self._schemanode.enum_options()
+        self._filter = urwid.Edit("")
+        self._matches = xrange(len(options))
+        try:
+            self._pos = options.index(self._value)
+        except ValueError:
+            self._pos = 0
+        self._top = max(self._pos - self._height // 2, 0)
+        self._update()
+
+    def close(self):
+        self._filter = None
+        self._w = self._get_value_widget()
+
+    def select(self, option):
+        self._value = option
+        self.close()
+        self._on_select(option)
+
+    def keypress(self, size, key):
+        if not self.is_open():
+            if key in ('enter', ' '):
+                self.open()
+                return None
+            return key
+        moves = {'up': -1, 'down': 1, 
+                 'page up': -self._height, 'page down': self._height}
+        if key == 'esc':
+            self.close()
+        elif key == 'enter':
+            if len(self._matches) > 0:
+                options = self._schemanode.enum_options()
+                self.select(options[self._matches[self._pos]])
+        elif key in moves:
+            self._move(moves[key])
+        else:
+            oldtext = self._filter.get_edit_text()
+            if self._filter.keypress(size, key) is not None:
+                # leave other keys to the tree (e.g. tab)
+                return key
+            text = self._filter.get_edit_text()
+            if text != oldtext:
+                self._set_filter(text)
+        return None
+
+    def _set_filter(self, text):
+        options = self._schemanode.enum_options()
+        if text == "":
+            self._matches = xrange(len(options))
+        else:
+            self._matches = get_enum_index(self._schemanode).find_prefix(text)
+        self._pos = 0
+        self._top = 0
+        self._update()
+
+    def _move(self, offset):
+        if len(self._matches) == 0:
+            return
+        self._pos = min(max(self._pos + offset, 0), len(self._matches) - 1)
+        if self._pos < self._top:
+            self._top = self._pos
+        elif self._pos >= self._top + self._height:
+            self._top = self._pos - self._height + 1
+        self._update()
+
+    def _update(self):
+        """Rebuild the open list for the options in view"""
+        options = self._schemanode.enum_options()
+        self._filter.set_caption("(%i of %i) " % (len(self._matches), 
+                                                  len(options)))
+        rows = [urwid.AttrWrap(self._filter, 'editfield', 'editfieldfocus')]
+        end = min(self._top + self._height, len(self._matches))
+        for i in range(self._top, end):
+            text = _to_unicode(options[self._matches[i]])
+            if i == self._pos:
+                rows.append(urwid.Text(('editfieldfocus', "> " + text)))
+            else:
+                rows.append(urwid.Text(('editfield', "  " + text)))
+        if len(self._matches) == 0:
+            rows.append(urwid.Text("  (no matches)"))
+        self._w = urwid.Pile(rows)
+
+
 class KeyEditWidget(GenericEditWidget):
     """ Edit the key associated with this node """
 
@@ -272,10 +477,8 @@ class FieldAddButtons(BaseJsonEditWidget):
         def on_press(button, user_data=None):
             parentnode.add_child_node(user_data['key'])
 
-        jsonnode = self.get_node().get_parent().get_value()
         maxlen = 3
-        for key in jsonnode.get_available_keys():
-            fieldname = jsonnode.get_child_title(key)
+        for key, fieldname in parentnode.get_field_add_choices():
             maxlen = max(len(fieldname), maxlen)
             buttons.append(urwid.Button(fieldname, on_press, {'key': key}))
         return urwid.GridFlow(buttons, maxlen+4, 2, 0, 'left')
@@ -304,11 +507,145 @@ class FieldAddNode(TreeNode):
         return self.get_value().is_insertable()
 
 
+class ArrayPageKey(object):
+    """
+    Key for the page of array items from start to start + span - 1.  Pages 
+    with more than ARRAY_PAGE_SIZE items are split into smaller pages.
+    """
+    def __init__(self, start, span):
+        self.start = start
+        self.span = span
+
+    def __eq__(self, other):
+        return (isinstance(other, ArrayPageKey) and 
+                (self.start, self.span) == (other.start, other.span))
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((self.start, self.span))
+
+
+class ArrayPageWidget(ParentWidget):
+    """ Collapsible range of array items """
+    def get_display_text(self):
+        start, end = self.get_node().get_range()
+        return "[%i..%i]" % (start, end - 1)
+
+    def unhandled_keys(self, size, key):
+        return key
+
+
+class ArrayPageNode(ParentNode):
+    """
+    Page of the items of a large array.  The items stay keyed by their array
+    index, and are cached by the JsonWidgetParent for the whole array (the 
+    pages share its dict of child nodes), so edits which shift items from
+    one page to another are handled in one place.
+    """
+    def __init__(self, arraynode, parent=None, key=None, depth=None):
+        ParentNode.__init__(self, arraynode.get_value(), parent=parent, 
+                            key=key, depth=depth)
+        self._arraynode = arraynode
+        self._children = arraynode._children
+
+    def get_range(self):
+        """Return the (start, end) indexes of the items on this page"""
+        key = self.get_key()
+        length = len(self.get_value().get_children())
+        return key.start, min(key.start + key.span, length)
+
+    def load_widget(self):
+        return ArrayPageWidget(self)
+
+    def is_expanded_initially(self):
+        return False
+
+    def load_child_keys(self):
+        start, end = self.get_range()
+        span = self.get_key().span
+        if span > ARRAY_PAGE_SIZE:
+            subspan = span // ARRAY_PAGE_SIZE
+            return [ArrayPageKey(i, subspan) 
+                    for i in range(start, end, subspan)]
+        else:
+            return range(start, end)
+
+    def load_child_node(self, key):
+        if isinstance(key, ArrayPageKey):
+            return ArrayPageNode(self._arraynode, parent=self, key=key, 
+                                 depth=self.get_depth() + 1)
+        else:
+            return self._arraynode.load_child_node(key)
+
+    def forget_child_keys(self):
+        """Have the item keys reloaded when next needed"""
+        self._child_keys = None
+        self._child_index = None
+        self.clear_last_descendant()
+
+    def unload(self):
+        # the child nodes belong to the JsonWidgetParent
+        TreeNode.unload(self)
+
+    def is_evictable(self):
+        # a collapsed page is rebuilt collapsed
+        return not getattr(self._widget, 'expanded', False)
+
+    def evict(self):
+        # the nodes on this page go with it
+        for key in self.get_child_keys():
+            child = self._children.get(key)
+            if child is not None:
+                child.evict()
+        ParentNode.evict(self)
+
+    def delete_child_node(self, key):
+        self._arraynode.delete_child_node(key)
+
+    def insert_child_node(self, key):
+        self._arraynode.insert_child_node(key)
+
+    def get_title_max_length(self):
+        return self._arraynode.get_title_max_length()
+
+    def is_deletable(self):
+        return False
+
+    def is_insertable(self):
+        return False
+
+
+def expand_ancestors(treenode):
+    """
+    Expand the collapsed objects, arrays and pages of array items holding 
+    treenode, so that it's shown
+    """
+    parent = treenode.get_parent()
+    while parent is not None:
+        widget = parent.get_widget()
+        if not widget.expanded:
+            widget.set_expanded(True)
+        parent = parent.get_parent()
+
+
 class JsonWidgetNode(TreeNode):
     def __init__(self, jsonnode, parent=None, key=None, depth=None):
         key = jsonnode.get_key()
-        depth = jsonnode.get_depth()
+        if depth is None:
+            depth = jsonnode.get_depth()
         TreeNode.__init__(self, jsonnode, key=key, parent=parent, depth=depth)
+        jsonnode.add_listener(self._handle_json_event)
+
+    def _handle_json_event(self, event):
+        if event.type == JsonNodeEvent.VALUE_CHANGED:
+            if self._widget is not None and not self._widget.is_storing():
+                self.refresh_widget()
+
+    def unload(self):
+        self.get_value().remove_listener(self._handle_json_event)
+        TreeNode.unload(self)
 
     def load_widget(self):
         jsonnode = self.get_value()
@@ -352,33 +689,187 @@ class JsonWidgetNode(TreeNode):
         return self.get_value().is_insertable()
 
 class JsonWidgetParent(ParentNode):
+    """
+    Tree node for a JSON object or array.  Objects and arrays nested 
+    collapse_depth or more levels deep, or with more than collapse_size 
+    children, start out collapsed, as do those with a "collapsed" schema hint.
+    """
     def __init__(self, jsonnode, parent=None, key=None, depth=None, 
-                 listbox=None):
+                 listbox=None, collapse_depth=None, collapse_size=None):
         key = jsonnode.get_key()
-        depth = jsonnode.get_depth()
+        if depth is None:
+            depth = jsonnode.get_depth()
         self._fieldaddkey = FieldAddKey()
         if jsonnode.is_additional_props_node():
             self._keyeditkey = KeyEditKey()
         self._listbox = listbox
+        self._collapse_depth = collapse_depth
+        self._collapse_size = collapse_size
         ParentNode.__init__(self, jsonnode, key=key, parent=parent, 
                             depth=depth)
+        # span of the top level pages of a large array (None if unpaged)
+        self._page_span = None
+        # cached [(key, title), ...] of the children which can be added, and
+        # get_title_max_length; both are reset when this node's value or 
+        # children change
+        self._fieldaddchoices = None
+        self._titlemaxlen = None
+        jsonnode.add_listener(self._handle_json_event)
 
     def load_widget(self):
         return ArrayEditWidget(self)
 
+    def get_listbox(self):
+        """The JsonFrame showing this tree, if any"""
+        return self._listbox
+
+    def is_expanded_initially(self):
+        jsonnode = self.get_value()
+        if jsonnode.get_schema_node().is_collapsed():
+            return False
+        if (self._collapse_depth is not None and 
+            jsonnode.get_depth() >= self._collapse_depth):
+            return False
+        if (self._collapse_size is not None and 
+            len(jsonnode.get_children()) > self._collapse_size):
+            return False
+        return True
+
+    def _handle_json_event(self, event):
+        """
+        Keep the cached child nodes in line with the JsonNode.  Only the 
+        nodes for the affected key (and, for arrays, the cached nodes whose 
+        index shifted) are touched; the rest keep their widgets.
+        """
+        self._fieldaddchoices = None
+        self._titlemaxlen = None
+        if event.type == JsonNodeEvent.VALUE_CHANGED:
+            if event.oldchildren is not None:
+                # new children came with the new value
+                for child in self._children.values():
+                    child.unload()
+                self._children.clear()
+                self.get_child_keys(reload=True)
+            self.refresh_widget()
+            return
+        isarray = isinstance(self.get_value().children, list)
+        if isarray and self._get_page_span() != self._page_span:
+            # the array needs to be split into pages differently
+            for child in self._children.values():
+                child.unload()
+            self._children.clear()
+        elif event.type == JsonNodeEvent.CHILD_INSERTED:
+            if isarray:
+                self._shift_child_nodes(event.key, 1)
+        elif event.type == JsonNodeEvent.CHILD_REMOVED:
+            child = self._children.pop(event.key, None)
+            if child is not None:
+                child.unload()
+            if isarray:
+                self._shift_child_nodes(event.key + 1, -1)
+        elif event.type == JsonNodeEvent.KEY_RENAMED:
+            child = self._children.pop(event.oldkey, None)
+            if child is not None:
+                child.set_key(event.key)
+                self._children[event.key] = child
+                child.refresh_widget()
+        self.get_child_keys(reload=True)
+        if self._page_span is not None:
+            self._update_pages(event.key)
+        # the count shown while collapsed has changed
+        if self._widget is not None and not self._widget.expanded:
+            self._widget.update_widget()
+        # the list of available keys has changed
+        if self._fieldaddkey in self._children:
+            self._children[self._fieldaddkey].refresh_widget()
+
+    def _get_page_span(self):
+        """Return the number of items in each top level page of the array"""
+        jsonnode = self.get_value()
+        if not isinstance(jsonnode.children, list):
+            return None
+        length = len(jsonnode.get_children())
+        if length <= ARRAY_PAGE_SIZE:
+            return None
+        span = ARRAY_PAGE_SIZE
+        while length > span * ARRAY_PAGE_SIZE:
+            span *= ARRAY_PAGE_SIZE
+        return span
+
+    def _get_page_node(self, index):
+        """Return the page which holds the item at index"""
+        node = self
+        span = self._page_span
+        while span >= ARRAY_PAGE_SIZE:
+            node = node.get_child_node(ArrayPageKey(index - index % span, 
+                                                    span))
+            span //= ARRAY_PAGE_SIZE
+        return node
+
+    def _update_pages(self, start):
+        """Update the pages holding items from index start on"""
+        length = len(self.get_value().get_children())
+        for key in self._children.keys():
+            if not isinstance(key, ArrayPageKey):
+                continue
+            if key.start >= length:
+                self._children.pop(key).unload()
+            elif key.start + key.span > start:
+                page = self._children[key]
+                page.forget_child_keys()
+                page.refresh_widget()
+
+    def _shift_child_nodes(self, start, offset):
+        """Move the cached nodes for array indexes >= start by offset"""
+        keys = [key for key in self._children 
+                if isinstance(key, (int, long)) and key >= start]
+        keys.sort(reverse=(offset > 0))
+        children = []
+        for key in keys:
+            child = self._children.pop(key)
+            child.set_key(key + offset)
+            self._children[key + offset] = child
+            children.append(child)
+            # titles include the index
+            child.refresh_widget()
+        if self._page_span is not None:
+            # loading pages can evict some of the children from the cache
+            for child in children:
+                if child._is_attached():
+                    child._parent = self._get_page_node(child.get_key())
+
+    def unload(self):
+        self.get_value().remove_listener(self._handle_json_event)
+        ParentNode.unload(self)
+
     def load_child_keys(self):
         jsonnode = self.get_value()
         keys = []
         if jsonnode.is_additional_props_node():
             keys.append(self._keyeditkey)
-        keys.extend(jsonnode.get_child_keys())
-        if len(jsonnode.get_available_keys()) > 0:
+        self._page_span = self._get_page_span()
+        if self._page_span is None:
+            keys.extend(jsonnode.get_child_keys())
+        else:
+            length = len(jsonnode.get_children())
+            keys.extend([ArrayPageKey(i, self._page_span) 
+                         for i in range(0, length, self._page_span)])
+        if len(self.get_field_add_choices()) > 0:
             fieldaddkey = self._fieldaddkey
             keys.append(fieldaddkey)
         return keys
 
     def load_child_node(self, key):
-        depth = self.get_depth() + 1
+        if isinstance(key, ArrayPageKey):
+            return ArrayPageNode(self, parent=self, key=key, 
+                                 depth=self.get_depth() + 1)
+        parent = self
+        if isinstance(key, (int, long)):
+            # the keys say whether the array is split into pages
+            self.get_child_keys()
+            if self._page_span is not None:
+                parent = self._get_page_node(key)
+        depth = parent.get_depth() + 1
         if isinstance(key, FieldAddKey):
             return FieldAddNode(None, parent=self, depth=depth, key=key)
         elif isinstance(key, KeyEditKey):
@@ -387,18 +878,31 @@ class JsonWidgetParent(ParentNode):
             jsonnode = self.get_value().get_child(key)
             schemanode = jsonnode.get_schema_node()
             if schemanode.is_type('object') or schemanode.is_type('array'):
-                return JsonWidgetParent(jsonnode, parent=self, key=key, 
-                                        depth=depth, listbox=self._listbox)
+                return JsonWidgetParent(jsonnode, parent=parent, key=key, 
+                                        depth=depth, listbox=self._listbox,
+                                        collapse_depth=self._collapse_depth,
+                                        collapse_size=self._collapse_size)
             else:
-                return JsonWidgetNode(jsonnode, parent=self, key=key, 
+                return JsonWidgetNode(jsonnode, parent=parent, key=key, 
                                       depth=depth)
 
+    def get_tree_node(self, jsonnode):
+        """
+        Return the TreeNode below this one displaying jsonnode, expanding
+        everything on the way
+        """
+        path = jsonnode.get_path()[len(self.get_value().get_path()):]
+        treenode = self
+        for key in path:
+            treenode = treenode.get_child_node(key)
+        expand_ancestors(treenode)
+        return treenode
+
     def add_child_node(self, key):
-        # update the json first
+        # update the json first; our cached child nodes are updated from the
+        # resulting event
         jsonnode = self.get_value()
         jsonnode.add_child(key)
-        # refresh the child key cache
-        self.get_child_keys(reload=True)
         newnode = self.get_child_node(key)
         # change the focus to the new field.  This will be especially
         # important should this be the last new field, since the last button
@@ -407,11 +911,6 @@ class JsonWidgetParent(ParentNode):
         offset, inset = self._listbox.get_focus_offset_inset(size)
         self._listbox.change_focus(size, newnode, coming_from='below',
                                    offset_inset = offset)
-        # refresh the field add buttons, since the list of available keys has
-        # changed
-        if len(jsonnode.get_available_keys()) > 0:
-            fieldaddnode = self.get_child_node(self._fieldaddkey)
-            fieldaddnode.get_widget(reload=True)
 
     def delete_node(self):
         '''Delete this node and all of its children'''
@@ -421,14 +920,7 @@ class JsonWidgetParent(ParentNode):
             keys = jsonnode.get_child_keys()
             for key in reversed(keys):
                 jsonnode.delete_child(key)
-                self._children.pop(key)
             jsonnode.set_data(None)
-            self.get_child_keys(reload=True)
-            self.get_widget(reload=True)
-            # refresh the field add buttons, since the list of available keys 
-            # has changed
-            fieldaddnode = self.get_child_node(self._fieldaddkey)
-            fieldaddnode.get_widget(reload=True)
         else:
             parent.delete_child_node(self.get_key())
 
@@ -438,43 +930,28 @@ class JsonWidgetParent(ParentNode):
         prevnode = childnode.get_widget().prev_inorder().get_node()
         size = self._listbox._size
         offset, inset = self._listbox.get_focus_offset_inset(size)
-        # update the json
+        # update the json (and through it, this node tree)
         jsonnode = self.get_value()
         jsonnode.delete_child(key)
-        # update this node tree
-        self._children.pop(key)
         # change focus
-        keys = self.get_child_keys(reload=True)
         self._listbox.change_focus(size, prevnode, coming_from='below',
                                    offset_inset = offset)
-        # refresh the field add buttons, since the list of available keys has
-        # changed
-        fieldaddnode = self.get_child_node(self._fieldaddkey)
-        fieldaddnode.get_widget(reload=True)
 
     def is_deletable(self):
         return self.get_value().is_deletable()
 
     def insert_child_node(self, key):
         """insert a node just prior to the given key"""
-        # update the json first
+        # update the json first; cached nodes for later items are shifted 
+        # in response
         jsonnode = self.get_value()
         jsonnode.insert_child(key)
-        # refresh the child key cache
-        keys = self.get_child_keys(reload=True)
-        for k in keys:
-            self.get_child_node(k, reload=True)
         # change the focus to the new field.
         newnode = self.get_child_node(key)
         size = self._listbox._size
         offset, inset = self._listbox.get_focus_offset_inset(size)
         self._listbox.change_focus(size, newnode, coming_from='below',
                                    offset_inset = offset)
-        # refresh the field add buttons, since the list of available keys has
-        # changed
-        if len(jsonnode.get_available_keys()) > 0:
-            fieldaddnode = self.get_child_node(self._fieldaddkey)
-            fieldaddnode.get_widget(reload=True)
 
     def insert_node(self):
         """ Insert a node before this one """
@@ -485,8 +962,24 @@ class JsonWidgetParent(ParentNode):
         """ Can a node be inserted at this point in the tree? """
         return self.get_value().is_insertable()
 
+    def get_field_add_choices(self):
+        """
+        Return [(key, title), ...] for the children which can be added, as
+        shown by FieldAddButtons
+        """
+        if self._fieldaddchoices is None:
+            jsonnode = self.get_value()
+            self._fieldaddchoices = [(key, jsonnode.get_child_title(key))
+                                     for key in jsonnode.get_available_keys()]
+        return self._fieldaddchoices
+
     def get_title_max_length(self):
         """Get max length of child titles (not counting maps and seqs)"""
+        if self._titlemaxlen is None:
+            self._titlemaxlen = self._get_title_max_length()
+        return self._titlemaxlen
+
+    def _get_title_max_length(self):
         maxlen = 0
         myval = self.get_value()
         if myval.is_type('array'):
@@ -501,21 +994,108 @@ class JsonWidgetParent(ParentNode):
         return maxlen
     
     def change_child_key(self, oldkey, newkey):
-        ParentNode.change_child_key(self, oldkey, newkey)
-        jsonnode = self.get_value().change_child_key(oldkey, newkey)
-        self.get_child_keys(reload=True)
-        self.get_widget(reload=True)
+        try:
+            self.get_value().change_child_key(oldkey, newkey)
+        except JsonNodeError as inst:
+            raise TreeWidgetError(str(inst))
+
+
+class JsonTreeWalker(TreeWalker):
+    """
+    TreeWalker which follows changes to the JsonNode tree, so that the 
+    display is redrawn and the focus doesn't stay on a removed node
+    """
+    def __init__(self, start_from):
+        TreeWalker.__init__(self, start_from)
+        jsonroot = start_from.get_value().get_root()
+        jsonroot.add_listener(self._handle_json_event, subtree=True)
+
+    def _handle_json_event(self, event):
+        if event.type == JsonNodeEvent.CHILD_REMOVED:
+            # if the focus was within the removed child, move it to the parent
+            node = self.focus
+            while node is not None and node.get_value() is not event.child:
+                node = node.get_parent()
+            if node is not None and node.get_parent() is not None:
+                self.focus = node.get_parent()
+                self._pin_focus()
+        if self.focus.get_parent() is not None and \
+                not self.focus._is_attached():
+            self._refocus()
+        # items shifted onto another page stay in view
+        expand_ancestors(self.focus)
+        self._modified()
+
+    def _refocus(self):
+        """Find the focus again after its node was replaced (by repaging)"""
+        node = self.focus
+        while not isinstance(node.get_value(), JsonNode):
+            node = node.get_parent()
+        root = node.get_root()
+        try:
+            self.focus = root.get_tree_node(node.get_value())
+        except (KeyError, IndexError, JsonNodeError, TreeWidgetError):
+            self.focus = root
+        self._pin_focus()
 
 
 class JsonFrame(TreeListBox):
-    def __init__(self, jsonobj):
+    """
+    Tree view of a JsonNode.  With buffer_edits set, text typed into an edit
+    field is held in the field until commit_pending_edit is called, or the 
+    focus moves, rather than being stored in the JsonNode keystroke by 
+    keystroke.
+    """
+    # GenericEditWidget holding text which isn't stored yet, or None
+    _pendingedit = None
+
+    def __init__(self, jsonobj, collapse_depth=None, collapse_size=None,
+                 buffer_edits=False):
         self.json = jsonobj
-        walker = TreeWalker(JsonWidgetParent(self.json, listbox=self))
+        self._buffer_edits = buffer_edits
+        self._rootnode = JsonWidgetParent(self.json, listbox=self,
+                                          collapse_depth=collapse_depth,
+                                          collapse_size=collapse_size)
+        self._rootnode.set_node_cache(NodeCache())
+        walker = JsonTreeWalker(self._rootnode)
         return super(self.__class__, self).__init__(walker)
 
+    def get_tree_node(self, jsonnode):
+        """Return the TreeNode displaying jsonnode"""
+        return self._rootnode.get_tree_node(jsonnode)
+
+    def focus_json_node(self, jsonnode):
+        """Move the focus to the widget for jsonnode"""
+        self.commit_pending_edit()
+        self.body.set_focus(self.get_tree_node(jsonnode))
+
+    def is_buffering_edits(self):
+        return self._buffer_edits
+
+    def set_pending_edit(self, widget):
+        """Note that widget has text to commit"""
+        if self._pendingedit is not widget:
+            self.commit_pending_edit()
+            self._pendingedit = widget
+
+    def has_pending_edit(self):
+        return self._pendingedit is not None
+
+    def commit_pending_edit(self):
+        """Store any text typed but not stored yet in the JsonNode"""
+        widget = self._pendingedit
+        if widget is not None:
+            self._pendingedit = None
+            widget.commit_edit()
+
     def keypress(self, size, key):
         # HACK: this is the only reliable way I could figure out how to get
         # this info to add_child_node
         self._size = size
-        return self.__super.keypress(size, key)
+        key = self.__super.keypress(size, key)
+        if self._pendingedit is not None and \
+                self._pendingedit.get_node() is not self.body.focus:
+            # done with that field
+            self.commit_pending_edit()
+        return key
 
@@ -32,8 +32,14 @@ Features:
 
 import urwid
 
+import collections
 import os
 
+try:
+    from collections import OrderedDict
+except ImportError:
+    OrderedDict = None
+
 
 class TreeWidgetError(RuntimeError):
     pass
@@ -185,8 +191,11 @@ class ParentWidget(TreeWidget):
     """Widget for an interior tree node."""
 
     def __init__(self, node):
+        # set first, since the display text can depend on it
+        self.expanded = node.is_expanded_initially()
         self.__super.__init__(node)
-        self.expanded = True
+        # a rebuilt widget may not be collapsed like the old one was
+        node.clear_last_descendant()
         
         self.update_widget()
     
@@ -199,15 +208,18 @@ class ParentWidget(TreeWidget):
             mark = "+"
         self._innerwidget.set_text([('dirmark', mark), " ", self.get_display_text()] )
 
+    def set_expanded(self, expanded):
+        self.expanded = expanded
+        self._node.clear_last_descendant()
+        self.update_widget()
+
     def keypress(self, size, key):
         """Handle expand & collapse requests."""
         
         if key in ("+", "right"):
-            self.expanded = True
-            self.update_widget()
+            self.set_expanded(True)
         elif key == "-":
-            self.expanded = False
-            self.update_widget()
+            self.set_expanded(False)
         else:
             return self.__super.keypress(size, key)
     
@@ -216,8 +228,7 @@ class ParentWidget(TreeWidget):
             return False
 
         if row == 0 and col == self.get_indent_cols():
-            self.expanded = not self.expanded
-            self.update_widget()
+            self.set_expanded(not self.expanded)
             return True
         
         return False
@@ -234,20 +245,113 @@ class ParentWidget(TreeWidget):
                 return None
 
     def last_child(self):
-        """Return last child if expanded."""
-        if not self.expanded:
+        """Return the last descendant shown if expanded."""
+        lastnode = self._node.get_last_descendant()
+        if lastnode is None:
             return None
         else:
-            if self._node.has_children():
-                lastchild = self._node.get_last_child().get_widget()
-            else:
-                return None
-            # recursively search down for the last descendant
-            lastdescendant = lastchild.last_child()
-            if lastdescendant is None:
-                return lastchild
+            return lastnode.get_widget()
+
+
+class _LruOrder(object):
+    """
+    The parts of OrderedDict that NodeCache uses, for Pythons without it 
+    (before 2.7).  Entries which are moved or removed stay in the queue, 
+    and are skipped once they get to the front.
+    """
+    def __init__(self):
+        # key -> stamp of its latest entry in the queue
+        self._stamps = {}
+        self._queue = collections.deque()
+        self._count = 0
+
+    def __len__(self):
+        return len(self._stamps)
+
+    def __setitem__(self, key, value):
+        # NodeCache only stores True
+        self._count += 1
+        self._stamps[key] = self._count
+        self._queue.append((self._count, key))
+        if len(self._queue) > 2 * len(self._stamps) + 100:
+            self._queue = collections.deque(
+                [(stamp, key) for stamp, key in self._queue 
+                 if self._stamps.get(key) == stamp])
+
+    def pop(self, key, default=None):
+        if self._stamps.pop(key, None) is None:
+            return default
+        return True
+
+    def popitem(self, last=True):
+        """Remove and return the oldest entry (last=False)"""
+        if last:
+            raise NotImplementedError("only the oldest entry can be popped")
+        while len(self._queue) > 0:
+            stamp, key = self._queue.popleft()
+            if self._stamps.get(key) == stamp:
+                del self._stamps[key]
+                return key, True
+        raise KeyError("popitem(): dictionary is empty")
+
+
+class NodeCache(object):
+    """
+    Least-recently-used record of the TreeNodes loaded for a tree.  Once
+    there are more than maxsize of them, the oldest are evicted: dropped from
+    their parent and unloaded, to be rebuilt by load_child_node if they're
+    needed again.  This keeps memory use flat however much of a large tree is
+    scrolled through.
+
+    The focus and its ancestors are never evicted, and neither are nodes
+    which say they can't be (see TreeNode.is_evictable).
+    """
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        if OrderedDict is None:
+            self._nodes = _LruOrder()
+        else:
+            self._nodes = OrderedDict()
+        self._focus = None
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def add(self, node):
+        self._nodes[node] = True
+        if len(self._nodes) > self.maxsize:
+            self._shrink(node)
+
+    def touch(self, node):
+        """Mark node as the most recently used"""
+        if self._nodes.pop(node, None) is not None:
+            self._nodes[node] = True
+
+    def discard(self, node):
+        self._nodes.pop(node, None)
+
+    def set_focus(self, node):
+        """Pin node and its ancestors"""
+        self._focus = node
+
+    def _shrink(self, newnode):
+        # the ancestors are looked up now, since nodes can be moved
+        pinned = set()
+        for node in (newnode, self._focus):
+            while node is not None:
+                pinned.add(node)
+                node = node._parent
+        kept = []
+        while len(self._nodes) > self.maxsize:
+            node = self._nodes.popitem(last=False)[0]
+            if node in pinned or not node.is_evictable():
+                kept.append(node)
             else:
-                return lastdescendant
+                node.evict()
+        for node in kept:
+            # evicting a node can take others with it
+            if node._parent is None or node._is_attached():
+                self._nodes[node] = True
 
 
 class TreeNode(object):
@@ -259,12 +363,17 @@ class TreeNode(object):
     *  parent: a TreeNode which contains a pointer back to this object
     *  widget: The widget used to render the object
     """
+    # NodeCache shared by the nodes of a tree, see set_node_cache
+    _cache = None
+
     def __init__(self, value, parent=None, key=None, depth=None):
         self._key = key
         self._parent = parent
         self._value = value
         self._depth = depth
         self._widget = None
+        if parent is not None:
+            self._cache = parent._cache
 
     def get_widget(self, reload=False):
         """ Return the widget for this node."""
@@ -274,6 +383,41 @@ class TreeNode(object):
 
     def load_widget(self):
         return TreeWidget(self)
+
+    def refresh_widget(self):
+        """Have the widget rebuilt the next time it's needed"""
+        self._widget = None
+
+    def set_node_cache(self, cache):
+        """
+        Bound the number of nodes kept loaded below this (root) node with a 
+        NodeCache.  Call this before any children are loaded.
+        """
+        self._cache = cache
+
+    def unload(self):
+        """
+        Called when the node is dropped from its parent's cache.  Extend to
+        release anything else the node holds on to.
+        """
+        if self._cache is not None:
+            self._cache.discard(self)
+
+    def is_evictable(self):
+        """Can the node cache drop this node, to be rebuilt later?"""
+        return True
+
+    def evict(self):
+        """Drop this node from its parent, which will rebuild it if needed"""
+        parent = self._parent
+        if self._is_attached():
+            del self._parent._children[self._key]
+        self.unload()
+
+    def _is_attached(self):
+        """Is this node still held by its parent (i.e. not evicted)?"""
+        parent = self._parent
+        return parent is not None and parent._children.get(self._key) is self
         
     def get_depth(self):
         if self._depth is None and self._parent is None:
@@ -341,15 +485,43 @@ class ParentNode(TreeNode):
         TreeNode.__init__(self, value, parent=parent, key=key, depth=depth)
 
         self._child_keys = None
+        # position of each key in _child_keys, built when first needed
+        self._child_index = None
         self._children = {}
+        # last node shown below this one, see get_last_descendant
+        self._lastdescendant = None
 
     def load_widget(self):
         return ParentWidget(self)
 
+    def refresh_widget(self):
+        """Update the widget in place, so it stays expanded or collapsed"""
+        if self._widget is not None:
+            self._widget.update_widget()
+
+    def unload(self):
+        for child in self._children.values():
+            child.unload()
+        self._children = {}
+        TreeNode.unload(self)
+
+    def is_evictable(self):
+        # children go first, and nodes which the user expanded or collapsed
+        # stay that way
+        return (len(self._children) == 0 and 
+                (self._widget is None or 
+                 self._widget.expanded == self.is_expanded_initially()))
+
+    def is_expanded_initially(self):
+        """Should the widget start out expanded?"""
+        return True
+
     def get_child_keys(self, reload=False):
         """Return a possibly ordered list of child keys"""
         if self._child_keys is None or reload == True:
             self._child_keys = self.load_child_keys()
+            self._child_index = None
+            self.clear_last_descendant()
         return self._child_keys
 
     def load_child_keys(self):
@@ -365,9 +537,17 @@ class ParentNode(TreeNode):
 
     def get_child_node(self, key, reload=False):
         """Return the child node for a given key.  Create if necessary."""
-        if key not in self._children or reload == True:
-            self._children[key] = self.load_child_node(key)
-        return self._children[key]
+        child = self._children.get(key)
+        if child is None or reload == True:
+            if child is not None:
+                child.unload()
+            child = self.load_child_node(key)
+            self._children[key] = child
+            if self._cache is not None:
+                self._cache.add(child)
+        elif self._cache is not None:
+            self._cache.touch(child)
+        return child
 
     def load_child_node(self, key):
         """Load the child node for a given key (virtual function)"""
@@ -385,9 +565,12 @@ class ParentNode(TreeNode):
         self._children[newkey].set_key(newkey)
 
     def get_child_index(self, key):
+        child_keys = self.get_child_keys()
+        if self._child_index is None:
+            self._child_index = dict((k, i) for i, k in enumerate(child_keys))
         try:
-            return self.get_child_keys().index(key)
-        except ValueError:
+            return self._child_index[key]
+        except KeyError:
             errorstring = ("Can't find key %s in ParentNode %s\n" +
                            "ParentNode items: %s")
             raise TreeWidgetError(errorstring % (key, self.get_key(), 
@@ -438,6 +621,44 @@ class ParentNode(TreeNode):
         """Does this node have any children?"""
         return len(self.get_child_keys())>0
 
+    def get_last_descendant(self):
+        """
+        Return the last node shown below this one (the last child of the last
+        child and so on, down to a collapsed or childless node), or None if
+        this node is collapsed or childless.  The result is cached along the 
+        way down.
+        """
+        path = []
+        node = self
+        while True:
+            cached = getattr(node, '_lastdescendant', None)
+            if cached is not None and cached._is_attached():
+                node = cached
+                break
+            expanded = getattr(node.get_widget(), 'expanded', False)
+            if not expanded or not node.has_children():
+                break
+            path.append(node)
+            node = node.get_last_child()
+        if node is self:
+            return None
+        for parent in path:
+            parent._lastdescendant = node
+        return node
+
+    def clear_last_descendant(self):
+        """
+        Forget the cached last descendant of this node and its ancestors,
+        after a change in what's shown below it
+        """
+        # a collapsed or childless node can be the cached result of its
+        # ancestors without having a result of its own
+        self._lastdescendant = None
+        node = self._parent
+        while node is not None and node._lastdescendant is not None:
+            node._lastdescendant = None
+            node = node._parent
+
 class TreeWalker(urwid.ListWalker):
     """ListWalker-compatible class for browsing directories.
     
@@ -446,15 +667,27 @@ class TreeWalker(urwid.ListWalker):
     def __init__(self, start_from):
         """start_from: TreeNode with the initial focus."""
         self.focus = start_from
+        self._pin_focus()
 
     def get_focus(self):
         widget = self.focus.get_widget()
         return widget, self.focus
         
     def set_focus(self, focus):
+        parent = focus.get_parent()
+        if parent is not None and not focus._is_attached():
+            # evicted by the node cache while the listbox was working out
+            # what to show; get a fresh copy
+            focus = parent.get_child_node(focus.get_key())
         self.focus = focus
+        self._pin_focus()
         self._modified()
 
+    def _pin_focus(self):
+        """Keep the node cache from evicting the focus"""
+        if self.focus._cache is not None:
+            self.focus._cache.set_focus(self.focus)
+
     def get_next(self, start_from):
         widget = start_from.get_widget()
         target = widget.next_inorder()
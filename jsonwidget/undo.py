@@ -0,0 +1,247 @@
+#!/usr/bin/python
+# Undo/redo history for JsonNode trees
+#
+# Copyright (c) 2010, Rob Lanphier
+# All rights reserved.
+# Licensed under BSD-style license.  See LICENSE.txt for details.
+
+"""
+Undo/redo for JsonNode trees.
+
+Rather than snapshotting the data, each edit is recorded along with enough
+information to reverse it.  Records find the nodes they apply to by path 
+when they're undone or redone (replacing an object or array builds new nodes
+for its children, so the nodes themselves can't be kept).  Nodes removed 
+from the tree are kept (not copied) by the record that removed them, so 
+undoing a deletion just reattaches the original subtree.  Undoing or redoing
+a step costs O(depth) per edit in the step (plus the cost of shifting the 
+later items when the edit is to an array).
+"""
+
+import time
+
+from jsonwidget.jsonnode import JsonNodeEvent
+
+
+class UndoError(RuntimeError):
+    pass
+
+
+def get_node_at_path(root, path):
+    node = root
+    for key in path:
+        node = node.get_child(key)
+    return node
+
+
+class SetDataEdit(object):
+    """The value of the node at path in the tree at root was replaced"""
+    def __init__(self, root, path, olddata, newdata):
+        self.root = root
+        self.path = path
+        self.olddata = olddata
+        self.newdata = newdata
+
+    def undo(self):
+        self.get_node().set_data(self.olddata)
+
+    def redo(self):
+        self.get_node().set_data(self.newdata)
+
+    def get_node(self):
+        return get_node_at_path(self.root, self.path)
+
+    def get_focus(self, undone):
+        return self.get_node()
+
+
+class AddChildEdit(object):
+    """
+    child was added at key to the node at path.  Once undone, child is the 
+    node that undoing removed, which redoing puts back.
+    """
+    def __init__(self, root, path, key, child):
+        self.root = root
+        self.path = path
+        self.key = key
+        self.child = child
+
+    def undo(self):
+        parent = self.get_parent()
+        self.child = parent.get_child(self.key)
+        parent.delete_child(self.key)
+
+    def redo(self):
+        self.get_parent().attach_child(self.key, self.child)
+
+    def get_parent(self):
+        return get_node_at_path(self.root, self.path)
+
+    def get_focus(self, undone):
+        if undone:
+            return self.get_parent()
+        return self.get_parent().get_child(self.key)
+
+
+class RemoveChildEdit(AddChildEdit):
+    """child was removed from parent at key"""
+    undo = AddChildEdit.redo
+    redo = AddChildEdit.undo
+
+    def get_focus(self, undone):
+        return AddChildEdit.get_focus(self, not undone)
+
+
+class RenameChildEdit(object):
+    """The child at oldkey of the node at path was moved to newkey"""
+    def __init__(self, root, path, oldkey, newkey):
+        self.root = root
+        self.path = path
+        self.oldkey = oldkey
+        self.newkey = newkey
+
+    def undo(self):
+        self.get_parent().change_child_key(self.newkey, self.oldkey)
+
+    def redo(self):
+        self.get_parent().change_child_key(self.oldkey, self.newkey)
+
+    def get_parent(self):
+        return get_node_at_path(self.root, self.path)
+
+    def get_focus(self, undone):
+        if undone:
+            return self.get_parent().get_child(self.oldkey)
+        return self.get_parent().get_child(self.newkey)
+
+
+class EditHistory(object):
+    """
+    Undo and redo stacks for one JsonNode tree.  Each step on a stack is a
+    list of edit records.  Edits made between begin_group() and end_group()
+    form a single step, as do repeated edits to the same value made less than
+    mergeinterval seconds apart (e.g. typing in a field).
+
+    maxsteps: number of steps to keep on the undo stack
+    """
+    def __init__(self, maxsteps=1000, mergeinterval=1.0):
+        self.maxsteps = maxsteps
+        self.mergeinterval = mergeinterval
+        self._undo = []
+        self._redo = []
+        self._group = None
+        # where each open group starts in self._group
+        self._groupstarts = []
+        self._applying = False
+        self._lasttime = 0
+
+    def handle_event(self, event):
+        """JsonNode listener: record the edit described by a JsonNodeEvent"""
+        root = event.node.get_root()
+        if event.type == JsonNodeEvent.VALUE_CHANGED:
+            edit = SetDataEdit(root, event.path, event.oldvalue, 
+                               event.value)
+        elif event.type == JsonNodeEvent.CHILD_INSERTED:
+            edit = AddChildEdit(root, event.path, event.key, event.child)
+        elif event.type == JsonNodeEvent.CHILD_REMOVED:
+            edit = RemoveChildEdit(root, event.path, event.key, event.child)
+        elif event.type == JsonNodeEvent.KEY_RENAMED:
+            edit = RenameChildEdit(root, event.path, event.oldkey, 
+                                   event.key)
+        else:
+            return
+        self.record(edit)
+
+    def record(self, edit):
+        """Add an edit made to the tree"""
+        if self._applying:
+            return
+        self._redo = []
+        now = time.time()
+        if self._group is not None:
+            self._group.append(edit)
+        elif self._can_merge(edit, now):
+            self._undo[-1][0].newdata = edit.newdata
+        else:
+            self._push([edit])
+        self._lasttime = now
+
+    def _can_merge(self, edit, now):
+        if not isinstance(edit, SetDataEdit) or len(self._undo) == 0:
+            return False
+        last = self._undo[-1]
+        return (len(last) == 1 and isinstance(last[0], SetDataEdit) and
+                last[0].path == edit.path and
+                now - self._lasttime < self.mergeinterval)
+
+    def _push(self, step):
+        self._undo.append(step)
+        if len(self._undo) > self.maxsteps:
+            del self._undo[0]
+
+    def begin_group(self):
+        """Start collecting edits into a single undo step"""
+        if self._group is None:
+            self._group = []
+        self._groupstarts.append(len(self._group))
+
+    def end_group(self):
+        self._groupstarts.pop()
+        if len(self._groupstarts) == 0:
+            if len(self._group) > 0:
+                self._push(self._group)
+            self._group = None
+            # don't merge the next edit into the group
+            self._lasttime = 0
+
+    def rollback_group(self):
+        """
+        Undo the edits made since the matching begin_group(), and end the 
+        group without recording them
+        """
+        start = self._groupstarts[-1]
+        edits = self._group[start:]
+        del self._group[start:]
+        self._apply(edits, undo=True)
+        self.end_group()
+
+    def can_undo(self):
+        return len(self._undo) > 0
+
+    def can_redo(self):
+        return len(self._redo) > 0
+
+    def undo(self):
+        """
+        Undo the most recent step, and return the node the step centered on
+        (e.g. for moving the cursor there).  Listeners on the tree are told
+        about the changes as usual.
+        """
+        if not self.can_undo():
+            raise UndoError("Nothing to undo")
+        step = self._undo.pop()
+        self._apply(step, undo=True)
+        self._redo.append(step)
+        return step[0].get_focus(True)
+
+    def redo(self):
+        """Redo the most recently undone step.  Returns the same as undo()"""
+        if not self.can_redo():
+            raise UndoError("Nothing to redo")
+        step = self._redo.pop()
+        self._apply(step, undo=False)
+        self._undo.append(step)
+        return step[-1].get_focus(False)
+
+    def _apply(self, step, undo):
+        self._applying = True
+        self._lasttime = 0
+        try:
+            if undo:
+                for edit in reversed(step):
+                    edit.undo()
+            else:
+                for edit in step:
+                    edit.redo()
+        finally:
+            self._applying = False
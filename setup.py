@@ -31,9 +31,11 @@ The following utilities are included with jsonwidget:
 * jsonaddress - an example JSON address book editor
 * jwc - a command line utility with the following functions:
 
+  * diff - compare two json files structurally, as a JSON Patch or a report
   * editserver - launch a web server to edit a json file from a browser
   * json2yaml - convert a json file to yaml with comments pulled from schema 
     (also yaml2json to go back)
+  * patch - apply a JSON Patch to a json file, checked against a schema
   * schemagen - create a schema from an example json file
   * validate - validate a JSON file against a schema
 
@@ -0,0 +1,73 @@
+import os
+import shutil
+import tempfile
+
+from jsonwidget.jsonnode import JsonNode
+from jsonwidget.schema import SchemaNode
+from jsonwidget.journal import EditJournal, read_journal, replay_journal
+from jsonwidget.termedit import JsonPinotFile
+
+class TestEditJournal:
+    def setup(self):
+        self.schemastring = """
+            {
+                "type": "seq",
+                "sequence": [
+                    {
+                        "type": "str"
+                    }
+                ]
+            }
+            """
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, "test.json")
+        with open(self.filename, 'w') as f:
+            f.write('["thing1", "thing2", "thing3"]')
+
+    def teardown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_replay(self):
+        schemanode = SchemaNode(string=self.schemastring)
+        jsonnode = JsonNode(filename=self.filename, schemanode=schemanode)
+        journal = EditJournal(self.filename)
+        journal.start()
+        jsonnode.set_journal(journal)
+        jsonnode.insert_child(1)
+        jsonnode.get_child(1).set_data('new')
+        jsonnode.delete_child(3)
+        journal.close()
+
+        header, records = read_journal(journal.journalname)
+        assert len(records) == 3
+        replayed = JsonNode(filename=self.filename, schemanode=schemanode)
+        replay_journal(replayed, records)
+        assert replayed.get_data() == ['thing1', 'new', 'thing2']
+
+    def test_recover_and_save(self):
+        schemanode = SchemaNode(string=self.schemastring)
+        crashed = JsonPinotFile(jsonfile=self.filename, schemaobj=schemanode)
+        crashed.get_json().get_child(0).set_data('edited')
+        crashed.journal.close()
+
+        recovered = JsonPinotFile(jsonfile=self.filename,
+                                  schemaobj=schemanode)
+        assert recovered.journalmessage is not None
+        assert recovered.get_json().get_child(0).get_data() == 'edited'
+        assert not recovered.is_saved()
+        recovered.save_to_file()
+        header, records = read_journal(recovered.journal.journalname)
+        assert records == []
+        recovered.close()
+        assert not os.path.exists(recovered.journal.journalname)
+
+    def test_deferred_sync(self):
+        import time
+        journal = EditJournal(self.filename, syncinterval=0.1)
+        journal.start()
+        # too soon after start() to sync now, but a timer syncs it later
+        journal.append({'op': 'remove', 'path': '/0'})
+        assert journal._unsynced == 1
+        time.sleep(0.3)
+        assert journal._unsynced == 0
+        journal.close()
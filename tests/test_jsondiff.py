@@ -0,0 +1,28 @@
+from jsonwidget.jsonnode import JsonNode
+from jsonwidget.schema import SchemaNode
+from jsonwidget.jsondiff import make_patch
+
+class TestJsonDiff:
+    def setup(self):
+        self.schemanode = SchemaNode(string='{"type": "any"}')
+
+    def get_patch(self, a, b):
+        return make_patch(JsonNode(data=a, schemanode=self.schemanode),
+                          JsonNode(data=b, schemanode=self.schemanode))
+
+    def test_object(self):
+        patch = self.get_patch({"a": 1, "b": [1, 2, 3]},
+                               {"a": 2, "b": [1, 3], "c": None})
+        assert {"op": "replace", "path": "/a", "value": 2} in patch
+        assert {"op": "remove", "path": "/b/1"} in patch
+        assert {"op": "add", "path": "/c", "value": None} in patch
+        assert len(patch) == 3
+
+    def test_keyed_array(self):
+        a = [{"id": 1, "v": "a"}, {"id": 2, "v": "b"}, {"id": 3, "v": "c"}]
+        b = [{"id": 3, "v": "changed"}, {"id": 1, "v": "a"}, 
+             {"id": 2, "v": "b"}]
+        patch = self.get_patch(a, b)
+        assert patch == [{"op": "move", "from": "/2", "path": "/0"},
+                         {"op": "replace", "path": "/0/v", 
+                          "value": "changed"}]
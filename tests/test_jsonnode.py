@@ -24,3 +24,211 @@ class TestJsonNodeArray:
         assert outdata[2] == 'thing2'
         assert len(outdata) == 4
 
+    def test_hash(self):
+        indata = ["thing1", "thing2", "thing3"]
+        schemanode = SchemaNode(string=self.schemastring)
+        jsonnode = JsonNode(data=indata, schemanode=schemanode)
+        other = JsonNode(data=list(indata), schemanode=schemanode)
+        assert jsonnode.get_hash() == other.get_hash()
+        jsonnode.get_child(1).set_data("changed")
+        assert not jsonnode.is_saved()
+        assert jsonnode.get_hash() != other.get_hash()
+        assert jsonnode.diff(other) == ['/1']
+        # typing the original value back counts as unchanged
+        jsonnode.get_child(1).set_data("thing2")
+        assert jsonnode.is_saved()
+        assert jsonnode.diff(other) == []
+
+    def test_saved_hash_step(self):
+        indata = ["thing%i" % i for i in range(10)]
+        schemanode = SchemaNode(string=self.schemastring)
+        jsonnode = JsonNode(data=indata, schemanode=schemanode)
+        # an edit before the digest is ready doesn't hash the tree, and 
+        # is_saved goes by the edit count
+        jsonnode.get_child(1).set_data("changed")
+        assert jsonnode._hash is None
+        jsonnode.get_child(1).set_data("thing1")
+        assert not jsonnode.is_saved()
+        jsonnode = JsonNode(data=indata, schemanode=schemanode)
+        steps = 1
+        while not jsonnode.saved_hash_step(limit=3):
+            steps += 1
+        assert steps == 4
+        jsonnode.get_child(1).set_data("changed")
+        assert not jsonnode.is_saved()
+        jsonnode.get_child(1).set_data("thing1")
+        assert jsonnode.is_saved()
+
+    def test_batch(self):
+        indata = ["thing1", "thing2", "thing3"]
+        schemanode = SchemaNode(string=self.schemastring)
+        jsonnode = JsonNode(data=indata, schemanode=schemanode)
+        events = []
+        jsonnode.add_listener(events.append, subtree=True)
+        with jsonnode.batch():
+            for child in jsonnode.get_children():
+                child.set_data("new")
+            assert events == []
+        assert len(events) == 3
+        assert jsonnode.editcount == 1
+        try:
+            with jsonnode.batch():
+                jsonnode.delete_child(0)
+                raise ValueError
+        except ValueError:
+            pass
+        assert jsonnode.get_data() == ["new", "new", "new"]
+        assert len(events) == 3
+        assert jsonnode.editcount == 1
+
+
+class TestJsonNodeSave:
+    def test_save_preserves_key_order(self):
+        import json
+        import os
+        import tempfile
+        import jsonwidget
+        fd, filename = tempfile.mkstemp(suffix='.json')
+        os.write(fd, '{"b": 1, "a": {"y": [1, 2.5], "x": null}}')
+        os.close(fd)
+        try:
+            schemafile = jsonwidget.find_system_schema("openschema.json")
+            jsonnode = JsonNode(filename=filename, schemafile=schemafile)
+            jsonnode.save_to_file()
+            with open(filename) as f:
+                outbuffer = f.read()
+        finally:
+            os.remove(filename)
+        assert outbuffer.index('"b"') < outbuffer.index('"a"')
+        assert outbuffer.index('"y"') < outbuffer.index('"x"')
+        assert json.loads(outbuffer) == jsonnode.get_data()
+
+    def test_incremental_save(self):
+        import os
+        import tempfile
+        import jsonwidget
+        fd, filename = tempfile.mkstemp(suffix='.json')
+        os.write(fd, ' {"b":1,  "a": {"y":[1, 2.5],\n "x":null}}\n')
+        os.close(fd)
+        try:
+            schemafile = jsonwidget.find_system_schema("openschema.json")
+            jsonnode = JsonNode(filename=filename, schemafile=schemafile)
+            jsonnode.get_child('a').get_child('y').get_child(1).set_data(3)
+            jsonnode.save_to_file()
+            jsonnode.get_child('b').set_data(2)
+            jsonnode.save_to_file()
+            with open(filename) as f:
+                outbuffer = f.read()
+        finally:
+            os.remove(filename)
+        assert outbuffer == ' {"b":2,  "a": {"y":[1, 3],\n "x":null}}\n'
+
+    def test_load_progress(self):
+        import os
+        import tempfile
+        fd, filename = tempfile.mkstemp(suffix='.json')
+        os.write(fd, '{"b": [%s], "a": null}' % ", ".join(["1"] * 2500))
+        os.close(fd)
+        reports = []
+        def progress(stage, done, total):
+            reports.append((stage, done, total))
+        try:
+            # no schema given, so one gets derived from the file
+            jsonnode = JsonNode(filename=filename, progress=progress)
+        finally:
+            os.remove(filename)
+        size = len(jsonnode.get_child('b').get_children())
+        assert size == 2500
+        assert jsonnode.get_child_keys() == ['b', 'a']
+        assert [stage for stage, done, total in reports] == \
+            ["read", "parse", "schema", "build", "build"]
+        assert reports[0][1] == reports[0][2]
+        assert reports[-1][1] == 2000
+
+    def test_save_snapshot(self):
+        import os
+        import tempfile
+        import jsonwidget
+        fd, filename = tempfile.mkstemp(suffix='.json')
+        os.write(fd, '{"b": 1, "a": [1, 2, 3]}\n')
+        os.close(fd)
+        try:
+            schemafile = jsonwidget.find_system_schema("openschema.json")
+            jsonnode = JsonNode(filename=filename, schemafile=schemafile)
+            jsonnode.get_child('b').set_data(2)
+            snapshot = jsonnode.take_save_snapshot()
+            # edits made while the snapshot is written go in the next save
+            jsonnode.get_child('a').get_child(0).set_data(5)
+            snapshot.write()
+            snapshot.commit()
+            with open(filename) as f:
+                assert f.read() == '{"b": 2, "a": [1, 2, 3]}\n'
+            assert not jsonnode.is_saved()
+            # a failed write leaves the changes to be saved next time
+            snapshot = jsonnode.take_save_snapshot()
+            snapshot.filename = os.path.join(filename, "missing")
+            try:
+                snapshot.write()
+            except EnvironmentError:
+                snapshot.cancel()
+            else:
+                assert False, "write should fail"
+            assert not jsonnode.is_saved()
+            jsonnode.save_to_file()
+            assert jsonnode.is_saved()
+            with open(filename) as f:
+                assert f.read() == '{"b": 2, "a": [5, 2, 3]}\n'
+        finally:
+            os.remove(filename)
+
+    def test_save_replaced_containers(self):
+        import json
+        import os
+        import tempfile
+        import jsonwidget
+        from jsonwidget.undo import EditHistory
+        fd, filename = tempfile.mkstemp(suffix='.json')
+        os.write(fd, '{"a": {"x": 1}, "b": [1, 2]}\n')
+        os.close(fd)
+        try:
+            schemafile = jsonwidget.find_system_schema("openschema.json")
+            jsonnode = JsonNode(filename=filename, schemafile=schemafile)
+            jsonnode.set_history(EditHistory())
+            jsonnode.get_child('a').set_data({"y": 2})
+            jsonnode.get_child('b').set_data([5])
+            assert jsonnode.get_child('a').get_child('y').get_data() == 2
+            jsonnode.save_to_file()
+            with open(filename) as f:
+                assert json.load(f) == {"a": {"y": 2}, "b": [5]}
+            jsonnode.undo()
+            jsonnode.save_to_file()
+            with open(filename) as f:
+                assert json.load(f) == {"a": {"y": 2}, "b": [1, 2]}
+        finally:
+            os.remove(filename)
+
+    def test_lazy_load(self):
+        import json
+        import os
+        import tempfile
+        fd, filename = tempfile.mkstemp(suffix='.json')
+        os.write(fd, '{"a": {"x": [{"y": 1}, {"y": 2}]}, '
+                     '"b": [1, 2], "c": 3}\n')
+        os.close(fd)
+        try:
+            jsonnode = JsonNode(filename=filename, lazy=True)
+            a = jsonnode.get_child('a')
+            assert a._unbuilt
+            x = a.get_child('x')
+            assert x._unbuilt
+            x.delete_child(0)
+            assert x.get_child(0).get_child('y').get_data() == 2
+            while not jsonnode.build_step(limit=1):
+                pass
+            assert not jsonnode.get_child('b')._unbuilt
+            jsonnode.save_to_file()
+            with open(filename) as f:
+                assert json.load(f) == {"a": {"x": [{"y": 2}]}, 
+                                        "b": [1, 2], "c": 3}
+        finally:
+            os.remove(filename)
@@ -0,0 +1,42 @@
+from jsonwidget.jsonnode import JsonNode
+from jsonwidget.schema import SchemaNode
+from jsonwidget.jsonpatch import JsonPatchError
+
+class TestJsonPatch:
+    def setup(self):
+        self.schemastring = """
+            {
+                "type": "seq",
+                "sequence": [
+                    {
+                        "type": "str"
+                    }
+                ]
+            }
+            """
+
+    def test_apply(self):
+        schemanode = SchemaNode(string=self.schemastring)
+        jsonnode = JsonNode(data=["a", "b", "c"], schemanode=schemanode)
+        jsonnode.apply_patch([{"op": "test", "path": "/0", "value": "a"},
+                              {"op": "remove", "path": "/0"},
+                              {"op": "add", "path": "/-", "value": "d"},
+                              {"op": "move", "from": "/0", "path": "/1"},
+                              {"op": "copy", "from": "/2", "path": "/0"},
+                              {"op": "replace", "path": "/1", "value": "e"}])
+        assert jsonnode.get_data() == ["d", "e", "b", "d"]
+        assert jsonnode.editcount == 1
+
+    def test_rollback(self):
+        schemanode = SchemaNode(string=self.schemastring)
+        jsonnode = JsonNode(data=["a", "b", "c"], schemanode=schemanode)
+        try:
+            # the second operation doesn't fit the schema
+            jsonnode.apply_patch([{"op": "remove", "path": "/0"},
+                                  {"op": "add", "path": "/0", "value": 5}])
+        except JsonPatchError:
+            pass
+        else:
+            assert False, "patch should have failed"
+        assert jsonnode.get_data() == ["a", "b", "c"]
+        assert jsonnode.is_saved()
@@ -0,0 +1,87 @@
+import json
+import os
+import shutil
+import tempfile
+
+from jsonwidget.jsonnode import JsonNode
+from jsonwidget.schema import SchemaNode
+from jsonwidget.jsonscan import find_pointer_span, JsonScanError
+
+class TestJsonScan:
+    def setup(self):
+        self.schemastring = """
+            {
+                "type": "map",
+                "mapping": {
+                    "name": {"type": "str"},
+                    "items": {
+                        "type": "seq",
+                        "sequence": [{"type": "any"}]
+                    }
+                }
+            }
+            """
+        self.text = ('{"name": "a \\" ] } [", "items" : ["x", "y", ' +
+                     '{"z": [1, 2]}, "w"], "after": null}\n')
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, "test.json")
+        with open(self.filename, 'w') as f:
+            f.write(self.text)
+
+    def teardown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_find(self):
+        data = json.loads(self.text)
+        for pointer, value in [("", data), ("/name", data['name']),
+                               ("/items", data['items']),
+                               ("/items/2/z/1", 2), ("/items/3", "w")]:
+            start, end = find_pointer_span(self.text, pointer)
+            assert json.loads(self.text[start:end]) == value
+        for pointer in ["/missing", "/items/4", "/items/x", "/name/0"]:
+            try:
+                find_pointer_span(self.text, pointer)
+            except JsonScanError:
+                pass
+            else:
+                assert False, "%s shouldn't be found" % pointer
+
+    def test_save_subtree(self):
+        schemanode = SchemaNode(string=self.schemastring)
+        itemschema = schemanode.get_descendant(["items"])
+        jsonnode = JsonNode(filename=self.filename, schemanode=itemschema,
+                            pointer="/items")
+        assert jsonnode.get_data() == ["x", "y", {"z": [1, 2]}, "w"]
+        jsonnode.get_child(1).set_data("changed")
+        jsonnode.save_to_file()
+        with open(self.filename) as f:
+            text = f.read()
+        assert text == self.text.replace('"y"', '"changed"')
+
+    def test_save_subtree_changed_source(self):
+        schemanode = SchemaNode(string=self.schemastring)
+        itemschema = schemanode.get_descendant(["items"])
+        jsonnode = JsonNode(filename=self.filename, schemanode=itemschema,
+                            pointer="/items")
+        jsonnode.get_child(1).set_data("changed")
+        jsonnode.save_to_file()
+        # the file changes behind the tree's back
+        with open(self.filename, 'w') as f:
+            f.write('{"before": [1, 2, 3],\n' + self.text[1:])
+        jsonnode.get_child(0).set_data("again")
+        jsonnode.save_to_file()
+        with open(self.filename) as f:
+            data = json.load(f)
+        assert data['before'] == [1, 2, 3]
+        assert data['name'] == 'a " ] } ['
+        assert data['items'] == ["again", "changed", {"z": [1, 2]}, "w"]
+        assert data['after'] is None
+        # saved under a new name, the rest of the document comes along
+        otherfile = os.path.join(self.tempdir, "other.json")
+        jsonnode.get_child(3).set_data("new")
+        os.utime(self.filename, (0, 0))
+        jsonnode.save_to_file(otherfile)
+        with open(otherfile) as f:
+            otherdata = json.load(f)
+        data['items'][3] = "new"
+        assert otherdata == data
@@ -0,0 +1,53 @@
+from jsonwidget.jsonnode import JsonNode
+from jsonwidget.schema import SchemaNode
+from jsonwidget.jsonsearch import SearchIndex
+
+class TestSearchIndex:
+    def setup(self):
+        self.schemastring = """
+            {
+                "type": "seq",
+                "sequence": [
+                    {
+                        "type": "map",
+                        "mapping": {
+                            "name": {"type": "str"},
+                            "age": {"type": "int"}
+                        }
+                    }
+                ]
+            }
+            """
+        self.data = [{"name": "Alice Smith", "age": 30},
+                     {"name": "Bob Smithers", "age": 41}]
+
+    def get_pointers(self, nodes):
+        return [node.get_pointer() for node in nodes]
+
+    def test_search(self):
+        schemanode = SchemaNode(string=self.schemastring)
+        jsonnode = JsonNode(data=self.data, schemanode=schemanode)
+        index = SearchIndex(jsonnode)
+        assert self.get_pointers(index.search("smi")) == ["/0/name",
+                                                          "/1/name"]
+        assert self.get_pointers(index.search("smith al")) == ["/0/name"]
+        assert self.get_pointers(index.search("41")) == ["/1/age"]
+        assert len(index.search("nam")) == 2
+        assert self.get_pointers(index.search("/1/a")) == ["/1/age"]
+        assert index.search("/5/a") == []
+        # the search wraps around after the last match
+        position = index.get_position(jsonnode.get_node_by_pointer("/1/age"))
+        assert index.find("smi", position)[0] == 0
+        assert index.find("smi", position, reverse=True)[0] == 1
+
+    def test_updates(self):
+        schemanode = SchemaNode(string=self.schemastring)
+        jsonnode = JsonNode(data=self.data, schemanode=schemanode)
+        index = SearchIndex(jsonnode)
+        index.build()
+        jsonnode.get_node_by_pointer("/0/name").set_data("Carol Jones")
+        assert self.get_pointers(index.search("smi")) == ["/1/name"]
+        assert self.get_pointers(index.search("carol")) == ["/0/name"]
+        jsonnode.delete_child(0)
+        assert index.search("carol") == []
+        assert self.get_pointers(index.search("smi")) == ["/0/name"]
@@ -17,3 +17,11 @@ class TestSchemaArray:
         schemanode = SchemaNode(string=self.schemastring)
         assert schemanode.is_type('array')
 
+
+    def test_dump_matches_dumps(self):
+        from StringIO import StringIO
+        schemanode = SchemaNode(string=self.schemastring)
+        out = StringIO()
+        schemanode.dump(out)
+        assert out.getvalue() == schemanode.dumps()
+        assert '"sequence": [' in out.getvalue()
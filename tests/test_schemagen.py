@@ -0,0 +1,93 @@
+import os
+import tempfile
+
+from jsonwidget.schemagen import infer_schema, merge_partial_schemas, \
+    read_ndjson_range, generate_schema_from_sources, fill_unknown_types
+from jsonwidget.jsontypes import schemaformat_v1, get_json_type
+
+class TestSchemaGen:
+    def setup(self):
+        self.docs = [{"a": 1, "b": [1, 2]},
+                     {"a": 1.5, "c": None},
+                     {"b": [], "c": "x"}]
+
+    def test_merge_associative(self):
+        a, b, c = [infer_schema(doc) for doc in self.docs]
+        left = merge_partial_schemas(merge_partial_schemas(a, b), c)
+        right = merge_partial_schemas(a, merge_partial_schemas(b, c))
+        assert left == right
+        props = left[0]['mapping']
+        assert props['a']['type'] == 'number'
+        assert props['b']['sequence'][0]['type'] == 'int'
+        # null in one document and a string in another
+        assert props['c']['type'] == 'any'
+        assert left[1]['children']['mapping']['keys'] == ['a', 'b', 'c']
+
+    def check_valid(self, data, schema):
+        fmt = schemaformat_v1
+        jsontype = get_json_type(data, fmt=fmt)
+        if schema['type'] == 'any':
+            return
+        if jsontype == 'int' and schema['type'] == 'number':
+            return
+        assert jsontype == schema['type'], (data, schema)
+        if jsontype == 'map':
+            for key, value in data.items():
+                self.check_valid(value, schema['mapping'][key])
+        elif jsontype == 'seq':
+            for value in data:
+                self.check_valid(value, schema['sequence'][0])
+
+    def test_merged_schema_accepts_inputs(self):
+        docs = self.docs + [{"b": [None, 3]}, {"c": None, "d": []}]
+        merged = None
+        for doc in docs:
+            merged = merge_partial_schemas(merged, infer_schema(doc))
+        fill_unknown_types(merged[0])
+        for doc in docs:
+            self.check_valid(doc, merged[0])
+        assert merged[0]['mapping']['d']['sequence'][0]['type'] == 'any'
+
+    def test_ndjson_shards(self):
+        fd, filename = tempfile.mkstemp(suffix='.ndjson')
+        lines = ['{"n": %i}\n' % i for i in range(50)]
+        os.write(fd, "".join(lines))
+        os.close(fd)
+        try:
+            seen = []
+            size = os.path.getsize(filename)
+            for start in range(0, size, 17):
+                seen.extend(read_ndjson_range(filename, start, start + 17))
+            assert seen == lines
+            schemanode = generate_schema_from_sources([filename], jobs=1,
+                                                      ndjson=True)
+            assert schemanode.get_child('n').is_type('integer')
+        finally:
+            os.unlink(filename)
+
+    def test_reservoir_sample(self):
+        import random
+        from jsonwidget.schemagen import reservoir_sample, KeyCoverage
+        lines = ['{"n": %i}\n' % i for i in range(1000)]
+        sample, seen, bytesread = reservoir_sample(lines, size=10,
+                                                   rng=random.Random(1))
+        assert len(sample) == 10
+        assert seen == 1000
+        assert len(set(sample)) == 10
+        sample, seen, bytesread = reservoir_sample(lines, bytebudget=100)
+        assert bytesread <= 100
+        assert sample == lines[:len(sample)]
+        coverage = KeyCoverage()
+        for doc in self.docs:
+            coverage.add(doc)
+        assert coverage.objects['/'] == 3
+        assert coverage.get_key_counts('/') == [('a', 2), ('b', 2), ('c', 2)]
+
+    def test_coverage_paths(self):
+        from jsonwidget.schemagen import KeyCoverage
+        coverage = KeyCoverage()
+        coverage.add({"a/b": {"x": 1}, "c~d": [{"y": 2}], u"\xe9": {"z": 3}})
+        assert coverage.get_locations() == ['/', '/a~1b', '/c~0d/*', 
+                                            u'/\xe9']
+        report = coverage.format_report(encoding='ascii')
+        assert '/\\xe9: 1 objects' in report
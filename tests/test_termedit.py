@@ -1,8 +1,11 @@
+import json
+
 from dingus import Dingus, returner
 
 from jsonwidget.jsonnode import JsonNode, JsonNodeError
 from jsonwidget.schema import SchemaNode
-from jsonwidget.termwidgets import JsonWidgetParent
+from jsonwidget.termwidgets import JsonWidgetParent, JsonFrame, EnumPicker
+from jsonwidget.treetools import NodeCache
 
 class TestJsonWidgetParent:
     def setup(self):
@@ -36,3 +39,176 @@ class TestJsonWidgetParent:
             wval = termparent.get_child_node(i).get_widget().get_value_text()
             assert v == wval
 
+
+    def test_direct_edits_update_cached_nodes(self):
+        indata = ["thing1", "thing2", "thing3"]
+        schemanode = SchemaNode(string=self.schemastring)
+        jsonnode = JsonNode(data=indata, schemanode=schemanode)
+        termparent = JsonWidgetParent(jsonnode)
+        thing3 = termparent.get_child_node(2)
+        jsonnode.delete_child(0)
+        assert termparent.get_child_node(1) is thing3
+        assert thing3.get_key() == 1
+        jsonnode.get_child(1).set_data("changed")
+        assert thing3.get_widget().get_value_text() == 'changed'
+
+    def test_node_cache(self):
+        self.check_node_cache()
+
+    def test_node_cache_without_ordereddict(self):
+        # as on Python 2.6
+        import jsonwidget.treetools
+        ordereddict = jsonwidget.treetools.OrderedDict
+        jsonwidget.treetools.OrderedDict = None
+        try:
+            self.check_node_cache()
+        finally:
+            jsonwidget.treetools.OrderedDict = ordereddict
+
+    def check_node_cache(self):
+        indata = ["thing%i" % i for i in range(20)]
+        schemanode = SchemaNode(string=self.schemastring)
+        jsonnode = JsonNode(data=indata, schemanode=schemanode)
+        termparent = JsonWidgetParent(jsonnode)
+        cache = NodeCache(maxsize=5)
+        termparent.set_node_cache(cache)
+        first = termparent.get_child_node(0)
+        cache.set_focus(first)
+        for i in range(20):
+            termparent.get_child_node(i)
+        assert len(termparent._children) == 5
+        assert termparent.get_child_node(0) is first
+        assert termparent.get_child_node(3).get_widget().get_value_text() == \
+            'thing3'
+        jsonnode.get_child(19).set_data("changed")
+        assert termparent.get_child_node(19).get_widget().get_value_text() == \
+            'changed'
+
+    def test_sibling_navigation(self):
+        indata = ["thing1", "thing2", "thing3"]
+        schemanode = SchemaNode(string=self.schemastring)
+        jsonnode = JsonNode(data=indata, schemanode=schemanode)
+        termparent = JsonWidgetParent(jsonnode)
+        assert termparent.next_child(0).get_key() == 1
+        jsonnode.insert_child(1)
+        jsonnode.get_child(1).set_data("new")
+        assert termparent.get_child_index(2) == 2
+        nextnode = termparent.next_child(0)
+        assert nextnode.get_widget().get_value_text() == 'new'
+        assert termparent.prev_child(1).get_key() == 0
+
+    def test_last_descendant(self):
+        schemastring = """
+            {"type": "seq", "sequence": [{"type": "map", "mapping": {
+                "a": {"type": "seq", "sequence": [{"type": "str"}]}}}]}
+            """
+        schemanode = SchemaNode(string=schemastring)
+        jsonnode = JsonNode(data=[{"a": ["x"]}], schemanode=schemanode)
+        termparent = JsonWidgetParent(jsonnode)
+        item = termparent.get_child_node(0)
+        array = item.get_child_node('a')
+        assert item.get_last_descendant().get_key() == array._fieldaddkey
+        array.get_widget().set_expanded(False)
+        assert item.get_last_descendant() is array
+        jsonnode.get_child(0).get_child('a').insert_child(0)
+        array.get_widget().set_expanded(True)
+        assert item.get_last_descendant().get_key() == array._fieldaddkey
+        assert termparent.get_last_descendant() is termparent.get_last_child()
+
+    def test_array_pages(self):
+        indata = ["thing%i" % i for i in range(2500)]
+        schemanode = SchemaNode(string=self.schemastring)
+        jsonnode = JsonNode(data=indata, schemanode=schemanode)
+        termparent = JsonWidgetParent(jsonnode)
+        pagekeys = termparent.get_child_keys()[:-1]
+        assert [key.start for key in pagekeys] == [0, 1000, 2000]
+        item = termparent.get_child_node(1999)
+        assert item.get_parent().get_key() == pagekeys[1]
+        assert item.get_parent().get_range() == (1000, 2000)
+        jsonnode.insert_child(0)
+        assert termparent.get_child_node(2000) is item
+        assert item.get_parent().get_key() == pagekeys[2]
+        for i in range(1501):
+            jsonnode.delete_child(0)
+        assert termparent.get_child_keys()[0] == 0
+        assert termparent.get_child_node(998).get_value().get_data() == \
+            'thing2498'
+
+    def test_collapse(self):
+        schemastring = """
+            {"type": "seq", "sequence": [{"type": "seq", 
+                                          "sequence": [{"type": "str"}]}]}
+            """
+        schemanode = SchemaNode(string=schemastring)
+        jsonnode = JsonNode(data=[["a", "b"], ["c"]], schemanode=schemanode)
+        termparent = JsonWidgetParent(jsonnode, collapse_depth=1)
+        assert termparent.get_widget().expanded
+        widget = termparent.get_child_node(0).get_widget()
+        assert not widget.expanded
+        assert widget.get_display_text().endswith("(2 items)")
+        jsonnode.get_child(0).delete_child(0)
+        assert widget.get_display_text().endswith("(1 item)")
+        # going to a node shows it
+        treenode = termparent.get_tree_node(jsonnode.get_child(1).get_child(0))
+        assert treenode.get_parent().get_widget().expanded
+        termparent = JsonWidgetParent(jsonnode, collapse_size=1)
+        assert not termparent.get_widget().expanded
+        assert termparent.get_child_node(0).get_widget().expanded
+
+    def test_buffered_edits(self):
+        schemanode = SchemaNode(string=self.schemastring)
+        jsonnode = JsonNode(data=["thing1", "thing2"], schemanode=schemanode)
+        frame = JsonFrame(jsonnode, buffer_edits=True)
+        treenode = frame.get_tree_node(jsonnode.get_child(0))
+        treenode.get_widget().get_w().keypress((20,), 'x')
+        assert treenode.get_widget().get_value_text() == 'thing1'
+        assert frame.has_pending_edit()
+        assert jsonnode.get_data() == ["thing1", "thing2"]
+        # typing into another field stores the first one
+        othernode = frame.get_tree_node(jsonnode.get_child(1))
+        othernode.get_widget().get_w().keypress((20,), 'y')
+        assert jsonnode.get_data() == ["thing1x", "thing2"]
+        frame.commit_pending_edit()
+        assert not frame.has_pending_edit()
+        assert jsonnode.get_data() == ["thing1x", "thing2y"]
+
+    def test_enum_picker(self):
+        options = ["opt%03i" % i for i in range(200)] + ["Other"]
+        schemastring = ('{"type": "seq", "sequence": [{"type": "str", ' +
+                        '"enum": %s}]}' % json.dumps(options))
+        schemanode = SchemaNode(string=schemastring)
+        jsonnode = JsonNode(data=["opt005"], schemanode=schemanode)
+        termparent = JsonWidgetParent(jsonnode)
+        picker = termparent.get_child_node(0).get_widget().get_w()
+        while not isinstance(picker, EnumPicker):
+            picker = picker.get_focus()
+        picker.keypress((30,), 'enter')
+        assert picker.is_open()
+        assert len(picker.render((30,)).text) == 1 + picker._height
+        for key in "opt1":
+            picker.keypress((30,), key)
+        picker.keypress((30,), 'down')
+        picker.keypress((30,), 'enter')
+        assert not picker.is_open()
+        assert jsonnode.get_data() == ["opt101"]
+        picker.keypress((30,), 'enter')
+        for key in "oth":
+            picker.keypress((30,), key)
+        picker.keypress((30,), 'enter')
+        assert jsonnode.get_data() == ["Other"]
+
+    def test_field_add_choices(self):
+        schemanode = SchemaNode(string=self.schemastring)
+        jsonnode = JsonNode(data=["thing1", "thing2"], schemanode=schemanode)
+        termparent = JsonWidgetParent(jsonnode)
+        choices = termparent.get_field_add_choices()
+        assert [key for key, title in choices] == [2]
+        assert termparent.get_field_add_choices() is choices
+        maxlen = termparent.get_title_max_length()
+        jsonnode.add_child(2)
+        assert [key for key, title in termparent.get_field_add_choices()] \
+            == [3]
+        assert termparent.get_title_max_length() == maxlen
+        for i in range(3, 10):
+            jsonnode.add_child(i)
+        assert termparent.get_title_max_length() == maxlen + 1
@@ -0,0 +1,85 @@
+from jsonwidget.jsonnode import JsonNode
+from jsonwidget.schema import SchemaNode
+from jsonwidget.undo import EditHistory, UndoError
+
+class TestEditHistory:
+    def setup(self):
+        self.schemastring = """
+            {
+                "type": "seq",
+                "sequence": [
+                    {
+                        "type": "str"
+                    }
+                ]
+            }
+            """
+
+    def test_undo_redo(self):
+        indata = ["thing1", "thing2", "thing3"]
+        schemanode = SchemaNode(string=self.schemastring)
+        jsonnode = JsonNode(data=indata, schemanode=schemanode)
+        jsonnode.set_history(EditHistory(mergeinterval=0))
+        thing2 = jsonnode.get_child(1)
+        jsonnode.insert_child(1)
+        jsonnode.get_child(1).set_data('new')
+        jsonnode.delete_child(2)
+        assert jsonnode.get_data() == ['thing1', 'new', 'thing3']
+
+        focus = jsonnode.undo()
+        assert focus is thing2
+        assert jsonnode.get_child(2) is thing2
+        assert jsonnode.get_data() == ['thing1', 'new', 'thing2', 'thing3']
+        jsonnode.undo()
+        jsonnode.undo()
+        assert jsonnode.get_data() == ['thing1', 'thing2', 'thing3']
+        assert [c.get_key() for c in jsonnode.get_children()] == [0, 1, 2]
+
+        jsonnode.redo()
+        jsonnode.redo()
+        jsonnode.redo()
+        assert jsonnode.get_data() == ['thing1', 'new', 'thing3']
+        try:
+            jsonnode.redo()
+        except UndoError:
+            pass
+        else:
+            assert False, "redo past the end should fail"
+
+    def test_merge_typing(self):
+        schemanode = SchemaNode(string=self.schemastring)
+        jsonnode = JsonNode(data=["a"], schemanode=schemanode)
+        jsonnode.set_history(EditHistory(mergeinterval=60))
+        for text in ["ab", "abc", "abcd"]:
+            jsonnode.get_child(0).set_data(text)
+        jsonnode.undo()
+        assert jsonnode.get_data() == ["a"]
+
+    def test_replaced_container(self):
+        import json
+        import os
+        import tempfile
+        import jsonwidget
+        fd, filename = tempfile.mkstemp(suffix='.json')
+        os.write(fd, '{"a": {"x": 1}}')
+        os.close(fd)
+        try:
+            schemafile = jsonwidget.find_system_schema("openschema.json")
+            jsonnode = JsonNode(filename=filename, schemafile=schemafile)
+            jsonnode.set_history(EditHistory(mergeinterval=0))
+            # replacing "a" builds a new node for "x"
+            jsonnode.get_child('a').set_data({"x": 2})
+            jsonnode.get_child('a').get_child('x').set_data(3)
+            jsonnode.undo()
+            jsonnode.undo()
+            assert jsonnode.get_data() == {"a": {"x": 1}}
+            jsonnode.redo()
+            focus = jsonnode.redo()
+            assert focus is jsonnode.get_child('a').get_child('x')
+            assert focus.get_data() == 3
+            assert jsonnode.get_data() == {"a": {"x": 3}}
+            jsonnode.save_to_file()
+            with open(filename) as f:
+                assert json.load(f) == {"a": {"x": 3}}
+        finally:
+            os.remove(filename)